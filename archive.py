@@ -0,0 +1,244 @@
+import os
+import gzip
+import zlib
+import json
+import struct
+import logging
+from dataclasses import dataclass
+from threading import Thread, Lock, Event
+from time import monotonic
+from typing import List, Dict, Tuple, Optional
+from metrics import storage_sync_seconds
+
+
+@dataclass(frozen=True)
+class TierConfig:
+    name: str
+    resolution_sec: int
+    segment_sec: int       # time span covered by a segment file. Multiple of resolution_sec
+    retention_sec: int
+    append_records: bool = False    # each completed bucket is appended to the segment file instead of buffering the segment
+
+
+# the coarse tiers cover days to weeks per segment. Their buckets are rare, so they are written as they complete
+DEFAULT_TIERS = [TierConfig("1s", 1, 15 * 60, 2 * 24 * 60 * 60),
+                 TierConfig("1m", 60, 24 * 60 * 60, 90 * 24 * 60 * 60, append_records=True),
+                 TierConfig("15m", 15 * 60, 7 * 24 * 60 * 60, 2 * 366 * 24 * 60 * 60, append_records=True),
+                 TierConfig("1h", 60 * 60, 30 * 24 * 60 * 60, 10 * 366 * 24 * 60 * 60, append_records=True)]
+
+
+class Tier:
+
+    # Samples are averaged per resolution bucket and buffered in memory. The buffer is written once per segment as a
+    # gzip compressed file of fixed-width records (uint32 epoch sec, float32 per series), to keep writes on SD cards rare.
+    # A tier appending its records writes each completed bucket as a further gzip member of the segment file instead
+
+    def __init__(self, directory: str, config: TierConfig, series: List[str]):
+        self.config = config
+        self.__series = series
+        self.__record = struct.Struct("<I" + "f" * len(series))
+        self.__directory = os.path.join(directory, config.name)
+        os.makedirs(self.__directory, exist_ok=True)
+        self.__segment = -1
+        self.__records: List[Tuple[int, Tuple[float, ...]]] = list()
+        self.__bucket = -1
+        self.__sums = [0.0] * len(series)
+        self.__count = 0
+
+    def add(self, epoch_sec: int, values: Tuple[float, ...]) -> Optional[Tuple[int, Tuple[float, ...]]]:
+        # returns the averaged record of the bucket completed by this sample, if any
+        bucket = epoch_sec // self.config.resolution_sec
+        completed = None
+        if bucket != self.__bucket:
+            completed = self.__complete_bucket()
+            self.__bucket = bucket
+        for i in range(len(values)):
+            self.__sums[i] += values[i]
+        self.__count += 1
+        return completed
+
+    def __complete_bucket(self) -> Optional[Tuple[int, Tuple[float, ...]]]:
+        if self.__count == 0:
+            return None
+        record = (self.__bucket * self.config.resolution_sec, tuple([value / self.__count for value in self.__sums]))
+        self.__sums = [0.0] * len(self.__series)
+        self.__count = 0
+        segment = record[0] // self.config.segment_sec
+        if segment != self.__segment:
+            self.flush()
+            self.__segment = segment
+            if self.config.append_records:
+                self.__open_segment(segment)
+        if self.config.append_records:
+            self.__append(record)
+        else:
+            self.__records.append(record)
+        return record
+
+    def __header(self) -> bytes:
+        return json.dumps({"series": self.__series, "resolution_sec": self.config.resolution_sec}).encode("UTF-8") + b"\n"
+
+    def __open_segment(self, segment: int):
+        # a segment file of a former run is continued, unless it has been written with other series. A member torn by
+        # a power loss is cut off, otherwise the members appended behind would not be readable
+        try:
+            self.__remove_expired(segment)
+            filename = self.__filename(segment)
+            if os.path.isfile(filename):
+                data, valid_size = self.__decompress(filename)
+                if b"\n" not in data or json.loads(data[:data.index(b"\n")].decode("UTF-8"))["series"] != self.__series:
+                    logging.warning(filename + " has been written with other series. Replacing it")
+                    os.remove(filename)
+                elif valid_size < os.path.getsize(filename):
+                    logging.warning(filename + " ignoring " + str(os.path.getsize(filename) - valid_size) + " bytes of a torn record")
+                    with open(filename, "r+b") as file:
+                        file.truncate(valid_size)
+        except Exception as e:
+            logging.warning("error occurred opening archive segment of tier " + self.config.name + " " + str(e))
+
+    def __append(self, record: Tuple[int, Tuple[float, ...]]):
+        start = monotonic()
+        try:
+            filename = self.__filename(self.__segment)
+            data = self.__record.pack(record[0], *record[1])
+            if not os.path.isfile(filename):
+                data = self.__header() + data
+            with open(filename, "ab") as file:
+                file.write(gzip.compress(data))
+            storage_sync_seconds.observe(monotonic() - start, "archive_" + self.config.name)
+        except Exception as e:
+            logging.warning("error occurred appending to archive segment of tier " + self.config.name + " " + str(e))
+
+    def __filename(self, segment: int) -> str:
+        return os.path.join(self.__directory, str(segment * self.config.segment_sec) + ".seg.gz")
+
+    def flush(self):
+        if len(self.__records) == 0:
+            return
+        start = monotonic()
+        try:
+            # merge with the records written by a former run of the same segment
+            records = dict(self.__read_segment(self.__segment))
+            records.update(self.__records)
+            filename = self.__filename(self.__segment)
+            tempname = filename + ".temp"
+            with gzip.open(tempname, "wb") as file:
+                file.write(self.__header() + b"".join([self.__record.pack(epoch_sec, *values) for epoch_sec, values in sorted(records.items())]))
+            os.replace(tempname, filename)
+            self.__records = list()
+            self.__remove_expired(self.__segment)
+            storage_sync_seconds.observe(monotonic() - start, "archive_" + self.config.name)
+        except Exception as e:
+            logging.warning("error occurred writing archive segment of tier " + self.config.name + " " + str(e))
+
+    def __remove_expired(self, current_segment: int):
+        oldest_segment = current_segment - self.config.retention_sec // self.config.segment_sec
+        for filename in os.listdir(self.__directory):
+            if filename.endswith(".seg.gz") and int(filename.split(".")[0]) // self.config.segment_sec < oldest_segment:
+                os.remove(os.path.join(self.__directory, filename))
+
+    @staticmethod
+    def __decompress(filename: str) -> Tuple[bytes, int]:
+        # the gzip members of the file one after the other, plus the size of the complete members. A member torn by a
+        # power loss ends the data
+        with open(filename, "rb") as file:
+            data = file.read()
+        size = len(data)
+        chunks = list()
+        while len(data) > 0:
+            decompressor = zlib.decompressobj(wbits=31)
+            try:
+                chunk = decompressor.decompress(data)
+            except zlib.error:
+                break
+            if not decompressor.eof:
+                break
+            chunks.append(chunk)
+            data = decompressor.unused_data
+        return b"".join(chunks), size - len(data)
+
+    def __read_segment(self, segment: int) -> List[Tuple[int, Tuple[float, ...]]]:
+        filename = self.__filename(segment)
+        if not os.path.isfile(filename):
+            return []
+        data, _ = self.__decompress(filename)
+        if b"\n" not in data:
+            return []
+        header_end = data.index(b"\n")
+        header = json.loads(data[:header_end].decode("UTF-8"))
+        if header["series"] != self.__series:
+            logging.warning(filename + " has been written with other series. Ignoring it")
+            return []
+        # records appended later on replace former ones of the same bucket
+        body = data[header_end + 1:]
+        body = body[:len(body) - len(body) % self.__record.size]
+        return [(record[0], tuple(record[1:])) for record in self.__record.iter_unpack(body)]
+
+    def read(self, from_epoch_sec: int, to_epoch_sec: int) -> List[Tuple[int, Tuple[float, ...]]]:
+        records = dict()
+        for segment in range(from_epoch_sec // self.config.segment_sec, to_epoch_sec // self.config.segment_sec + 1):
+            records.update(self.__read_segment(segment))
+        records.update([record for record in self.__records if record[0] // self.config.segment_sec == self.__segment])
+        return [(epoch_sec, values) for epoch_sec, values in sorted(records.items()) if from_epoch_sec <= epoch_sec <= to_epoch_sec]
+
+
+class SampleArchive:
+
+    # An append is buffered in memory only, so the polling thread does not wait for compression and segment writes.
+    # The buffered samples are passed to the tiers by a writer thread once per write period (or on read and flush)
+
+    def __init__(self, directory: str, series: List[str], tiers: List[TierConfig] = None, write_period_sec: float = 5):
+        self.series = series
+        tiers = DEFAULT_TIERS if tiers is None else tiers
+        self.__tiers = [Tier(os.path.join(directory, "archive"), config, series) for config in tiers]
+        self.__write_period_sec = write_period_sec
+        self.__buffer_lock = Lock()
+        self.__buffer: List[Tuple[int, Tuple[float, ...]]] = list()
+        self.__tiers_lock = Lock()
+        self.__stopped = Event()
+        self.__writer_thread = Thread(target=self.__write_loop, daemon=True)
+        self.__writer_thread.start()
+
+    def append(self, epoch_sec: float, values: Dict[str, float]):
+        record = (int(epoch_sec), tuple([float(values.get(name, 0)) for name in self.series]))
+        with self.__buffer_lock:
+            self.__buffer.append(record)
+
+    def write(self):
+        # passes the buffered samples to the tiers. Each completed bucket of a tier is the input of the next (coarser) tier
+        with self.__tiers_lock:
+            with self.__buffer_lock:
+                buffer = self.__buffer
+                self.__buffer = list()
+            for sample in buffer:
+                record: Optional[Tuple[int, Tuple[float, ...]]] = sample
+                for tier in self.__tiers:
+                    record = tier.add(*record)
+                    if record is None:
+                        break
+
+    def __write_loop(self):
+        while not self.__stopped.wait(self.__write_period_sec):
+            try:
+                self.write()
+            except Exception as e:
+                logging.warning("error occurred writing the archive " + str(e))
+
+    def read(self, tier_name: str, from_epoch_sec: int, to_epoch_sec: int) -> List[Tuple[int, Dict[str, float]]]:
+        self.write()
+        with self.__tiers_lock:
+            for tier in self.__tiers:
+                if tier.config.name == tier_name:
+                    return [(epoch_sec, dict(zip(self.series, values))) for epoch_sec, values in tier.read(from_epoch_sec, to_epoch_sec)]
+        raise ValueError("unknown tier " + tier_name)
+
+    def flush(self):
+        self.write()
+        with self.__tiers_lock:
+            for tier in self.__tiers:
+                tier.flush()
+
+    def close(self):
+        self.__stopped.set()
+        self.__writer_thread.join()
+        self.flush()
@@ -0,0 +1,155 @@
+import sys
+import argparse
+import tracemalloc
+from datetime import datetime, timedelta
+from time import perf_counter
+from typing import List, Tuple
+from energy import WattRecorder
+from replay import VirtualClock
+from timebase import timebase
+
+
+# Micro-benchmark of WattRecorder against the former implementation (a list of (datetime, watt) tuples scanned
+# backwards per query). A virtual clock fills the history without waiting, e.g.
+#   python bench_wattrecorder.py compare --minutes 65 --hz 1
+#   python bench_wattrecorder.py rates --hz 1 10 100
+
+
+WINDOWS = [5, 15, 60, 3 * 60, 5 * 60]    # seconds, as requested per publish run
+
+
+class LegacyWattRecorder:
+
+    # the former implementation. The wall clock is read by using the timebase, so it follows the virtual clock
+
+    def __init__(self, max_size_minutes: int = 65):
+        self.__max_size_minutes = max_size_minutes
+        self.__minute_measures: List[Tuple[datetime, float]] = list()
+
+    @property
+    def size(self) -> int:
+        return len(self.__minute_measures)
+
+    def __utcnow(self) -> datetime:
+        return datetime.utcfromtimestamp(timebase.epoch())
+
+    def put(self, measure: float):
+        if len(self.__minute_measures) == 0 or measure != self.__minute_measures[-1][1]:
+            self.__minute_measures.append((self.__utcnow(), measure))
+            self.__compact()
+
+    def __compact(self):
+        max_datetime = self.__utcnow() - timedelta(minutes=self.__max_size_minutes)
+        num_elements = len(self.__minute_measures)
+        for i in range(num_elements):
+            if self.__minute_measures[0][0] < max_datetime:
+                del self.__minute_measures[0]
+            else:
+                return
+
+    def watt_per_hour(self, minute_range: int = None, second_range: int = 60) -> int:
+        now = self.__utcnow()
+        if minute_range is not None:
+            second_range = minute_range * 60
+        offset = now - timedelta(seconds=second_range)
+
+        watt_sec = 0
+        for measure in reversed(self.__minute_measures):
+            start_time = measure[0]
+            watt = measure[1]
+            if start_time < offset:
+                start_time = offset
+            elapsed_seconds = (now - start_time).total_seconds()
+            watt_sec += watt * elapsed_seconds
+            now = start_time
+            if start_time == offset:
+                break
+        return int(watt_sec / second_range)
+
+
+def fill(recorder, clock: VirtualClock, minutes: float, hz: float) -> float:
+    # puts a changing measure at the given rate. Returns the mean put duration (sec)
+    num_puts = int(minutes * 60 * hz)
+    elapsed = 0.0
+    for num in range(num_puts):
+        clock.advance(1 / hz)
+        start = perf_counter()
+        recorder.put(250 + num % 97)
+        elapsed += perf_counter() - start
+    return elapsed / max(1, num_puts)
+
+
+def query(recorder, rounds: int) -> Tuple[float, List[int]]:
+    # mean duration (sec) of a query set covering all windows, plus the values of the last set
+    start = perf_counter()
+    values = list()
+    for _ in range(rounds):
+        values = [recorder.watt_per_hour(second_range=second_range) for second_range in WINDOWS]
+    return (perf_counter() - start) / rounds, values
+
+
+def compare(minutes: float, hz: float, rounds: int) -> List[str]:
+    clock = VirtualClock(datetime(2026, 6, 1).timestamp())
+    timebase.set_clock(clock)
+    legacy = LegacyWattRecorder()
+    recorder = WattRecorder()
+    num_puts = int(minutes * 60 * hz)
+    for num in range(num_puts):
+        clock.advance(1 / hz)
+        legacy.put(250 + num % 97)
+        recorder.put(250 + num % 97)
+    legacy_duration, legacy_values = query(legacy, rounds)
+    duration, values = query(recorder, rounds)
+    deviation = max([abs(value - legacy_value) for value, legacy_value in zip(values, legacy_values)])
+    return [str(round(minutes)) + " min history at " + str(hz) + "Hz (" + str(recorder.size) + " measures), windows " + ", ".join([str(window) + "s" for window in WINDOWS]),
+            "legacy:       " + str(round(legacy_duration * 1000000, 1)) + "us per query set",
+            "WattRecorder: " + str(round(duration * 1000000, 1)) + "us per query set",
+            "max deviation " + str(deviation) + "W (int truncation)"]
+
+
+def rates(minutes: float, rates_hz: List[float]) -> List[str]:
+    # memory held by a filled recorder and the mean put duration per sampling rate
+    lines = [str(round(minutes)) + " min history"]
+    for hz in rates_hz:
+        results = list()
+        for recorder_type in [LegacyWattRecorder, WattRecorder]:
+            # tracing slows down the puts. So the memory is measured by a second run
+            clock = VirtualClock(datetime(2026, 6, 1).timestamp())
+            timebase.set_clock(clock)
+            recorder = recorder_type()
+            fill(recorder, clock, minutes, hz)
+            # steady state, the expired measures are evicted by the puts
+            put_duration = fill(recorder, clock, 5, hz)
+            clock = VirtualClock(datetime(2026, 6, 1).timestamp())
+            timebase.set_clock(clock)
+            tracemalloc.start()
+            recorder = recorder_type()
+            fill(recorder, clock, minutes, hz)
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            results.append((memory, put_duration))
+        (legacy_memory, legacy_put), (memory, put) = results
+        lines.append(str(hz) + "Hz: " + str(round(legacy_memory / 1024 / 1024, 2)) + "MB -> " + str(round(memory / 1024 / 1024, 2)) + "MB, put " +
+                     str(round(legacy_put * 1000000, 1)) + "us -> " + str(round(put * 1000000, 1)) + "us")
+    return lines
+
+
+def main(argv: List[str]):
+    parser = argparse.ArgumentParser(description="benchmarks the WattRecorder")
+    commands = parser.add_subparsers(dest="command", required=True)
+    compare_parser = commands.add_parser("compare", help="query cost compared with the former implementation")
+    compare_parser.add_argument("--minutes", type=float, default=65, help="history filled before querying")
+    compare_parser.add_argument("--hz", type=float, default=1.0, help="sampling rate")
+    compare_parser.add_argument("--rounds", type=int, default=1000, help="query sets measured")
+    rates_parser = commands.add_parser("rates", help="memory and put duration per sampling rate compared with the former implementation")
+    rates_parser.add_argument("--minutes", type=float, default=65, help="history filled")
+    rates_parser.add_argument("--hz", type=float, nargs="+", default=[1.0, 10.0, 100.0], help="sampling rates")
+    args = parser.parse_args(argv)
+
+    lines = compare(args.minutes, args.hz, args.rounds) if args.command == "compare" else rates(args.minutes, args.hz)
+    for line in lines:
+        print(line)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
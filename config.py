@@ -0,0 +1,60 @@
+import json
+from dataclasses import dataclass, field, fields
+from typing import List, Dict, Any
+
+
+# pv_channel1u2 is the sum of channel 1 & 2, pv_channel1u2u3 the sum of channel 1 & 2 & 3
+DEFAULT_DERIVED = {"pv_channel1u2": [1, 2], "pv_channel1u2u3": [1, 2, 3]}
+
+
+@dataclass
+class SiteConfig:
+    name: str
+    provider: str
+    pv: str
+    pv_channels: List[str] = field(default_factory=list)
+    min_pv_power: int = 400
+    description: str = "description"
+    derived: Dict[str, List[int]] = field(default_factory=lambda: dict(DEFAULT_DERIVED))
+    pv_peek_window_days: int = 30
+    loads: List[Dict[str, Any]] = field(default_factory=list)     # load control rules, see control.LoadRule
+
+
+@dataclass
+class Config:
+    port: int
+    directory: str
+    sites: List[SiteConfig]
+    ingestion: str = "poll"
+    push_window_sec: float = 0.25
+    push_min_interval_sec: float = 0    # min time between two websocket messages to a client
+    push_deadband: float = 0            # numeric changes up to this value are not pushed to a client
+    lazy_properties: bool = False     # compute the derived properties on read, as long as there is no websocket subscriber
+
+
+def load_config(filename: str) -> Config:
+    # e.g.
+    # {
+    #   "port": 8343,
+    #   "directory": "/etc/energy",
+    #   "sites": [
+    #     {"name": "house", "provider": "http://10.1.11.92", "pv": "http://10.1.11.91", "pv_channels": ["http://10.1.11.93", "http://10.1.11.94"], "min_pv_power": 400},
+    #     {"name": "garage", "provider": "http://10.1.12.92", "pv": "http://10.1.12.91", "derived": {},
+    #      "loads": [{"name": "heater", "relay": "http://10.1.12.95", "on_watt": 2200, "off_watt": 0, "min_on_sec": 600}]}
+    #   ]
+    # }
+    with open(filename, "r") as file:
+        data = json.load(file)
+    site_keys = {site_field.name for site_field in fields(SiteConfig)}
+    sites = list()
+    for num, site in enumerate(data.pop("sites", [])):
+        for key in site.keys():
+            if key not in site_keys:
+                raise ValueError(filename + " contains the unknown key " + key + " in site " + str(site.get("name", num + 1)) + " (supported: " + ", ".join(sorted(site_keys)) + ")")
+        sites.append(SiteConfig(**site))
+    if len(sites) == 0:
+        raise ValueError(filename + " does not define any site")
+    names = [site.name for site in sites]
+    if len(set(names)) != len(names):
+        raise ValueError(filename + " contains duplicated site names " + ", ".join(names))
+    return Config(sites=sites, **data)
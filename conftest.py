@@ -0,0 +1,20 @@
+import pytest
+from datetime import datetime, timezone
+from typing import Callable
+from replay import VirtualClock
+from timebase import timebase, Clock
+
+
+@pytest.fixture
+def use_clock() -> Callable[[Clock], Clock]:
+    # installs a clock as clock of the timebase. The system clock is restored afterwards
+    def install(clock: Clock) -> Clock:
+        timebase.set_clock(clock)
+        return clock
+    yield install
+    timebase.set_clock(Clock())
+
+
+@pytest.fixture
+def clock(use_clock) -> VirtualClock:
+    return use_clock(VirtualClock(datetime(2026, 6, 1, 12, tzinfo=timezone.utc).timestamp()))
@@ -0,0 +1,173 @@
+import sys
+import logging
+import argparse
+import tempfile
+from time import monotonic
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import List, Dict, Optional, Tuple
+from energy import Energy, Snapshot
+from shelly import ShellySwitch
+from timebase import timebase
+from metrics import registry
+
+
+control_reaction_seconds = registry.histogram("control_reaction_seconds", "duration from receiving a sample to the switching decision", ("load",), (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+control_switches = registry.counter("control_switches_total", "switching decisions", ("load", "state"))
+control_switch_seconds = registry.histogram("control_switch_seconds", "duration of the switching requests to the relays", ("load",))
+control_switch_failures = registry.counter("control_switch_failures_total", "failed switching requests", ("load",))
+
+
+@dataclass(frozen=True)
+class LoadRule:
+    name: str
+    relay: str                                  # address of the shelly relay switching the load
+    switch_id: int = 0
+    signal: str = "pv_surplus_power_15s"        # Energy property the thresholds apply to
+    on_watt: int = 1500                         # switch on, if the signal reaches this value
+    off_watt: int = 0                           # switch off, if the signal falls to this value (hysteresis). The surplus is 0 while importing
+    min_on_sec: float = 5 * 60
+    min_off_sec: float = 5 * 60
+
+
+class Relay(ABC):
+
+    @abstractmethod
+    def switch(self, on: bool):
+        pass
+
+
+class ShellyRelay(Relay):
+
+    def __init__(self, addr: str, switch_id: int = 0):
+        self.__switch = ShellySwitch(addr, switch_id)
+
+    def switch(self, on: bool):
+        self.__switch.switch(on)
+
+
+class SimulatedRelay(Relay):
+
+    # load of a simulation. While on, its power is added to the provider meter
+
+    def __init__(self, power: int):
+        self.power = power
+        self.is_on = False
+        self.switched: List[Tuple[float, bool]] = list()
+
+    def switch(self, on: bool):
+        self.is_on = on
+        self.switched.append((timebase.epoch(), on))
+
+
+class LoadController:
+
+    # Evaluates the rules on each tick of Energy (polling thread), so the switching decision follows the sample within
+    # the same call. The relays are switched asynchronously, a slow relay does not delay the polling. The loads are
+    # assumed to be off on start. While the provider is stale, the loads are switched off (fail safe)
+
+    def __init__(self, energy: Energy, rules: List[LoadRule], relays: Optional[Dict[str, Relay]] = None):
+        for rule in rules:
+            if not isinstance(getattr(Energy, rule.signal, None), property):
+                raise ValueError("rule " + rule.name + ": unknown signal " + rule.signal)
+            if rule.off_watt >= rule.on_watt:
+                raise ValueError("rule " + rule.name + ": off_watt " + str(rule.off_watt) + " is not below on_watt " + str(rule.on_watt))
+        self.__energy = energy
+        self.__rules = rules
+        self.__relays = {rule.name: ShellyRelay(rule.relay, rule.switch_id) for rule in rules} if relays is None else relays
+        now = timebase.monotonic()
+        # state per rule: is on, monotonic time of the last switch. Replaced as a whole. Changed by the polling thread and
+        # by the relay threads (revert of a failed switch)
+        self.__states_lock = Lock()
+        self.__states: Dict[str, Tuple[bool, float]] = {rule.name: (False, now - rule.min_off_sec) for rule in rules}
+        self.__executor = ThreadPoolExecutor(max_workers=max(1, len(rules)), thread_name_prefix="relay")
+        energy.add_tick_listener(self.__on_tick)
+
+    @property
+    def states(self) -> Dict[str, bool]:
+        return {name: is_on for name, (is_on, _) in self.__states.items()}
+
+    def __on_tick(self, snapshot: Snapshot):
+        now = timebase.monotonic()
+        provider_stale = self.__energy.provider_stale
+        for rule in self.__rules:
+            with self.__states_lock:
+                is_on, since = self.__states[rule.name]
+                if provider_stale:
+                    # the signal is unknown. A load is switched off regardless of min_on_sec and not switched on again
+                    if is_on:
+                        self.__switch(rule, False, now, "provider stale", snapshot)
+                    continue
+                value = getattr(self.__energy, rule.signal)
+                if not is_on and value >= rule.on_watt and now >= since + rule.min_off_sec:
+                    self.__switch(rule, True, now, rule.signal + "=" + str(value), snapshot)
+                elif is_on and value <= rule.off_watt and now >= since + rule.min_on_sec:
+                    self.__switch(rule, False, now, rule.signal + "=" + str(value), snapshot)
+
+    def __switch(self, rule: LoadRule, on: bool, now: float, reason: str, snapshot: Snapshot):
+        # called with the states lock held
+        self.__states[rule.name] = (on, now)
+        received = snapshot.provider_measures_updated_utc
+        received_epoch = (received if received.tzinfo is not None else received.replace(tzinfo=timezone.utc)).timestamp()
+        control_reaction_seconds.observe(max(0.0, timebase.epoch() - received_epoch), rule.name)
+        control_switches.inc(rule.name, "on" if on else "off")
+        logging.info("switching " + rule.name + " " + ("on" if on else "off") + " (" + reason + ")")
+        self.__executor.submit(self.__switch_relay, rule, on)
+
+    def __switch_relay(self, rule: LoadRule, on: bool):
+        start = monotonic()
+        try:
+            self.__relays[rule.name].switch(on)
+            control_switch_seconds.observe(monotonic() - start, rule.name)
+        except Exception as e:
+            # the decision is reverted, so the rule is evaluated again on the next tick
+            logging.warning("switching " + rule.name + " failed " + str(e))
+            control_switch_failures.inc(rule.name)
+            with self.__states_lock:
+                is_on, since = self.__states[rule.name]
+                if is_on == on:
+                    self.__states[rule.name] = (not on, since - max(rule.min_on_sec, rule.min_off_sec))
+
+    def close(self):
+        self.__executor.shutdown(wait=True)
+
+
+def simulate(argv: List[str]):
+    # replays a synthetic trace by using fake meters. The power of a switched on load is added to the provider meter
+    from replay import Trace, Replay
+    parser = argparse.ArgumentParser(description="simulates the load control by replaying a synthetic meter trace")
+    parser.add_argument("--start", default="2026-06-01T00:00:00", help="start time (utc)")
+    parser.add_argument("--days", type=float, default=1)
+    parser.add_argument("--load", type=int, default=2000, help="power of the simulated load")
+    parser.add_argument("--signal", default="pv_surplus_power_15s")
+    parser.add_argument("--on", type=int, default=2200, help="on threshold")
+    parser.add_argument("--off", type=int, default=0, help="off threshold")
+    parser.add_argument("--min_on", type=float, default=5 * 60)
+    parser.add_argument("--min_off", type=float, default=5 * 60)
+    args = parser.parse_args(argv)
+
+    duration_sec = args.days * 24 * 60 * 60
+    trace = Trace.synthetic(datetime.fromisoformat(args.start).replace(tzinfo=timezone.utc).timestamp(), duration_sec)
+    relay = SimulatedRelay(args.load)
+    replay = Replay(trace, tempfile.mkdtemp(), provider_offset=lambda: relay.power if relay.is_on else 0)
+    rule = LoadRule("load", "simulated", signal=args.signal, on_watt=args.on, off_watt=args.off, min_on_sec=args.min_on, min_off_sec=args.min_off)
+    controller = LoadController(replay.energy, [rule], {"load": relay})
+    num_samples, wall_sec = replay.run(duration_sec)
+    controller.close()
+    for line in replay.report(duration_sec, num_samples, wall_sec)[:2]:
+        print(line)
+    on_sec = 0.0
+    for (time, on), (next_time, _) in zip(relay.switched, relay.switched[1:] + [(timebase.epoch(), False)]):
+        if on:
+            on_sec += next_time - time
+    print("switched " + str(len(relay.switched)) + " times, load on for " + str(round(on_sec / 3600, 1)) + "h (" + str(round(on_sec * relay.power / 3600 / 1000, 1)) + " kWh)")
+    for time, on in relay.switched:
+        print("  " + datetime.fromtimestamp(time, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S") + " " + ("on" if on else "off"))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s %(name)-20s: %(levelname)-8s %(message)s', level=logging.WARNING, datefmt='%Y-%m-%d %H:%M:%S')
+    simulate(sys.argv[1:])
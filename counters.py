@@ -0,0 +1,107 @@
+import logging
+from typing import List, Tuple, Optional
+from timeseries import TimeSeries
+from timebase import timebase
+from wal import WriteAheadLog
+
+
+class CounterEnergy:
+
+    # Energy based on a hardware counter. Per hour and per day the last counter reading (watt hours) is stored. The
+    # energy of a bucket is the difference to the last reading of a preceding bucket, so the values do not drift and
+    # a polling gap (or a restart) does not lose energy. The energy of a gap is accounted to the bucket of the next
+    # reading. A counter going backwards (e.g. device replaced) continues with an offset
+
+    LOOKBACK = {"hour": 31 * 24, "day": 400}
+
+    def __init__(self, name: str, directory: str, wal: Optional[WriteAheadLog] = None):
+        self.__name = name
+        self.__total_per_hour = TimeSeries(name + "_total_per_hour", directory, resolution_sec=60*60, capacity=400*24, sync_period_sec=70, wal=wal)
+        self.__total_per_day = TimeSeries(name + "_total_per_day", directory, resolution_sec=24*60*60, capacity=10*366, sync_period_sec=80, wal=wal)
+        self.__series = {"hour": self.__total_per_hour, "day": self.__total_per_day}
+        self.__offset = 0
+
+    def __latest(self, resolution: str, bucket: int) -> Optional[Tuple[int, int]]:
+        # latest (bucket, total) at or before the given bucket
+        series = self.__series[resolution]
+        items = series.items(bucket - self.LOOKBACK[resolution], bucket)
+        return items[-1] if len(items) > 0 else None
+
+    def put(self, total_wh: int):
+        now = timebase.epoch()
+        total = total_wh + self.__offset
+        for resolution, series in self.__series.items():
+            bucket = series.bucket_of(now)
+            latest = self.__latest(resolution, bucket)
+            if latest is None:
+                # first reading. The preceding bucket serves as base of the current one
+                series.put(bucket - 1, total)
+            elif total < latest[1]:
+                logging.warning(self.__name + " counter went backwards (" + str(total) + "Wh < " + str(latest[1]) + "Wh). Continuing with an offset")
+                self.__offset += latest[1] - total
+                total = latest[1]
+            series.put(bucket, total)
+
+    def history(self, resolution: str, from_epoch_sec: float, to_epoch_sec: float) -> List[Tuple[int, int]]:
+        # (start time of the bucket as epoch sec, watt hours) of the buckets holding a reading
+        series = self.__series[resolution]
+        from_bucket = series.bucket_of(from_epoch_sec)
+        history = list()
+        previous = None
+        for bucket, total in series.items(from_bucket - self.LOOKBACK[resolution], series.bucket_of(to_epoch_sec)):
+            if previous is not None and bucket >= from_bucket:
+                history.append((bucket * series.resolution_sec, total - previous))
+            previous = total
+        return history
+
+    def __energy(self, resolution: str, bucket: int) -> int:
+        latest = self.__latest(resolution, bucket)
+        if latest is None or latest[0] != bucket:
+            return 0
+        base = self.__latest(resolution, bucket - 1)
+        return 0 if base is None else latest[1] - base[1]
+
+    @property
+    def energy_current_hour(self) -> int:
+        return self.__energy("hour", self.__total_per_hour.bucket_of(timebase.epoch()))
+
+    @property
+    def energy_current_day(self) -> int:
+        return self.__energy("day", timebase.calendar().day)
+
+    @property
+    def energy_current_year(self) -> int:
+        calendar = timebase.calendar()
+        latest = self.__latest("day", calendar.day)
+        if latest is None or latest[0] < calendar.year_start_day:
+            return 0
+        base = self.__latest("day", calendar.year_start_day - 1)
+        if base is None:
+            # first year. The earliest reading of the year is the base
+            base = self.__total_per_day.items(calendar.year_start_day, calendar.day)[0]
+        return latest[1] - base[1]
+
+
+class CounterDifference:
+
+    # e.g. self consumption = pv yield - exported energy. Buckets are not negative
+
+    def __init__(self, minuend: CounterEnergy, subtrahend: CounterEnergy):
+        self.__minuend = minuend
+        self.__subtrahend = subtrahend
+
+    def history(self, resolution: str, from_epoch_sec: float, to_epoch_sec: float) -> List[Tuple[int, int]]:
+        subtrahend = dict(self.__subtrahend.history(resolution, from_epoch_sec, to_epoch_sec))
+        return [(epoch_sec, max(0, energy - subtrahend.get(epoch_sec, 0))) for epoch_sec, energy in self.__minuend.history(resolution, from_epoch_sec, to_epoch_sec)]
+
+    @property
+    def energy_current_hour(self) -> int:
+        return max(0, self.__minuend.energy_current_hour - self.__subtrahend.energy_current_hour)
+
+    @property
+    def energy_current_day(self) -> int:
+        return max(0, self.__minuend.energy_current_day - self.__subtrahend.energy_current_day)
+
+    @property
+    def energy_current_year(self) -> int:
+        return max(0, self.__minuend.energy_current_year - self.__subtrahend.energy_current_year)
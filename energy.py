@@ -1,96 +1,287 @@
+import os
 import logging
-from threading import Thread
-from datetime import datetime, timedelta
+from threading import Thread, Lock
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta, date
 from time import sleep
-from typing import Tuple, List, Dict, Optional
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Tuple, List, Dict, Optional, Set, Any, Callable
 from redzoo.database.simple import SimpleDB
-from shelly import ShellyMeter
+from shelly import ShellyMeter, DeviceRegistry, EnergyRecord
+from poller import Poller, Sample, CounterSample
+from stream import ShellyStream
+from timeseries import TimeSeries, RollingSum
+from archive import SampleArchive
+from timebase import timebase, EPOCH
+from wal import WriteAheadLog
+from peeks import PeekHourIndex
+from forecast import SeasonalProfile
+from counters import CounterEnergy, CounterDifference
+from gaps import SampleQuality, Backfill, Gap
+
+
+PHASES = ["a", "b", "c"]
+
+# pseudo field name signaling that the hourly, daily and yearly aggregates have been updated
+AGGREGATES = "aggregates"
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    # the measured values of a polling round. Snapshots are never changed but replaced as a whole, so a reader holding a
+    # snapshot gets a consistent view without locking
+    version: int
+    provider_measures_updated_utc: datetime
+    provider_power: int
+    provider_power_phase_a: Optional[int]     # None, if the provider meter is a single phase meter
+    provider_power_phase_b: Optional[int]
+    provider_power_phase_c: Optional[int]
+    pv_measures_updated: datetime
+    pv_power: int
+    pv_power_channels: Tuple[int, ...]
+
+    @property
+    def pv_surplus_power(self) -> int:
+        return abs(self.provider_power) if self.provider_power < 0 else 0
+
+    @property
+    def pv_effective_power(self) -> int:
+        effective = self.pv_power - self.pv_surplus_power
+        return 0 if effective < 0 else effective
+
+    @property
+    def consumption_power(self) -> int:
+        # e.g:
+        # provider 450 + pv 0 = 450
+        # provider 300 + pv 200 = 500
+        # provider -900 + pv 1600 = 500
+        return self.provider_power + self.pv_power
+
 
 
 class WattRecorder:
 
+    # written by a single thread and read by others. Readers take the state tuple at once. Measures are appended in place
+    # (times last, so a reader never sees a time without its values) and the compaction swaps in fresh arrays
+
     def __init__(self, max_size_minutes: int = 65):
-        self.__max_size_minutes = max_size_minutes
-        self.__minute_measures: List[Tuple[datetime, float]] = list()
-        self.__value = 0
+        self.__max_size_seconds = max_size_minutes * 60
+        # parallel arrays of doubles: monotonic start time, watt and the accumulated watt seconds at the start time of each measure,
+        # plus the index of the oldest measure not expired yet
+        self.__state = (array('d'), array('d'), array('d'), 0)
 
     @property
     def size(self) -> int:
-        return len(self.__minute_measures)
+        times, _, _, head = self.__state
+        return len(times) - head
 
     def put(self, measure: float):
-        if len(self.__minute_measures) == 0 or measure != self.__minute_measures[-1][1]:
-            self.__minute_measures.append((datetime.utcnow(), measure))
-            self.__compact()
-
-    def __compact(self):
-        max_datetime = datetime.utcnow() - timedelta(minutes=self.__max_size_minutes)
-        num_elements = len(self.__minute_measures)
-        for i in range(num_elements):
-            if self.__minute_measures[0][0] < max_datetime:
-                del self.__minute_measures[0]
+        times, watts, watt_secs, head = self.__state
+        if len(times) == head or measure != watts[-1]:
+            now = timebase.monotonic()
+            if len(times) == head:
+                watt_sec = 0
             else:
-                return
+                watt_sec = watt_secs[-1] + watts[-1] * (now - times[-1])
+            watts.append(measure)
+            watt_secs.append(watt_sec)
+            times.append(now)
+            self.__compact(now)
+
+    def __compact(self, now: float):
+        times, watts, watt_secs, head = self.__state
+        head = bisect_left(times, now - self.__max_size_seconds, lo=head)
+        # release expired measures in bulk to keep removal amortized O(1)
+        if head > 256 and head * 2 > len(times):
+            self.__state = (times[head:], watts[head:], watt_secs[head:], 0)
+        else:
+            self.__state = (times, watts, watt_secs, head)
+
+    @staticmethod
+    def __watt_sec_at(state: Tuple[array, array, array, int], size: int, at: float) -> float:
+        times, watts, watt_secs, head = state
+        idx = bisect_right(times, at, head, size) - 1
+        if idx < head:
+            return watt_secs[head]
+        else:
+            return watt_secs[idx] + watts[idx] * (at - times[idx])
 
     def watt_per_hour(self, minute_range: int = None, second_range: int = 60) -> int:
-        now = datetime.utcnow()
         if minute_range is not None:
             second_range = minute_range * 60
-        offset = now - timedelta(seconds=second_range)
-
-        watt_sec = 0
-        for measure in reversed(self.__minute_measures):
-            start_time = measure[0]
-            watt = measure[1]
-            if start_time < offset:
-                start_time = offset
-            elapsed_seconds = (now - start_time).total_seconds()
-            watt_sec += watt * elapsed_seconds
-            now = start_time
-            if start_time == offset:
-                break
+        state = self.__state
+        size = len(state[0])   # measures appended later on are ignored
+        if size == state[3]:
+            return 0
+        now = timebase.monotonic()
+        watt_sec = self.__watt_sec_at(state, size, now) - self.__watt_sec_at(state, size, now - second_range)
         return int(watt_sec / second_range)
 
 
+class MultiWattRecorder:
+
+    # WattRecorder of multiple series measured together (e.g. the phases of a meter). The series share the time array, so
+    # a put costs a single clock read, bisect and compaction for all of them. Watts and watt seconds are interleaved per measure
+
+    def __init__(self, num_series: int, max_size_minutes: int = 65):
+        self.__num_series = num_series
+        self.__max_size_seconds = max_size_minutes * 60
+        self.__state = (array('d'), array('d'), array('d'), 0)
+        self.__last_measures: Tuple[float, ...] = ()    # used by the writer only
+
+    def put(self, measures: Tuple[float, ...]):
+        times, watts, watt_secs, head = self.__state
+        n = self.__num_series
+        if len(times) == head or measures != self.__last_measures:
+            self.__last_measures = tuple(measures)
+            now = timebase.monotonic()
+            if len(times) == head:
+                watt_secs.extend([0] * n)
+            else:
+                elapsed = now - times[-1]
+                watt_secs.extend([watt_sec + watt * elapsed for watt_sec, watt in zip(watt_secs[-n:], watts[-n:])])
+            watts.extend(measures)
+            times.append(now)
+            self.__compact(now)
+
+    def __compact(self, now: float):
+        times, watts, watt_secs, head = self.__state
+        head = bisect_left(times, now - self.__max_size_seconds, lo=head)
+        if head > 256 and head * 2 > len(times):
+            n = self.__num_series
+            self.__state = (times[head:], watts[head * n:], watt_secs[head * n:], 0)
+        else:
+            self.__state = (times, watts, watt_secs, head)
+
+    def __watt_secs_at(self, state: Tuple[array, array, array, int], size: int, at: float) -> List[float]:
+        times, watts, watt_secs, head = state
+        n = self.__num_series
+        idx = bisect_right(times, at, head, size) - 1
+        if idx < head:
+            return list(watt_secs[head * n:(head + 1) * n])
+        else:
+            elapsed = at - times[idx]
+            return [watt_sec + watt * elapsed for watt_sec, watt in zip(watt_secs[idx * n:(idx + 1) * n], watts[idx * n:(idx + 1) * n])]
+
+    def watt_per_hour(self, minute_range: int = None, second_range: int = 60) -> Tuple[int, ...]:
+        if minute_range is not None:
+            second_range = minute_range * 60
+        state = self.__state
+        size = len(state[0])   # measures appended later on are ignored
+        if size == state[3]:
+            return tuple([0] * self.__num_series)
+        now = timebase.monotonic()
+        return tuple([int((to_watt_sec - from_watt_sec) / second_range) for to_watt_sec, from_watt_sec in zip(self.__watt_secs_at(state, size, now), self.__watt_secs_at(state, size, now - second_range))])
+
+
 class AggregatedPower:
 
-    def __init__(self, name: str, directory : str):
-        self.__power_per_minute = SimpleDB(name+ "_per_minute", sync_period_sec=60, directory=directory)
-        self.__power_per_hour = SimpleDB(name+ "_per_hour", sync_period_sec=70, directory=directory)
-        self.__power_per_day = SimpleDB(name + "_per_day", sync_period_sec=80, directory=directory)
+    def __init__(self, name: str, directory : str, wal: Optional[WriteAheadLog] = None):
+        self.__power_per_minute = TimeSeries(name + "_per_minute", directory, resolution_sec=60, capacity=2*24*60, sync_period_sec=60, wal=wal)
+        self.__power_per_hour = TimeSeries(name + "_per_hour", directory, resolution_sec=60*60, capacity=400*24, sync_period_sec=70, wal=wal)
+        self.__power_per_day = TimeSeries(name + "_per_day", directory, resolution_sec=24*60*60, capacity=10*366, sync_period_sec=80, wal=wal)
+        if self.__power_per_day.is_new:
+            self.__import_legacy_days(name, directory)
+        self.__last_60_minutes = RollingSum(self.__power_per_minute)
+        self.__completed_hours_of_day = RollingSum(self.__power_per_hour)
+        self.__days_of_year = RollingSum(self.__power_per_day)
+        self.__measured_day = -1
+
+    def __import_legacy_days(self, name: str, directory: str):
+        # daily values of former versions are stored in a SimpleDB keyed by day of year
+        if os.path.isfile(os.path.join(directory, name + "_per_day.json.gz")):
+            legacy = SimpleDB(name + "_per_day", directory=directory)
+            today = EPOCH + timedelta(days=timebase.calendar().day)
+            for day_of_year in legacy.keys():
+                day = date(today.year, 1, 1) + timedelta(days=int(day_of_year) - 1)
+                if day > today:
+                    day = date(today.year - 1, 1, 1) + timedelta(days=int(day_of_year) - 1)
+                self.__power_per_day.put(self.__day_bucket(day), legacy.get(day_of_year))
+            self.__power_per_day.flush()
+            logging.info(str(len(legacy.keys())) + " daily values of " + name + " imported")
+
+    def __day_bucket(self, day: date) -> int:
+        return (day - EPOCH).days
 
     def measure(self, power_1m: int):
-        self.__power_per_minute.put(str(datetime.utcnow().minute), power_1m, ttl_sec=61*60)
+        now = timebase.epoch()
+        minute = self.__power_per_minute.bucket_of(now)
+        self.__last_60_minutes.move(minute - 59, minute)
+        self.__last_60_minutes.update(minute, self.__power_per_minute.put(minute, power_1m), power_1m)
         # hourly value
-        power_60min = int(sum([self.__power_per_minute.get(str(minute), 0) for minute in range(0, 60)]) / 60)
-        self.__power_per_hour.put(str(datetime.utcnow().hour), power_60min, ttl_sec=25*60*60)
-        # daily value
-        current_hour = datetime.now().hour
-        power_24hour =  sum([self.__power_per_hour.get(str(hour), 0) for hour in range(0, current_hour)])
-        self.__power_per_day.put(datetime.utcnow().strftime('%j'), power_24hour, ttl_sec=366 * 24 * 60 * 60)
+        power_60min = int(self.__last_60_minutes.sum_and_count(minute - 59, minute)[0] / 60)
+        hour = self.__power_per_hour.bucket_of(now)
+        calendar = timebase.calendar(now)
+        day = calendar.day
+        self.__completed_hours_of_day.move(day * 24, hour - 1)
+        self.__completed_hours_of_day.update(hour, self.__power_per_hour.put(hour, power_60min), power_60min)
+        # daily value (completed hours of the current day)
+        power_24hour = self.__completed_hours_of_day.sum_and_count(day * 24, hour - 1)[0]
+        if day != self.__measured_day:
+            # the hour 23 of the former day has not been completed by its last measure
+            self.__complete_day(day - 1)
+            self.__measured_day = day
+        self.__days_of_year.move(calendar.year_start_day, day)
+        self.__days_of_year.update(day, self.__power_per_day.put(day, power_24hour), power_24hour)
+
+    def backfill(self, power_per_minute: Dict[int, int]):
+        # replaces minute buckets (e.g. of a polling gap) and recomputes the closed hours and days containing them. The
+        # current hour and day are recomputed by the next measure
+        now = timebase.epoch()
+        current_minute = self.__power_per_minute.bucket_of(now)
+        current_hour = self.__power_per_hour.bucket_of(now)
+        current_day = timebase.calendar(now).day
+        hours = set()
+        for minute, power in power_per_minute.items():
+            if current_minute - self.__power_per_minute.capacity < minute <= current_minute:
+                self.__last_60_minutes.update(minute, self.__power_per_minute.put(minute, power), power)
+                hours.add(minute // 60)
+        for hour in sorted(hours):
+            if hour < current_hour:
+                power_60min = int(self.__power_per_minute.sum(hour * 60, hour * 60 + 59) / 60)
+                self.__completed_hours_of_day.update(hour, self.__power_per_hour.put(hour, power_60min), power_60min)
+        for day in sorted({hour // 24 for hour in hours}):
+            if day < current_day:
+                self.__complete_day(day)
+
+    def __complete_day(self, day: int):
+        # daily value of all 24 hours. A day without any hourly value is left empty
+        hours = self.__power_per_hour.items(day * 24, day * 24 + 23)
+        if len(hours) > 0:
+            power_24hour = sum([power for _, power in hours])
+            self.__days_of_year.update(day, self.__power_per_day.put(day, power_24hour), power_24hour)
 
     @property
     def power_current_day(self) -> int:
-        return int(self.__power_per_day.get(str(datetime.utcnow().strftime('%j')), 0))
+        return self.__power_per_day.get(timebase.calendar().day, 0)
 
     @property
     def power_current_hour(self) -> int:
-        return self.power_by_hour(datetime.utcnow().hour)
+        return self.__power_per_hour.get(self.__power_per_hour.bucket_of(timebase.epoch()), 0)
 
     def power_by_hour(self, hour: int) -> int:
-        return self.__power_per_hour.get(str(hour), 0)
+        # hour of the current day (utc)
+        return self.__power_per_hour.get(timebase.calendar().day * 24 + hour, 0)
+
+    def history(self, resolution: str, from_epoch_sec: float, to_epoch_sec: float) -> List[Tuple[int, int]]:
+        # (start time of the bucket as epoch sec, value) of the buckets holding a value
+        series = {"minute": self.__power_per_minute, "hour": self.__power_per_hour, "day": self.__power_per_day}[resolution]
+        return [(bucket * series.resolution_sec, value) for bucket, value in series.items(series.bucket_of(from_epoch_sec), series.bucket_of(to_epoch_sec))]
+
+    def __current_year_range(self) -> Tuple[int, int]:
+        calendar = timebase.calendar()
+        return calendar.year_start_day, calendar.day
 
     @property
     def power_current_year(self) -> int:
-        return sum([self.__power_per_day.get(str(day), 0) for day in range(0, int(datetime.utcnow().strftime('%j'))+1)])
+        return self.__days_of_year.sum_and_count(*self.__current_year_range())[0]
 
     @property
     def power_estimated_year(self) -> int:
-        current_day = int(datetime.utcnow().strftime('%j'))
-        power_per_day = [self.__power_per_day.get(str(day), -1) for day in range(0, current_day+1)]
-        power_per_day = [power for power in power_per_day if power >= 0]
-        if len(power_per_day) > 0:
-            return int(sum(power_per_day) * 365 / len(power_per_day))
+        power, num_days = self.__days_of_year.sum_and_count(*self.__current_year_range())
+        if num_days > 0:
+            return int(power * 365 / num_days)
         else:
             return 0
 
@@ -100,79 +291,256 @@ class Energy:
     def __init__(self,
                  meter_addr_provider: str,
                  meter_addr_pv: str,
-                 meter_addr_pv_channel1: str,
-                 meter_addr_pv_channel2: str,
-                 meter_addr_pv_channel3: str,
+                 meter_addr_pv_channels: List[str],
                  directory: str,
-                 min_pv_power : int):
+                 min_pv_power : int,
+                 ingestion: str = "poll",
+                 poller: Optional[Poller] = None,
+                 pv_peek_window_days: int = 30,
+                 counter_period_sec: float = 60,
+                 records: Optional[Callable[[int, int], Optional[List[EnergyRecord]]]] = None):
         self.__is_running = True
-        self.__listener = lambda: None    # "empty" listener
-        self.__provider_shelly = ShellyMeter(meter_addr_provider)
-        self.__pv_shelly = ShellyMeter(meter_addr_pv)
-        self.__pv_shelly_channel1 = ShellyMeter(meter_addr_pv_channel1)
-        self.__pv_shelly_channel2 = ShellyMeter(meter_addr_pv_channel2)
-        self.__pv_shelly_channel3 = ShellyMeter(meter_addr_pv_channel3)
-
-        self.provider_measures_updated_utc = datetime.utcnow()
-        self.provider_power = 0
-        self.provider_power_phase_a = 0
-        self.provider_power_phase_b = 0
-        self.provider_power_phase_c = 0
-        self.__provider_aggregated_power = AggregatedPower("provider", directory)
-
-        self.pv_measures_updated = datetime.utcnow()
-        self.pv_power = 0
-        self.pv_power_channel_1 = 0
-        self.pv_power_channel_2 = 0
-        self.pv_power_channel_3 = 0
-        self.__pv_aggregated_power = AggregatedPower("pv", directory)
-        self.__pv_effective_aggregated_power = AggregatedPower("pv_effective", directory)
-        self.__consumption_aggregated_power = AggregatedPower("consumption", directory)
-        self.__surplus_aggregated_power = AggregatedPower("surplus", directory)
+        self.__listener = lambda changed: None    # "empty" listener
+        self.__tick_listeners: List[Callable[[Snapshot], None]] = list()
+        device_registry = DeviceRegistry(directory)
+        self.__provider_shelly = ShellyMeter(meter_addr_provider, registry=device_registry)
+        self.__pv_shelly = ShellyMeter(meter_addr_pv, registry=device_registry)
+        self.__pv_shelly_channels = [ShellyMeter(addr, registry=device_registry) for addr in meter_addr_pv_channels]
+        # the energy counters are read at a low rate, independent of the ingestion
+        counter_sources = {"provider_counters": self.__provider_shelly, "pv_counters": self.__pv_shelly}
+        # the minute buckets of a provider gap are rebuilt by the records of the meter
+        self.__sample_quality = SampleQuality({"provider": meter_addr_provider, "pv": meter_addr_pv})
+        self.__backfill = Backfill(meter_addr_provider, self.__provider_shelly.records if records is None else records, self.__apply_records, directory=directory)
+        # a poller may be shared by multiple sites. In this case it is started by its owner
+        self.__is_poller_owner = poller is None
+        self.__poller = Poller() if poller is None else poller
+        if ingestion == "push":
+            # pushed status notifications are processed as they arrive. Polling serves as fallback while a stream is silent
+            self.__provider_shelly = ShellyStream(self.__provider_shelly, meter_addr_provider)
+            self.__pv_shelly = ShellyStream(self.__pv_shelly, meter_addr_pv)
+            self.__pv_shelly_channels = [ShellyStream(meter, addr) for meter, addr in zip(self.__pv_shelly_channels, meter_addr_pv_channels)]
+            self.__poller.stream(self.__provider_shelly, lambda sample: self.__on_samples({"provider": sample}))
+            self.__poller.stream(self.__pv_shelly, lambda sample: self.__on_samples({"pv": sample}))
+            for num, meter in enumerate(self.__pv_shelly_channels, start=1):
+                self.__poller.stream(meter, lambda sample, name="pv_channel" + str(num): self.__on_channel_samples({name: sample}))
+        self.__poller.schedule(1, {"provider": self.__provider_shelly, "pv": self.__pv_shelly}, self.__on_samples)
+        if len(self.__pv_shelly_channels) > 0:
+            self.__poller.schedule(2, {"pv_channel" + str(num): meter for num, meter in enumerate(self.__pv_shelly_channels, start=1)}, self.__on_channel_samples)
+        self.__poller.schedule_counters(counter_period_sec, counter_sources, self.__on_counter_samples)
+
+        self.__snapshot_lock = Lock()
+        self.__snapshot = Snapshot(version=0,
+                                   provider_measures_updated_utc=datetime.utcnow(),
+                                   provider_power=0,
+                                   provider_power_phase_a=None,
+                                   provider_power_phase_b=None,
+                                   provider_power_phase_c=None,
+                                   pv_measures_updated=datetime.utcnow(),
+                                   pv_power=0,
+                                   pv_power_channels=tuple([0] * len(meter_addr_pv_channels)))
+        # all series of the directory share a single write ahead log
+        self.__wal = WriteAheadLog(directory)
+        self.__provider_aggregated_power = AggregatedPower("provider", directory, self.__wal)
+
+        self.__pv_aggregated_power = AggregatedPower("pv", directory, self.__wal)
+        self.__pv_effective_aggregated_power = AggregatedPower("pv_effective", directory, self.__wal)
+        self.__consumption_aggregated_power = AggregatedPower("consumption", directory, self.__wal)
+        self.__surplus_aggregated_power = AggregatedPower("surplus", directory, self.__wal)
+        # net power per phase of the provider meter (may be negative)
+        self.__provider_phase_aggregated_powers = [AggregatedPower("provider_phase_" + phase, directory, self.__wal) for phase in PHASES]
+        self.__aggregated_powers = {"provider": self.__provider_aggregated_power,
+                                    "pv": self.__pv_aggregated_power,
+                                    "pv_effective": self.__pv_effective_aggregated_power,
+                                    "consumption": self.__consumption_aggregated_power,
+                                    "surplus": self.__surplus_aggregated_power}
+        for phase, aggregated_power in zip(PHASES, self.__provider_phase_aggregated_powers):
+            self.__aggregated_powers["provider_phase_" + phase] = aggregated_power
+        # the downtime of a restart (or crash) is a provider gap as well. It starts with the last minute measured
+        now = timebase.epoch()
+        minutes = self.__provider_aggregated_power.history("minute", now - 2 * 24 * 60 * 60, now)
+        if len(minutes) > 0 and now - minutes[-1][0] >= 2 * 60:
+            self.__backfill.request(Gap("provider", minutes[-1][0], now))
+        # exact energy (watt hours) based on the hardware counters of the meters
+        self.__grid_import_counter = CounterEnergy("grid_import", directory, self.__wal)
+        self.__grid_export_counter = CounterEnergy("grid_export", directory, self.__wal)
+        self.__pv_yield_counter = CounterEnergy("pv_yield", directory, self.__wal)
+        self.__counter_energies = {"grid_import": self.__grid_import_counter,
+                                   "grid_export": self.__grid_export_counter,
+                                   "pv_yield": self.__pv_yield_counter,
+                                   "self_consumption": CounterDifference(self.__pv_yield_counter, self.__grid_export_counter)}
+        self.__forecasts = {"pv": SeasonalProfile(lambda from_epoch_sec, to_epoch_sec: self.__pv_aggregated_power.history("hour", from_epoch_sec, to_epoch_sec), lambda: self.pv_power_1m),
+                            "consumption": SeasonalProfile(lambda from_epoch_sec, to_epoch_sec: self.__consumption_aggregated_power.history("hour", from_epoch_sec, to_epoch_sec), lambda: self.consumption_power_1m)}
 
         self.__pv_power_smoothen_recorder = WattRecorder()
-        self.__pv_power_ch_1_smoothen_recorder = WattRecorder()
-        self.__pv_power_ch_2_smoothen_recorder = WattRecorder()
-        self.__pv_power_ch_3_smoothen_recorder = WattRecorder()
+        self.__pv_power_ch_smoothen_recorders = [WattRecorder() for _ in meter_addr_pv_channels]
         self.__pv_effective_power_smoothen_recorder = WattRecorder()
         self.__provider_power_smoothen_recorder = WattRecorder()
         self.__consumption_power_smoothen_recorder = WattRecorder()
         self.__pv_surplus_power_smoothen_recorder = WattRecorder()
+        self.__provider_phases_smoothen_recorder = MultiWattRecorder(len(PHASES))
+
+        self.__archive = SampleArchive(directory, ["provider", "consumption", "pv"] + ["pv_channel_" + str(num) for num in range(1, len(meter_addr_pv_channels) + 1)] + ["surplus", "pv_effective"])
 
-        self.__time_daily_value_measured = datetime.utcnow()
+        self.__time_daily_value_measured = timebase.monotonic()
 
-        self.__pv_daily_peeks = SimpleDB("pv_daily_peek", sync_period_sec=60, directory=directory)
+        # peek hour (utc) per epoch day
+        pv_daily_peeks = TimeSeries("pv_daily_peek", directory, resolution_sec=24*60*60, capacity=60, wal=self.__wal)
+        self.__pv_peeks = PeekHourIndex(pv_daily_peeks, pv_peek_window_days)
+        if pv_daily_peeks.is_new:
+            self.__import_legacy_peeks(directory)
         self.__min_pv_power = min_pv_power
 
 
     def set_listener(self,listener):
         self.__listener = listener
 
+    def add_tick_listener(self, listener: Callable[[Snapshot], None]):
+        # called on the polling thread on each provider/pv sample, as soon as the smoothen values are updated. A tick
+        # listener must not block. Ticks continue while a source is stale, so a listener has to check provider_stale and
+        # pv_stale before acting on the snapshot
+        self.__tick_listeners.append(listener)
+
     @property
-    def pv_effective_power(self) -> int:
-        effective = self.pv_power - self.pv_surplus_power
-        if effective < 0:
+    def history_series(self) -> List[str]:
+        return list(self.__aggregated_powers.keys()) + list(self.__counter_energies.keys())
+
+    def history_resolutions(self, series: str) -> List[str]:
+        # the counters are read once per minute at most
+        return ["hour", "day"] if series in self.__counter_energies.keys() else ["minute", "hour", "day"]
+
+    def history(self, series: str, resolution: str, from_epoch_sec: float, to_epoch_sec: float) -> List[Tuple[int, int]]:
+        if series in self.__counter_energies.keys():
+            return self.__counter_energies[series].history(resolution, from_epoch_sec, to_epoch_sec)
+        return self.__aggregated_powers[series].history(resolution, from_epoch_sec, to_epoch_sec)
+
+    @property
+    def counter_series(self) -> List[str]:
+        return list(self.__counter_energies.keys())
+
+    def counter_energy_current_hour(self, series: str) -> int:
+        return self.__counter_energies[series].energy_current_hour
+
+    def counter_energy_current_day(self, series: str) -> int:
+        return self.__counter_energies[series].energy_current_day
+
+    def counter_energy_current_year(self, series: str) -> int:
+        return self.__counter_energies[series].energy_current_year
+
+    @property
+    def forecast_series(self) -> List[str]:
+        return list(self.__forecasts.keys())
+
+    def forecast(self, series: str, horizon_hours: int = 24, resolution_sec: int = 15 * 60) -> List[Tuple[int, int]]:
+        return self.__forecasts[series].forecast(horizon_hours, resolution_sec)
+
+    @property
+    def pv_forecast_24h(self) -> int:
+        return self.__forecasts["pv"].energy(24)
+
+    @property
+    def consumption_forecast_24h(self) -> int:
+        return self.__forecasts["consumption"].energy(24)
+
+    def archived_samples(self, tier: str, from_epoch_sec: int, to_epoch_sec: int) -> List[Tuple[int, Dict[str, float]]]:
+        return self.__archive.read(tier, from_epoch_sec, to_epoch_sec)
+
+    @property
+    def snapshot(self) -> Snapshot:
+        return self.__snapshot
+
+    @property
+    def provider_measures_updated_utc(self) -> datetime:
+        return self.__snapshot.provider_measures_updated_utc
+
+    @property
+    def provider_power(self) -> int:
+        return self.__snapshot.provider_power
+
+    @property
+    def has_provider_phases(self) -> bool:
+        # single phase meters do not provide phase values
+        return self.__snapshot.provider_power_phase_a is not None
+
+    @property
+    def provider_power_phase_a(self) -> Optional[int]:
+        return self.__snapshot.provider_power_phase_a
+
+    @property
+    def provider_power_phase_b(self) -> Optional[int]:
+        return self.__snapshot.provider_power_phase_b
+
+    @property
+    def provider_power_phase_c(self) -> Optional[int]:
+        return self.__snapshot.provider_power_phase_c
+
+    def __phase_index(self, phase: str) -> int:
+        return PHASES.index(phase)
+
+    def provider_power_phase_15s(self, phase: str) -> int:
+        return self.__provider_phases_smoothen_recorder.watt_per_hour(second_range=15)[self.__phase_index(phase)]
+
+    def provider_power_phase_1m(self, phase: str) -> int:
+        return self.__provider_phases_smoothen_recorder.watt_per_hour(minute_range=1)[self.__phase_index(phase)]
+
+    def provider_power_phase_current_hour(self, phase: str) -> int:
+        return self.__provider_phase_aggregated_powers[self.__phase_index(phase)].power_current_hour
+
+    def provider_power_phase_current_day(self, phase: str) -> int:
+        return self.__provider_phase_aggregated_powers[self.__phase_index(phase)].power_current_day
+
+    @property
+    def provider_power_phase_imbalance(self) -> int:
+        # difference between the highest and the lowest phase (smoothen 1 min). A single phase meter is balanced
+        if not self.has_provider_phases:
             return 0
-        else:
-            return  effective
+        powers = self.__provider_phases_smoothen_recorder.watt_per_hour(minute_range=1)
+        return max(powers) - min(powers)
+
+    @property
+    def provider_stale(self) -> bool:
+        # no provider samples received recently. The current provider values are outdated
+        return self.__sample_quality.is_stale("provider")
+
+    @property
+    def pv_stale(self) -> bool:
+        return self.__sample_quality.is_stale("pv")
+
+    def gaps(self, from_epoch_sec: float, to_epoch_sec: float) -> List[Gap]:
+        return self.__sample_quality.gaps(from_epoch_sec, to_epoch_sec)
+
+    @property
+    def backfill_horizon_epoch_sec(self) -> float:
+        # the buckets starting before will not be rewritten by a backfill. A backfill covers the (open or a future) gap of
+        # the provider and the gaps requested so far, from the start of the minute holding the last sample before the gap
+        horizon = self.__sample_quality.last_received_epoch("provider")
+        pending = self.__backfill.pending_from_epoch_sec()
+        if pending is not None:
+            horizon = min(horizon, pending)
+        return int(horizon) // 60 * 60
+
+    @property
+    def pv_measures_updated(self) -> datetime:
+        return self.__snapshot.pv_measures_updated
+
+    @property
+    def pv_power(self) -> int:
+        return self.__snapshot.pv_power
+
+    @property
+    def pv_power_channels(self) -> Tuple[int, ...]:
+        return self.__snapshot.pv_power_channels
+
+    @property
+    def pv_effective_power(self) -> int:
+        return self.__snapshot.pv_effective_power
 
     @property
     def pv_surplus_power(self) -> int:
-        surplus = 0
-        if self.provider_power < 0:
-            surplus = abs(self.provider_power)
-        if surplus < 0:
-            return 0
-        else:
-            return surplus
+        return self.__snapshot.pv_surplus_power
 
     @property
     def consumption_power(self) -> int:
-        # e.g:
-        # provider 450 + pv 0 = 450
-        # provider 300 + pv 200 = 500
-        # provider -900 + pv 1600 = 500
-        return self.provider_power + self.pv_power
+        return self.__snapshot.consumption_power
 
     @property
     def consumption_power_5s(self) -> int:
@@ -269,28 +637,18 @@ class Energy:
         return self.__pv_effective_power_smoothen_recorder.watt_per_hour(minute_range=1)
 
     @property
-    def pv_power_ch1_5s(self) -> int:
-        return self.__pv_power_ch_1_smoothen_recorder.watt_per_hour(second_range=5)
-
-    @property
-    def pv_power_ch1_15s(self) -> int:
-        return self.__pv_power_ch_1_smoothen_recorder.watt_per_hour(second_range=15)
-
-    @property
-    def pv_power_ch2_5s(self) -> int:
-        return self.__pv_power_ch_2_smoothen_recorder.watt_per_hour(second_range=5)
+    def num_pv_channels(self) -> int:
+        return len(self.pv_power_channels)
 
-    @property
-    def pv_power_ch2_15s(self) -> int:
-        return self.__pv_power_ch_2_smoothen_recorder.watt_per_hour(second_range=15)
+    def pv_power_channel(self, num: int) -> int:
+        # num: channel number starting with 1
+        return self.__snapshot.pv_power_channels[num - 1]
 
-    @property
-    def pv_power_ch3_5s(self) -> int:
-        return self.__pv_power_ch_3_smoothen_recorder.watt_per_hour(second_range=5)
+    def pv_power_channel_5s(self, num: int) -> int:
+        return self.__pv_power_ch_smoothen_recorders[num - 1].watt_per_hour(second_range=5)
 
-    @property
-    def pv_power_ch3_15s(self) -> int:
-        return self.__pv_power_ch_3_smoothen_recorder.watt_per_hour(second_range=15)
+    def pv_power_channel_15s(self, num: int) -> int:
+        return self.__pv_power_ch_smoothen_recorders[num - 1].watt_per_hour(second_range=15)
 
     @property
     def pv_power_5s(self) -> int:
@@ -334,21 +692,29 @@ class Energy:
 
     @property
     def pv_peek_hour_utc(self) -> int:
-        peeks = sorted(self.__peeks())
-        if len(peeks) == 0:
-            return 12
-        else:
-            return peeks[int(len(peeks)* 0.5)]
+        # median of the daily peek hours
+        return self.__pv_peeks.percentile(50)
 
-    def __peeks(self) -> List[int]:
-        today = datetime.utcnow()
-        hours = [self.__pv_daily_peeks.get((today - timedelta(days=day_offset)).strftime("%Y-%m-%d"), -1) for day_offset in range(0, 60)]
-        return [hour for hour in hours if hour >= 0]
+    @property
+    def pv_peek_hour_weighted_utc(self) -> int:
+        # median of the daily peek hours, recent days weighted higher
+        return self.__pv_peeks.weighted_percentile(50)
+
+    def pv_peek_hour_percentile_utc(self, percent: float, weighted: bool = False) -> int:
+        return self.__pv_peeks.weighted_percentile(percent) if weighted else self.__pv_peeks.percentile(percent)
+
+    def __import_legacy_peeks(self, directory: str):
+        # peeks of former versions are stored in a SimpleDB keyed by date
+        if os.path.isfile(os.path.join(directory, "pv_daily_peek.json.gz")):
+            legacy = SimpleDB("pv_daily_peek", directory=directory)
+            for key in legacy.keys():
+                self.__pv_peeks.put((datetime.strptime(key, "%Y-%m-%d").date() - EPOCH).days, legacy.get(key))
+            logging.info(str(len(legacy.keys())) + " daily peeks imported")
 
     def __peek_info_loop(self):
         while self.__is_running:
             try:
-                logging.info("peek: " + str(self.pv_peek_hour_utc) + " utc (peeks: " + ", ".join(str(hour) for hour in self.__peeks()) +")")
+                logging.info("peek: " + str(self.pv_peek_hour_utc) + " utc (peeks: " + ", ".join(str(hour) for hour in self.__pv_peeks.hours) +")")
             except Exception as e:
                 logging.warning("error occurred on printing peek values " + str(e))
             sleep(13 * 60 * 60)
@@ -380,146 +746,171 @@ class Energy:
         return self.__consumption_aggregated_power.power_current_day
 
     def start(self):
-        Thread(target=self.__measure_loop, daemon=True).start()
-        Thread(target=self.__measure_channel1_loop, daemon=True).start()
-        Thread(target=self.__measure_channel2_loop, daemon=True).start()
-        Thread(target=self.__measure_channel3_loop, daemon=True).start()
+        if self.__is_poller_owner:
+            self.__poller.start()
         Thread(target=self.__peek_info_loop, daemon=True).start()
         Thread(target=self.__statistics_loop, daemon=True).start()
 
     def stop(self):
         self.__is_running = False
-
-    def __measure_loop(self):
-        while self.__is_running:
-            try:
-                self.__refresh_provider_values()
-                self.__refresh_pv_values()
-                self.__provider_power_smoothen_recorder.put(self.provider_power)
-                self.__consumption_power_smoothen_recorder.put(self.consumption_power)
-                self.__pv_power_smoothen_recorder.put(self.pv_power)
-                self.__pv_power_ch_1_smoothen_recorder.put(self.pv_power_channel_1)
-                self.__pv_power_ch_2_smoothen_recorder.put(self.pv_power_channel_2)
-                self.__pv_power_ch_3_smoothen_recorder.put(self.pv_power_channel_3)
-                self.__pv_surplus_power_smoothen_recorder.put(self.pv_surplus_power)
-                self.__pv_effective_power_smoothen_recorder.put(self.pv_effective_power)
-                self.__measure_daily_values()
-                self.__listener()
-                sleep(1.03)
-            except Exception as e:
-                logging.warning("error occurred on refresh " + str(e))
-                sleep(3)
-
-    def __measure_channel1_loop(self):
-        while self.__is_running:
-            try:
-                self.__refresh_pv_channel1_values()
-                self.__listener()
-                sleep(2.03)
-            except Exception as e:
-                logging.warning("error occurred on refresh " + str(e))
-                sleep(3)
-
-    def __measure_channel2_loop(self):
-        while self.__is_running:
-            try:
-                self.__refresh_pv_channel2_values()
-                self.__listener()
-                sleep(2.03)
-            except Exception as e:
-                logging.warning("error occurred on refresh " + str(e))
-                sleep(3)
-
-    def __measure_channel3_loop(self):
-        while self.__is_running:
+        # the storage is closed not before the poller has stopped calling the listeners. A shared poller has to be
+        # stopped by its owner before
+        if self.__is_poller_owner:
+            self.__poller.stop()
+        self.__archive.close()
+        self.__wal.close()
+
+    def __on_samples(self, samples: Dict[str, Sample]):
+        for source in ["provider", "pv"]:
+            if source in samples.keys():
+                gap = self.__sample_quality.received(source)
+                if gap is not None and source == "provider" and gap.to_epoch_sec - gap.from_epoch_sec >= 60:
+                    self.__backfill.request(gap)
+        updates = dict()
+        if "provider" in samples:
+            measure = samples["provider"].measure
+            # the measure of a single phase meter consists of the total (channel_a) only
+            is_single_phase = measure.channel_b is None and measure.channel_c is None
+            updates.update(provider_power=measure.total,
+                           provider_power_phase_a=None if is_single_phase else measure.channel_a,
+                           provider_power_phase_b=None if is_single_phase else measure.channel_b,
+                           provider_power_phase_c=None if is_single_phase else measure.channel_c,
+                           provider_measures_updated_utc=samples["provider"].time)
+        if "pv" in samples:
+            updates.update(pv_power=self.__positive(samples["pv"].measure.total),
+                           pv_measures_updated=samples["pv"].time)
+        snapshot, changed = self.__swap_snapshot(updates)
+        # the snapshot keeps the last values of a stale source. These are not valid anymore, so the smoothen values
+        # derived from it decay to 0 instead of holding the last value
+        provider_stale = self.provider_stale
+        pv_stale = self.pv_stale
+        self.__provider_power_smoothen_recorder.put(0 if provider_stale else snapshot.provider_power)
+        self.__consumption_power_smoothen_recorder.put(0 if provider_stale or pv_stale else snapshot.consumption_power)
+        self.__pv_power_smoothen_recorder.put(0 if pv_stale else snapshot.pv_power)
+        for recorder, power in zip(self.__pv_power_ch_smoothen_recorders, snapshot.pv_power_channels):
+            recorder.put(0 if pv_stale else power)
+        self.__pv_surplus_power_smoothen_recorder.put(0 if provider_stale else snapshot.pv_surplus_power)
+        self.__pv_effective_power_smoothen_recorder.put(0 if provider_stale or pv_stale else snapshot.pv_effective_power)
+        if snapshot.provider_power_phase_a is not None:
+            if provider_stale:
+                self.__provider_phases_smoothen_recorder.put((0, 0, 0))
+            else:
+                self.__provider_phases_smoothen_recorder.put((snapshot.provider_power_phase_a, snapshot.provider_power_phase_b or 0, snapshot.provider_power_phase_c or 0))
+        for tick_listener in self.__tick_listeners:
             try:
-                self.__refresh_pv_channel3_values()
-                self.__listener()
-                sleep(2.03)
+                tick_listener(snapshot)
             except Exception as e:
-                logging.warning("error occurred on refresh " + str(e))
-                sleep(3)
-
-    def __refresh_provider_values(self) -> bool:
-        try:
-            measure = self.__provider_shelly.measure()
-            self.provider_power = measure.total
-            self.provider_power_phase_a = measure.channel_a
-            self.provider_power_phase_b = measure.channel_b
-            self.provider_power_phase_c = measure.channel_c
-            self.provider_measures_updated_utc = datetime.utcnow()
-            return True
-        except Exception as e:
-            return False
-
-    def __refresh_pv_values(self) -> bool:
-        try:
-            pv_power = self.__pv_shelly.measure().total
-            if pv_power > 0:
-                self.pv_power = pv_power
-            else:
-                self.pv_power = 0
-            self.pv_measures_updated = datetime.utcnow()
-            return True
-        except Exception as e:
-            logging.warning("error occurred reading pv values " + str(e))
-            return False
-
-    def __refresh_pv_channel1_values(self) -> bool:
-        try:
-            pv_power_channel_1 = self.__pv_shelly_channel1.measure().total
-            if pv_power_channel_1 > 0:
-                self.pv_power_channel_1 = pv_power_channel_1
-            else:
-                self.pv_power_channel_1 = 0
-            return True
-        except Exception as e:
-            logging.warning("error occurred reading pv values " + str(e))
-            return False
-
-    def __refresh_pv_channel2_values(self) -> bool:
-        try:
-            pv_power_channel_2 = self.__pv_shelly_channel2.measure().total
-            if pv_power_channel_2 > 0:
-                self.pv_power_channel_2 = pv_power_channel_2
-            else:
-                self.pv_power_channel_2 = 0
-            return True
-        except Exception as e:
-            logging.warning("error occurred reading pv values " + str(e))
-            return False
-
-    def __refresh_pv_channel3_values(self) -> bool:
-        try:
-            pv_power_channel_3 = self.__pv_shelly_channel3.measure().total
-            if pv_power_channel_3 > 0:
-                self.pv_power_channel_3 = pv_power_channel_3
-            else:
-                self.pv_power_channel_3 = 0
-            return True
-        except Exception as e:
-            logging.warning("error occurred reading pv values " + str(e))
-            return False
-
-    def __measure_daily_values(self):
-        if datetime.utcnow() > self.__time_daily_value_measured + timedelta(seconds=29):
-            provider = self.provider_power_1m
-            if provider < 0:
-                provider = 0
-            self.__provider_aggregated_power.measure(provider)
-            self.__pv_aggregated_power.measure(self.pv_power_1m)
-            self.__pv_effective_aggregated_power.measure(self.pv_effective_power_1m)
-            self.__consumption_aggregated_power.measure(self.consumption_power_1m)
-            self.__surplus_aggregated_power.measure(self.pv_surplus_power_1m)
-            self.__time_daily_value_measured = datetime.utcnow()
+                logging.warning("error occurred on tick listener " + str(e))
+        if not provider_stale and not pv_stale:
+            values = {"provider": snapshot.provider_power,
+                      "consumption": snapshot.consumption_power,
+                      "pv": snapshot.pv_power,
+                      "surplus": snapshot.pv_surplus_power,
+                      "pv_effective": snapshot.pv_effective_power}
+            for num, power in enumerate(snapshot.pv_power_channels, start=1):
+                values["pv_channel_" + str(num)] = power
+            self.__archive.append(timebase.epoch(), values)
+        if self.__measure_daily_values():
+            changed.add(AGGREGATES)
+        self.__listener(changed)
+
+    def __on_channel_samples(self, samples: Dict[str, Sample]):
+        channel_updates = dict()
+        for num in range(1, self.num_pv_channels + 1):
+            sample = samples.get("pv_channel" + str(num), None)
+            if sample is not None:
+                channel_updates[num] = self.__positive(sample.measure.total)
+        _, changed = self.__swap_snapshot(dict(), channel_updates)
+        if len(changed) > 0:
+            self.__listener(changed)
+
+    def __on_counter_samples(self, samples: Dict[str, CounterSample]):
+        # meters without energy counters provide no sample
+        if "provider_counters" in samples.keys():
+            self.__grid_import_counter.put(int(samples["provider_counters"].counters.imported_wh))
+            self.__grid_export_counter.put(int(samples["provider_counters"].counters.exported_wh))
+        if "pv_counters" in samples.keys():
+            self.__pv_yield_counter.put(int(samples["pv_counters"].counters.imported_wh))
+        if len(samples) > 0:
+            self.__listener({AGGREGATES})
+
+    def __swap_snapshot(self, updates: Dict[str, Any], channel_updates: Dict[int, int] = None) -> Tuple[Snapshot, Set[str]]:
+        # the samples of the provider/pv schedule and the channel schedule may be received concurrently (e.g. pushed)
+        with self.__snapshot_lock:
+            snapshot = self.__snapshot
+            changed = {field for field, value in updates.items() if getattr(snapshot, field) != value}
+            changed_updates = {field: updates[field] for field in changed}
+            if channel_updates is not None:
+                channels = list(snapshot.pv_power_channels)
+                for num, power in channel_updates.items():
+                    if channels[num - 1] != power:
+                        channels[num - 1] = power
+                        changed.add("pv_power_channel_" + str(num))
+                changed_updates["pv_power_channels"] = tuple(channels)
+            if len(changed) > 0:
+                snapshot = replace(snapshot, version=snapshot.version + 1, **changed_updates)
+                self.__snapshot = snapshot
+            return snapshot, changed
+
+    def __positive(self, power: int) -> int:
+        return power if power > 0 else 0
+
+    def __measure_daily_values(self) -> bool:
+        self.__backfill.process()
+        if timebase.monotonic() > self.__time_daily_value_measured + 29:
+            # the smoothen values of a stale source decay to 0. The buckets are left empty instead (and backfilled, if possible)
+            provider_stale = self.provider_stale
+            pv_stale = self.pv_stale
+            if not provider_stale:
+                provider = self.provider_power_1m
+                if provider < 0:
+                    provider = 0
+                self.__provider_aggregated_power.measure(provider)
+                self.__surplus_aggregated_power.measure(self.pv_surplus_power_1m)
+                if self.has_provider_phases:
+                    for aggregated_power, power in zip(self.__provider_phase_aggregated_powers, self.__provider_phases_smoothen_recorder.watt_per_hour(minute_range=1)):
+                        aggregated_power.measure(power)
+            if not pv_stale:
+                self.__pv_aggregated_power.measure(self.pv_power_1m)
+            if not provider_stale and not pv_stale:
+                self.__pv_effective_aggregated_power.measure(self.pv_effective_power_1m)
+                self.__consumption_aggregated_power.measure(self.consumption_power_1m)
+            self.__time_daily_value_measured = timebase.monotonic()
             self.__compute_daily_pv_peek()
+            return True
+        return False
+
+    def __apply_records(self, records: List[EnergyRecord]):
+        # called on the polling thread. Consumption and effective pv are rebuilt for the minutes pv has been measured only
+        provider = dict()
+        surplus = dict()
+        phases = [dict() for _ in PHASES]
+        for record in records:
+            for minute_start in range(record.time, record.time + record.period_sec, 60):
+                minute = minute_start // 60
+                net_wh = [imported - exported for imported, exported in zip(record.imported_wh, record.exported_wh)]
+                net = round(sum(net_wh) * 3600 / record.period_sec)
+                provider[minute] = net if net > 0 else 0
+                surplus[minute] = -net if net < 0 else 0
+                for phase_powers, phase_wh in zip(phases, net_wh):
+                    phase_powers[minute] = round(phase_wh * 3600 / record.period_sec)
+        self.__provider_aggregated_power.backfill(provider)
+        self.__surplus_aggregated_power.backfill(surplus)
+        for aggregated_power, phase_powers in zip(self.__provider_phase_aggregated_powers, phases):
+            aggregated_power.backfill(phase_powers)
+        if len(provider) > 0:
+            pv = dict(self.__pv_aggregated_power.history("minute", min(provider.keys()) * 60, max(provider.keys()) * 60))
+            pv = {epoch_sec // 60: power for epoch_sec, power in pv.items()}
+            self.__consumption_aggregated_power.backfill({minute: provider[minute] - surplus[minute] + pv[minute] for minute in provider.keys() if minute in pv.keys()})
+            self.__pv_effective_aggregated_power.backfill({minute: max(0, pv[minute] - surplus[minute]) for minute in provider.keys() if minute in pv.keys()})
+        self.__listener({AGGREGATES})
 
     def __compute_daily_pv_peek(self):
-        pv_power_per_hour = { hour: self.__pv_aggregated_power.power_by_hour(hour) for hour in range(0, datetime.utcnow().hour) }
+        pv_power_per_hour = { hour: self.__pv_aggregated_power.power_by_hour(hour) for hour in range(0, timebase.calendar().hour_of_day(timebase.epoch())) }
         pv_power_per_hour = { hour: pv_power_per_hour[hour] for hour in pv_power_per_hour.keys() if pv_power_per_hour[hour] > self.__min_pv_power}
         pv_peek_hour = self.__pv_peek_hour_of_day(pv_power_per_hour)
         if pv_peek_hour is not None:
-            self.__pv_daily_peeks.put(datetime.utcnow().strftime("%Y-%m-%d"), pv_peek_hour, ttl_sec=30*24*60*60)
+            self.__pv_peeks.put(timebase.calendar().day, pv_peek_hour)
 
     def __pv_peek_hour_of_day(self, pv_power_per_hour: Dict[int, int]) -> Optional[int]:
         aggregated_power_of_day =  sum(pv_power_per_hour.values())
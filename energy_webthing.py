@@ -1,11 +1,86 @@
+import os
 import sys
+import signal
 import logging
 import tornado.ioloop
-from datetime import datetime, timedelta
-from webthing import (SingleThing, Property, Thing, Value, WebThingServer)
-from energy import Energy
-
-
+from threading import Lock
+from typing import Set, List, Tuple, Callable, Any, Optional, Dict
+from webthing import (SingleThing, MultipleThings, Property, Thing, Value, WebThingServer)
+from energy import Energy, Snapshot, AGGREGATES, PHASES
+from push import BatchedPush
+from timebase import timebase
+from history import HistoryHandler, ForecastHandler
+from metrics import MetricsHandler, registry, publish_seconds
+from poller import Poller
+from config import Config, SiteConfig, DEFAULT_DERIVED, load_config
+from control import LoadController, LoadRule
+
+
+
+class LazyValue(Value):
+
+    # value of a derived property. Once bound, it is computed on read and memoized for ttl_sec. Without binding it
+    # behaves like Value
+
+    def __init__(self, initial_value):
+        super().__init__(initial_value)
+        self.__compute: Optional[Callable[[], Any]] = None
+        self.__ttl_sec = 0.0
+        self.__computed_time = timebase.monotonic()
+
+    def bind(self, compute: Callable[[], Any], ttl_sec: float):
+        self.__compute = compute
+        self.__ttl_sec = ttl_sec
+
+    def get(self):
+        if self.__compute is not None:
+            now = timebase.monotonic()
+            if now > self.__computed_time + self.__ttl_sec:
+                # a changed value is notified as usual
+                self.notify_of_external_update(self.__compute())
+        return self.last_value
+
+    def notify_of_external_update(self, value):
+        self.__computed_time = timebase.monotonic()
+        super().notify_of_external_update(value)
+
+
+class PublishGroup:
+
+    def __init__(self, interval_sec: int):
+        self.__interval_sec = interval_sec
+        self.__last_update = timebase.monotonic() - 3 * 60 * 60
+        self.__changed: Set[str] = set()
+        self.__publications: List[Tuple[Value, Callable[[Snapshot], Any], Optional[Set[str]]]] = list()
+        self.__skipped: Set[int] = set()     # lazy publications changed, but not published so far
+
+    def add(self, value: Value, compute: Callable[[Snapshot], Any], depends_on: Optional[Set[str]] = None):
+        # a publication without dependencies is recomputed on each interval. compute gets the snapshot of the current
+        # publish run, so the instantaneous values published together belong to the same polling round
+        self.__publications.append((value, compute, depends_on))
+
+    def bind_lazy_values(self, snapshot: Callable[[], Snapshot]):
+        # the lazy values compute themselves on read, memoized for the interval of the group
+        for value, compute, _ in self.__publications:
+            if isinstance(value, LazyValue):
+                value.bind(lambda compute=compute: compute(snapshot()), max(1, self.__interval_sec))
+
+    def publish(self, changed: Set[str], snapshot: Snapshot, skip_lazy: bool = False):
+        # skip_lazy: the lazy values are not computed (nobody subscribed to them). Their changes are kept, so they are
+        # published by the first run without skip_lazy
+        self.__changed.update(changed)
+        now = timebase.monotonic()
+        if now > self.__last_update + self.__interval_sec:
+            self.__last_update = now
+            for num, (value, compute, depends_on) in enumerate(self.__publications):
+                is_changed = depends_on is None or not depends_on.isdisjoint(self.__changed)
+                if skip_lazy and isinstance(value, LazyValue):
+                    if is_changed:
+                        self.__skipped.add(num)
+                elif is_changed or num in self.__skipped:
+                    self.__skipped.discard(num)
+                    value.notify_of_external_update(compute(snapshot))
+            self.__changed = set()
 
 
 class EnergyThing(Thing):
@@ -13,19 +88,36 @@ class EnergyThing(Thing):
     # regarding capabilities refer https://iot.mozilla.org/schemas
     # there is also another schema registry http://iotschema.org/docs/full.html not used by webthing
 
-    def __init__(self, description: str, energy: Energy):
-        self.last_short_update = datetime.now() - timedelta(hours=3)
-        self.last_long_update = datetime.now() - timedelta(hours=3)
+    def __init__(self,
+                 description: str,
+                 energy: Energy,
+                 push_window_sec: float = 0.25,
+                 derived: Dict[str, List[int]] = None,
+                 id: str = 'urn:dev:ops:energy-1',
+                 site: str = "energy",
+                 lazy: bool = False,
+                 push_min_interval_sec: float = 0,
+                 push_deadband: float = 0):
+        derived = DEFAULT_DERIVED if derived is None else derived
+        self.__changed: Set[str] = set()
+        self.__changed_lock = Lock()
+        self.__publish_scheduled = False
 
         Thing.__init__(
             self,
-            'urn:dev:ops:energy-1',
+            id,
             'EnergySensor3',
             ['MultiLevelSensor'],
             description
         )
         self.ioloop = tornado.ioloop.IOLoop.current()
         self.energy = energy
+        self.site = site
+        # changed properties are pushed to the websocket subscribers as one batched message per window
+        self.__push: Optional[BatchedPush] = None
+        if push_window_sec > 0:
+            self.__push = BatchedPush(self, window_sec=push_window_sec, min_interval_sec=push_min_interval_sec, deadband=push_deadband)
+            self.__push.start()
         self.energy.set_listener(self.on_value_changed)
 
         self.pv_measures_updated = Value(energy.pv_measures_updated.strftime("%Y-%m-%dT%H:%M:%S+00:00"))
@@ -92,7 +184,7 @@ class EnergyThing(Thing):
                          'description': 'the current pv power produced',
                          'readOnly': True,
                      }))
-        self.pv_power_3m = Value(energy.pv_power_3m)
+        self.pv_power_3m = LazyValue(energy.pv_power_3m)
         self.add_property(
             Property(self,
                      'pv_power_3m',
@@ -105,174 +197,45 @@ class EnergyThing(Thing):
                          'readOnly': True,
                      }))
 
-        self.pv_power_channel_1 = Value(energy.pv_power_channel_1)
-        self.add_property(
-            Property(self,
-                     'pv_channel1',
-                     self.pv_power_channel_1,
-                     metadata={
-                         'title': 'pv_channel1',
-                         "type": "integer",
-                         'unit': 'watt',
-                         'description': 'the current pv power channel 1 produced',
-                         'readOnly': True,
-                     }))
-
-        self.pv_power_channel1_15s = Value(energy.pv_power_ch1_15s)
-        self.add_property(
-            Property(self,
-                     'pv_channel1_15s',
-                     self.pv_power_channel1_15s,
-                     metadata={
-                         'title': 'pv_channel1_15s',
-                         "type": "integer",
-                         'unit': 'watt',
-                         'description': 'the current pv power channel 1 produced (smoothen 15 sec)',
-                         'readOnly': True,
-                     }))
-
-        self.pv_power_channel1_5s = Value(energy.pv_power_ch1_5s)
-        self.add_property(
-            Property(self,
-                     'pv_channel1_5s',
-                     self.pv_power_channel1_5s,
-                     metadata={
-                         'title': 'pv_channel1_5s',
-                         "type": "integer",
-                         'unit': 'watt',
-                         'description': 'the current pv power channel 1produced (smoothen 5 sec)',
-                         'readOnly': True,
-                     }))
-
-        self.pv_power_channel2_5s = Value(energy.pv_power_ch2_5s)
-        self.add_property(
-            Property(self,
-                     'pv_channel2_5s',
-                     self.pv_power_channel2_5s,
-                     metadata={
-                         'title': 'pv_channel2_5s',
-                         "type": "integer",
-                         'unit': 'watt',
-                         'description': 'the current pv power channel 2produced (smoothen 5 sec)',
-                         'readOnly': True,
-                     }))
-
-        self.pv_power_channel3_5s = Value(energy.pv_power_ch3_5s)
-        self.add_property(
-            Property(self,
-                     'pv_channel3_5s',
-                     self.pv_power_channel3_5s,
-                     metadata={
-                         'title': 'pv_channel3_5s',
-                         "type": "integer",
-                         'unit': 'watt',
-                         'description': 'the current pv power channel 3produced (smoothen 5 sec)',
-                         'readOnly': True,
-                     }))
-
-        self.pv_power_channel_2 = Value(energy.pv_power_channel_2)
-        self.add_property(
-            Property(self,
-                     'pv_channel2',
-                     self.pv_power_channel_2,
-                     metadata={
-                         'title': 'pv_channel2',
-                         "type": "integer",
-                         'unit': 'watt',
-                         'description': 'the current pv power channel 2 produced',
-                         'readOnly': True,
-                     }))
-
-        self.pv_power_channel_3 = Value(energy.pv_power_channel_3)
-        self.add_property(
-            Property(self,
-                     'pv_channel3',
-                     self.pv_power_channel_3,
-                     metadata={
-                         'title': 'pv_channel3',
-                         "type": "integer",
-                         'unit': 'watt',
-                         'description': 'the current pv power channel 3 produced',
-                         'readOnly': True,
-                     }))
-
-        self.pv_power_channel_1u2 = Value(energy.pv_power_channel_1 + energy.pv_power_channel_2)
-        self.add_property(
-            Property(self,
-                     'pv_channel1u2',
-                     self.pv_power_channel_1u2,
-                     metadata={
-                         'title': 'pv_channel 1 & 2',
-                         "type": "integer",
-                         'unit': 'watt',
-                         'description': 'the current pv power channel 1 & 2 produced',
-                         'readOnly': True,
-                     }))
-
-        self.pv_power_channel1u2_5s = Value(energy.pv_power_ch1_5s + energy.pv_power_ch2_5s)
-        self.add_property(
-            Property(self,
-                     'pv_channel1u2_5s',
-                     self.pv_power_channel1u2_5s,
-                     metadata={
-                         'title': 'pv_power_channel1u2_5s',
-                         "type": "integer",
-                         'unit': 'watt',
-                         'description': 'the current pv power channel 1 & 2 produced (smoothen 5 sec)',
-                         'readOnly': True,
-                     }))
-
-        self.pv_power_channel1u2_15s = Value(energy.pv_power_ch1_15s + energy.pv_power_ch2_15s)
-        self.add_property(
-            Property(self,
-                     'pv_channel1u2_15s',
-                     self.pv_power_channel1u2_15s,
-                     metadata={
-                         'title': 'pv_power_channel1u2_15s',
-                         "type": "integer",
-                         'unit': 'watt',
-                         'description': 'the current pv power channel 1 & 2 produced (smoothen 15 sec)',
-                         'readOnly': True,
-                     }))
-
-        self.pv_power_channel1u2u3_15s = Value(energy.pv_power_ch1_15s + energy.pv_power_ch2_15s +  + energy.pv_power_ch3_15s)
-        self.add_property(
-            Property(self,
-                     'pv_channel1u2u3_15s',
-                     self.pv_power_channel1u2u3_15s,
-                     metadata={
-                         'title': 'pv_power_channel1u2u3_15s',
-                         "type": "integer",
-                         'unit': 'watt',
-                         'description': 'the current pv power channel 1 & 2 & 3 produced (smoothen 15 sec)',
-                         'readOnly': True,
-                     }))
-
-        self.pv_power_channel1u2u3_5s = Value(energy.pv_power_ch1_5s + energy.pv_power_ch2_5s +  + energy.pv_power_ch3_5s)
-        self.add_property(
-            Property(self,
-                     'pv_channel1u2u3_5s',
-                     self.pv_power_channel1u2u3_5s,
-                     metadata={
-                         'title': 'pv_power_channel1u2u3_5s',
-                         "type": "integer",
-                         'unit': 'watt',
-                         'description': 'the current pv power channel 1 & 2 & 3 produced (smoothen 5 sec)',
-                         'readOnly': True,
-                     }))
-
-        self.pv_power_channel_1u2u3 = Value(energy.pv_power_channel_1 + energy.pv_power_channel_2 + energy.pv_power_channel_3)
-        self.add_property(
-            Property(self,
-                     'pv_channel1u2u3',
-                     self.pv_power_channel_1u2u3,
-                     metadata={
-                         'title': 'pv_channel 1 & 2 & 3',
-                         "type": "integer",
-                         'unit': 'watt',
-                         'description': 'the current pv power channel 1 & 2 & 3 produced',
-                         'readOnly': True,
-                     }))
+        # the channel properties are named by the channel number (pv_channel1, pv_channel2, ...)
+        self.__pv_power_channels: List[Tuple[int, Value, LazyValue, LazyValue]] = list()
+        for num in range(1, energy.num_pv_channels + 1):
+            channel_values = (num, Value(energy.pv_power_channel(num)), LazyValue(energy.pv_power_channel_5s(num)), LazyValue(energy.pv_power_channel_15s(num)))
+            for suffix, value, description_suffix in zip(['', '_5s', '_15s'], channel_values[1:], ['', ' (smoothen 5 sec)', ' (smoothen 15 sec)']):
+                self.add_property(
+                    Property(self,
+                             'pv_channel' + str(num) + suffix,
+                             value,
+                             metadata={
+                                 'title': 'pv_channel' + str(num) + suffix,
+                                 "type": "integer",
+                                 'unit': 'watt',
+                                 'description': 'the current pv power channel ' + str(num) + ' produced' + description_suffix,
+                                 'readOnly': True,
+                             }))
+            self.__pv_power_channels.append(channel_values)
+
+        # derived series are the sum of channels such as pv_channel1u2 (channel 1 & 2)
+        self.__pv_power_derived: List[Tuple[List[int], Value, LazyValue, LazyValue]] = list()
+        for name, nums in derived.items():
+            nums = [num for num in nums if 1 <= num <= energy.num_pv_channels]
+            derived_values = (nums,
+                              Value(sum([energy.pv_power_channel(num) for num in nums])),
+                              LazyValue(sum([energy.pv_power_channel_5s(num) for num in nums])),
+                              LazyValue(sum([energy.pv_power_channel_15s(num) for num in nums])))
+            for suffix, value, description_suffix in zip(['', '_5s', '_15s'], derived_values[1:], ['', ' (smoothen 5 sec)', ' (smoothen 15 sec)']):
+                self.add_property(
+                    Property(self,
+                             name + suffix,
+                             value,
+                             metadata={
+                                 'title': name + suffix,
+                                 "type": "integer",
+                                 'unit': 'watt',
+                                 'description': 'the current pv power channel ' + ' & '.join([str(num) for num in nums]) + ' produced' + description_suffix,
+                                 'readOnly': True,
+                             }))
+            self.__pv_power_derived.append(derived_values)
 
         self.pv_effective_power = Value(energy.pv_effective_power)
         self.add_property(
@@ -300,7 +263,7 @@ class EnergyThing(Thing):
                          'readOnly': True,
                      }))
 
-        self.consumption_power_3m = Value(energy.consumption_power_3m)
+        self.consumption_power_3m = LazyValue(energy.consumption_power_3m)
         self.add_property(
             Property(self,
                      'consumption_3m',
@@ -328,7 +291,7 @@ class EnergyThing(Thing):
                          'readOnly': True,
                      }))
 
-        self.consumption_power_estimated_year = Value(energy.consumption_power_estimated_year)
+        self.consumption_power_estimated_year = LazyValue(energy.consumption_power_estimated_year)
         self.add_property(
             Property(self,
                      'consumption_estimated_year',
@@ -341,7 +304,7 @@ class EnergyThing(Thing):
                          'readOnly': True,
                      }))
 
-        self.pv_power_estimated_year = Value(energy.pv_power_estimated_year)
+        self.pv_power_estimated_year = LazyValue(energy.pv_power_estimated_year)
         self.add_property(
             Property(self,
                      'pv_estimated_year',
@@ -354,7 +317,7 @@ class EnergyThing(Thing):
                          'readOnly': True,
                      }))
 
-        self.pv_effective_power_estimated_year = Value(energy.pv_effective_power_estimated_year)
+        self.pv_effective_power_estimated_year = LazyValue(energy.pv_effective_power_estimated_year)
         self.add_property(
             Property(self,
                      'pv_effective_estimated_year',
@@ -367,7 +330,7 @@ class EnergyThing(Thing):
                          'readOnly': True,
                      }))
 
-        self.pv_effective_power_estimated_year = Value(energy.pv_effective_power_estimated_year)
+        self.pv_effective_power_estimated_year = LazyValue(energy.pv_effective_power_estimated_year)
         self.add_property(
             Property(self,
                      'pv_effective_estimated_year',
@@ -380,7 +343,7 @@ class EnergyThing(Thing):
                          'readOnly': True,
                      }))
 
-        self.pv_peek_hour_utc = Value(energy.pv_peek_hour_utc)
+        self.pv_peek_hour_utc = LazyValue(energy.pv_peek_hour_utc)
         self.add_property(
             Property(self,
                      'pv_peek_hour_utc',
@@ -393,7 +356,46 @@ class EnergyThing(Thing):
                          'readOnly': True,
                      }))
 
-        self.provider_power_estimated_year = Value(energy.provider_power_estimated_year)
+        self.pv_forecast_24h = LazyValue(energy.pv_forecast_24h)
+        self.add_property(
+            Property(self,
+                     'pv_forecast_24h',
+                     self.pv_forecast_24h,
+                     metadata={
+                         'title': 'pv_forecast_24h',
+                         "type": "integer",
+                         'unit': 'watt hour',
+                         'description': 'the forecasted pv energy of the next 24 hours (refer /forecast for the 15 min values)',
+                         'readOnly': True,
+                     }))
+
+        self.consumption_forecast_24h = LazyValue(energy.consumption_forecast_24h)
+        self.add_property(
+            Property(self,
+                     'consumption_forecast_24h',
+                     self.consumption_forecast_24h,
+                     metadata={
+                         'title': 'consumption_forecast_24h',
+                         "type": "integer",
+                         'unit': 'watt hour',
+                         'description': 'the forecasted energy consumption of the next 24 hours (refer /forecast for the 15 min values)',
+                         'readOnly': True,
+                     }))
+
+        self.pv_peek_hour_weighted_utc = LazyValue(energy.pv_peek_hour_weighted_utc)
+        self.add_property(
+            Property(self,
+                     'pv_peek_hour_weighted_utc',
+                     self.pv_peek_hour_weighted_utc,
+                     metadata={
+                         'title': 'pv_peek_hour_weighted_utc',
+                         "type": "integer",
+                         'unit': 'hour',
+                         'description': 'the peek pv hour (UTC), recent days weighted higher',
+                         'readOnly': True,
+                     }))
+
+        self.provider_power_estimated_year = LazyValue(energy.provider_power_estimated_year)
         self.add_property(
             Property(self,
                      'provider_power_estimated_year',
@@ -406,7 +408,7 @@ class EnergyThing(Thing):
                          'readOnly': True,
                      }))
 
-        self.provider_power_5s = Value(energy.provider_power_5s)
+        self.provider_power_5s = LazyValue(energy.provider_power_5s)
         self.add_property(
             Property(self,
                      'provider_5s',
@@ -419,7 +421,7 @@ class EnergyThing(Thing):
                          'readOnly': True,
                      }))
 
-        self.provider_power_5s_effective = Value(energy.provider_power_5s_effective)
+        self.provider_power_5s_effective = LazyValue(energy.provider_power_5s_effective)
         self.add_property(
             Property(self,
                      'provider_5s_effective',
@@ -432,7 +434,7 @@ class EnergyThing(Thing):
                          'readOnly': True,
                      }))
 
-        self.provider_power_15s_effective = Value(energy.provider_power_15s_effective)
+        self.provider_power_15s_effective = LazyValue(energy.provider_power_15s_effective)
         self.add_property(
             Property(self,
                      'provider_15s_effective',
@@ -445,7 +447,7 @@ class EnergyThing(Thing):
                          'readOnly': True,
                      }))
 
-        self.provider_power_current_hour = Value(energy.provider_power_current_hour)
+        self.provider_power_current_hour = LazyValue(energy.provider_power_current_hour)
         self.add_property(
             Property(self,
                      'provider_current_hour',
@@ -458,7 +460,7 @@ class EnergyThing(Thing):
                          'readOnly': True,
                      }))
 
-        self.provider_power_current_day = Value(energy.provider_power_current_day)
+        self.provider_power_current_day = LazyValue(energy.provider_power_current_day)
         self.add_property(
             Property(self,
                      'provider_current_day',
@@ -471,7 +473,7 @@ class EnergyThing(Thing):
                          'readOnly': True,
                      }))
 
-        self.provider_power_current_year = Value(energy.provider_power_current_year)
+        self.provider_power_current_year = LazyValue(energy.provider_power_current_year)
         self.add_property(
             Property(self,
                      'provider_current_year',
@@ -484,7 +486,84 @@ class EnergyThing(Thing):
                          'readOnly': True,
                      }))
 
-        self.pv_power_5s = Value(energy.pv_power_5s)
+        # the phase properties are named by the phase (provider_phase_a, provider_phase_b, ...)
+        self.__provider_power_phases: List[Tuple[str, Value, LazyValue, LazyValue, LazyValue]] = list()
+        for phase in PHASES:
+            phase_values = (phase,
+                            Value(getattr(energy, "provider_power_phase_" + phase)),
+                            LazyValue(energy.provider_power_phase_15s(phase)),
+                            LazyValue(energy.provider_power_phase_current_hour(phase)),
+                            LazyValue(energy.provider_power_phase_current_day(phase)))
+            for suffix, value, description_suffix in zip(['', '_15s', '_current_hour', '_current_day'], phase_values[1:], ['', ' (smoothen 15 sec)', ' (current hour)', ' (current day, watt hours)']):
+                self.add_property(
+                    Property(self,
+                             'provider_phase_' + phase + suffix,
+                             value,
+                             metadata={
+                                 'title': 'provider_phase_' + phase + suffix,
+                                 "type": "integer",
+                                 'unit': 'watt',
+                                 'description': 'the power provider phase ' + phase + ' (may be negative)' + description_suffix,
+                                 'readOnly': True,
+                             }))
+            self.__provider_power_phases.append(phase_values)
+
+        self.provider_power_phase_imbalance = LazyValue(energy.provider_power_phase_imbalance)
+        self.add_property(
+            Property(self,
+                     'provider_phase_imbalance',
+                     self.provider_power_phase_imbalance,
+                     metadata={
+                         'title': 'provider_phase_imbalance',
+                         "type": "integer",
+                         'unit': 'watt',
+                         'description': 'the difference between the highest and the lowest phase (smoothen 1 min)',
+                         'readOnly': True,
+                     }))
+
+        # energy based on the hardware counters of the meters (grid_import_current_day, grid_import_current_year, ...)
+        self.__counter_energies: List[Tuple[str, LazyValue, LazyValue]] = list()
+        for series in energy.counter_series:
+            counter_values = (series, LazyValue(energy.counter_energy_current_day(series)), LazyValue(energy.counter_energy_current_year(series)))
+            for suffix, value, description_suffix in zip(['_current_day', '_current_year'], counter_values[1:], [' current day', ' current year']):
+                self.add_property(
+                    Property(self,
+                             series + suffix,
+                             value,
+                             metadata={
+                                 'title': series + suffix,
+                                 "type": "integer",
+                                 'unit': 'watt hour',
+                                 'description': 'the ' + series.replace('_', ' ') + ' energy' + description_suffix + ' (meter counter)',
+                                 'readOnly': True,
+                             }))
+            self.__counter_energies.append(counter_values)
+
+        self.provider_stale = LazyValue(energy.provider_stale)
+        self.add_property(
+            Property(self,
+                     'provider_stale',
+                     self.provider_stale,
+                     metadata={
+                         'title': 'provider_stale',
+                         "type": "boolean",
+                         'description': 'true, if the provider meter has not been read recently. The provider based values are outdated',
+                         'readOnly': True,
+                     }))
+
+        self.pv_stale = LazyValue(energy.pv_stale)
+        self.add_property(
+            Property(self,
+                     'pv_stale',
+                     self.pv_stale,
+                     metadata={
+                         'title': 'pv_stale',
+                         "type": "boolean",
+                         'description': 'true, if the pv meter has not been read recently. The pv based values are outdated',
+                         'readOnly': True,
+                     }))
+
+        self.pv_power_5s = LazyValue(energy.pv_power_5s)
         self.add_property(
             Property(self,
                      'pv_5s',
@@ -497,7 +576,7 @@ class EnergyThing(Thing):
                          'readOnly': True,
                      }))
 
-        self.pv_power_15s = Value(energy.pv_power_15s)
+        self.pv_power_15s = LazyValue(energy.pv_power_15s)
         self.add_property(
             Property(self,
                      'pv_15s',
@@ -510,7 +589,7 @@ class EnergyThing(Thing):
                          'readOnly': True,
                      }))
 
-        self.pv_power_current_hour = Value(energy.pv_power_current_hour)
+        self.pv_power_current_hour = LazyValue(energy.pv_power_current_hour)
         self.add_property(
             Property(self,
                      'pv_current_hour',
@@ -523,7 +602,7 @@ class EnergyThing(Thing):
                          'readOnly': True,
                      }))
 
-        self.pv_power_current_day = Value(energy.pv_power_current_day)
+        self.pv_power_current_day = LazyValue(energy.pv_power_current_day)
         self.add_property(
             Property(self,
                      'pv_current_day',
@@ -536,7 +615,7 @@ class EnergyThing(Thing):
                          'readOnly': True,
                      }))
 
-        self.pv_power_current_year = Value(energy.pv_power_current_year)
+        self.pv_power_current_year = LazyValue(energy.pv_power_current_year)
         self.add_property(
             Property(self,
                      'pv_current_year',
@@ -549,7 +628,7 @@ class EnergyThing(Thing):
                          'readOnly': True,
                      }))
 
-        self.consumption_power_5s = Value(energy.consumption_power_5s)
+        self.consumption_power_5s = LazyValue(energy.consumption_power_5s)
         self.add_property(
             Property(self,
                      'consumption_5s',
@@ -562,7 +641,7 @@ class EnergyThing(Thing):
                          'readOnly': True,
                      }))
 
-        self.consumption_power_15s = Value(energy.consumption_power_15s)
+        self.consumption_power_15s = LazyValue(energy.consumption_power_15s)
         self.add_property(
             Property(self,
                      'consumption_15s',
@@ -575,7 +654,7 @@ class EnergyThing(Thing):
                          'readOnly': True,
                      }))
 
-        self.consumption_power_current_hour = Value(energy.consumption_power_current_hour)
+        self.consumption_power_current_hour = LazyValue(energy.consumption_power_current_hour)
         self.add_property(
             Property(self,
                      'consumption_current_hour',
@@ -588,7 +667,7 @@ class EnergyThing(Thing):
                          'readOnly': True,
                      }))
 
-        self.consumption_power_current_day = Value(energy.consumption_power_current_day)
+        self.consumption_power_current_day = LazyValue(energy.consumption_power_current_day)
         self.add_property(
             Property(self,
                      'consumption_current_day',
@@ -601,7 +680,7 @@ class EnergyThing(Thing):
                          'readOnly': True,
                      }))
 
-        self.consumption_power_current_year = Value(energy.consumption_power_current_year)
+        self.consumption_power_current_year = LazyValue(energy.consumption_power_current_year)
         self.add_property(
             Property(self,
                      'consumption_power_current_year',
@@ -614,7 +693,7 @@ class EnergyThing(Thing):
                          'readOnly': True,
                      }))
 
-        self.pv_surplus_power_5s = Value(energy.pv_surplus_power_5s)
+        self.pv_surplus_power_5s = LazyValue(energy.pv_surplus_power_5s)
         self.add_property(
             Property(self,
                      'pv_surplus_5s',
@@ -627,7 +706,7 @@ class EnergyThing(Thing):
                          'readOnly': True,
                      }))
 
-        self.pv_surplus_power_15s = Value(energy.pv_surplus_power_15s)
+        self.pv_surplus_power_15s = LazyValue(energy.pv_surplus_power_15s)
         self.add_property(
             Property(self,
                      'pv_surplus_15s',
@@ -640,7 +719,7 @@ class EnergyThing(Thing):
                          'readOnly': True,
                      }))
 
-        self.pv_surplus_power_5m = Value(energy.pv_surplus_power_5m)
+        self.pv_surplus_power_5m = LazyValue(energy.pv_surplus_power_5m)
         self.add_property(
             Property(self,
                      'pv_surplus_5m',
@@ -653,7 +732,7 @@ class EnergyThing(Thing):
                          'readOnly': True,
                      }))
 
-        self.pv_surplus_power_current_hour = Value(energy.pv_surplus_power_current_hour)
+        self.pv_surplus_power_current_hour = LazyValue(energy.pv_surplus_power_current_hour)
         self.add_property(
             Property(self,
                      'pv_surplus_current_hour',
@@ -666,83 +745,185 @@ class EnergyThing(Thing):
                          'readOnly': True,
                      }))
 
-    def on_value_changed(self):
+        energy = self.energy
+        on_change = PublishGroup(0)
+        on_change.add(self.provider_measures_updated_utc, lambda snapshot: snapshot.provider_measures_updated_utc.strftime("%Y-%m-%dT%H:%M:%S+00:00"), {"provider_measures_updated_utc"})
+        on_change.add(self.provider_power, lambda snapshot: snapshot.provider_power, {"provider_power"})
+        on_change.add(self.consumption_power, lambda snapshot: snapshot.consumption_power, {"provider_power", "pv_power"})
+        on_change.add(self.pv_measures_updated, lambda snapshot: snapshot.pv_measures_updated.strftime("%Y-%m-%dT%H:%M:%S+00:00"), {"pv_measures_updated"})
+        on_change.add(self.pv_power, lambda snapshot: snapshot.pv_power, {"pv_power"})
+        for num, value, _, _ in self.__pv_power_channels:
+            on_change.add(value, lambda snapshot, num=num: snapshot.pv_power_channels[num - 1], {"pv_power_channel_" + str(num)})
+        for nums, value, _, _ in self.__pv_power_derived:
+            on_change.add(value, lambda snapshot, nums=nums: sum([snapshot.pv_power_channels[num - 1] for num in nums]), {"pv_power_channel_" + str(num) for num in nums})
+        on_change.add(self.pv_effective_power, lambda snapshot: snapshot.pv_effective_power, {"provider_power", "pv_power"})
+        on_change.add(self.pv_effective_power_estimated_year, lambda _: energy.pv_effective_power_estimated_year, {AGGREGATES})
+        on_change.add(self.pv_peek_hour_utc, lambda _: energy.pv_peek_hour_utc, {AGGREGATES})
+        on_change.add(self.pv_peek_hour_weighted_utc, lambda _: energy.pv_peek_hour_weighted_utc, {AGGREGATES})
+        on_change.add(self.pv_surplus_power, lambda snapshot: snapshot.pv_surplus_power, {"provider_power"})
+        for phase, value, _, _, _ in self.__provider_power_phases:
+            on_change.add(value, lambda snapshot, phase=phase: getattr(snapshot, "provider_power_phase_" + phase), {"provider_power_phase_" + phase})
+
+        # smoothen values are time dependent. They are refreshed periodically
+        short_interval = PublishGroup(3)
+        short_interval.add(self.provider_power_estimated_year, lambda _: energy.provider_power_estimated_year, {AGGREGATES})
+        short_interval.add(self.provider_power_5s, lambda _: energy.provider_power_5s)
+        short_interval.add(self.provider_power_5s_effective, lambda _: energy.provider_power_5s_effective)
+        short_interval.add(self.provider_power_15s_effective, lambda _: energy.provider_power_15s_effective)
+        short_interval.add(self.consumption_power_5s, lambda _: energy.consumption_power_5s)
+        short_interval.add(self.consumption_power_15s, lambda _: energy.consumption_power_15s)
+        for num, _, value_5s, value_15s in self.__pv_power_channels:
+            short_interval.add(value_5s, lambda _, num=num: energy.pv_power_channel_5s(num))
+            short_interval.add(value_15s, lambda _, num=num: energy.pv_power_channel_15s(num))
+        for nums, _, value_5s, value_15s in self.__pv_power_derived:
+            short_interval.add(value_5s, lambda _, nums=nums: sum([energy.pv_power_channel_5s(num) for num in nums]))
+            short_interval.add(value_15s, lambda _, nums=nums: sum([energy.pv_power_channel_15s(num) for num in nums]))
+        short_interval.add(self.pv_power_5s, lambda _: energy.pv_power_5s)
+        short_interval.add(self.pv_power_15s, lambda _: energy.pv_power_15s)
+        short_interval.add(self.pv_surplus_power_5s, lambda _: energy.pv_surplus_power_5s)
+        short_interval.add(self.pv_surplus_power_15s, lambda _: energy.pv_surplus_power_15s)
+        short_interval.add(self.pv_surplus_power_5m, lambda _: energy.pv_surplus_power_5m)
+        for phase, _, value_15s, _, _ in self.__provider_power_phases:
+            short_interval.add(value_15s, lambda _, phase=phase: energy.provider_power_phase_15s(phase))
+        short_interval.add(self.provider_power_phase_imbalance, lambda _: energy.provider_power_phase_imbalance)
+        short_interval.add(self.provider_stale, lambda _: energy.provider_stale)
+        short_interval.add(self.pv_stale, lambda _: energy.pv_stale)
+
+        long_interval = PublishGroup(60)
+        long_interval.add(self.pv_power_3m, lambda _: energy.pv_power_3m)
+        long_interval.add(self.pv_forecast_24h, lambda _: energy.pv_forecast_24h, {AGGREGATES})
+        long_interval.add(self.consumption_forecast_24h, lambda _: energy.consumption_forecast_24h, {AGGREGATES})
+        long_interval.add(self.consumption_power_3m, lambda _: energy.consumption_power_3m)
+        long_interval.add(self.provider_power_current_hour, lambda _: energy.provider_power_current_hour, {AGGREGATES})
+        long_interval.add(self.provider_power_current_day, lambda _: energy.provider_power_current_day, {AGGREGATES})
+        long_interval.add(self.provider_power_current_year, lambda _: energy.provider_power_current_year, {AGGREGATES})
+        long_interval.add(self.consumption_power_current_hour, lambda _: energy.consumption_power_current_hour, {AGGREGATES})
+        long_interval.add(self.consumption_power_current_day, lambda _: energy.consumption_power_current_day, {AGGREGATES})
+        long_interval.add(self.consumption_power_current_year, lambda _: energy.consumption_power_current_year, {AGGREGATES})
+        long_interval.add(self.consumption_power_estimated_year, lambda _: energy.consumption_power_estimated_year, {AGGREGATES})
+        long_interval.add(self.pv_power_current_hour, lambda _: energy.pv_power_current_hour, {AGGREGATES})
+        long_interval.add(self.pv_power_current_day, lambda _: energy.pv_power_current_day, {AGGREGATES})
+        long_interval.add(self.pv_power_current_year, lambda _: energy.pv_power_current_year, {AGGREGATES})
+        long_interval.add(self.pv_power_estimated_year, lambda _: energy.pv_power_estimated_year, {AGGREGATES})
+        long_interval.add(self.pv_surplus_power_current_hour, lambda _: energy.pv_surplus_power_current_hour, {AGGREGATES})
+        for series, value_current_day, value_current_year in self.__counter_energies:
+            long_interval.add(value_current_day, lambda _, series=series: energy.counter_energy_current_day(series), {AGGREGATES})
+            long_interval.add(value_current_year, lambda _, series=series: energy.counter_energy_current_year(series), {AGGREGATES})
+        for phase, _, _, value_current_hour, value_current_day in self.__provider_power_phases:
+            long_interval.add(value_current_hour, lambda _, phase=phase: energy.provider_power_phase_current_hour(phase), {AGGREGATES})
+            long_interval.add(value_current_day, lambda _, phase=phase: energy.provider_power_phase_current_day(phase), {AGGREGATES})
+        self.__publish_groups = [on_change, short_interval, long_interval]
+        # in lazy mode the derived values are computed on read, as long as there is no websocket subscriber
+        self.__lazy = lazy
+        if lazy:
+            for group in self.__publish_groups:
+                group.bind_lazy_values(lambda: self.energy.snapshot)
+
+    def property_notify(self, property_):
+        if self.__push is None:
+            super().property_notify(property_)
+        else:
+            self.__push.notify(property_.name, property_.get_value())
+
+    def on_value_changed(self, changed: Set[str]):
+        # coalesce the notifications of the measure threads into a single ioloop callback
+        with self.__changed_lock:
+            self.__changed.update(changed)
+            if self.__publish_scheduled:
+                return
+            self.__publish_scheduled = True
         self.ioloop.add_callback(self._on_value_changed)
 
     def _on_value_changed(self):
-        self.provider_measures_updated_utc.notify_of_external_update(self.energy.provider_measures_updated_utc.strftime("%Y-%m-%dT%H:%M:%S+00:00"))
-        self.provider_power.notify_of_external_update(self.energy.provider_power)
-        self.consumption_power.notify_of_external_update(self.energy.consumption_power)
-        self.pv_measures_updated.notify_of_external_update(self.energy.pv_measures_updated.strftime("%Y-%m-%dT%H:%M:%S+00:00"))
-        self.pv_power.notify_of_external_update(self.energy.pv_power)
-        self.pv_power_channel_1.notify_of_external_update(self.energy.pv_power_channel_1)
-        self.pv_power_channel_2.notify_of_external_update(self.energy.pv_power_channel_2)
-        self.pv_power_channel_3.notify_of_external_update(self.energy.pv_power_channel_3)
-        self.pv_power_channel_1u2.notify_of_external_update(self.energy.pv_power_channel_1 + self.energy.pv_power_channel_2)
-        self.pv_power_channel_1u2u3.notify_of_external_update(self.energy.pv_power_channel_1 + self.energy.pv_power_channel_2 + self.energy.pv_power_channel_3)
-        self.pv_effective_power.notify_of_external_update(self.energy.pv_effective_power)
-        self.pv_effective_power_estimated_year.notify_of_external_update(self.energy.pv_effective_power_estimated_year)
-        self.pv_peek_hour_utc.notify_of_external_update(self.energy.pv_peek_hour_utc)
-        self.pv_surplus_power.notify_of_external_update(self.energy.pv_surplus_power)
-
-        if datetime.now() > self.last_short_update + timedelta(seconds=3):
-            self.last_short_update = datetime.now()
-            self.provider_power_estimated_year.notify_of_external_update(self.energy.provider_power_estimated_year)
-            self.provider_power_5s.notify_of_external_update(self.energy.provider_power_5s)
-            self.provider_power_5s_effective.notify_of_external_update(self.energy.provider_power_5s_effective)
-            self.provider_power_15s_effective.notify_of_external_update(self.energy.provider_power_15s_effective)
-            self.consumption_power_5s.notify_of_external_update(self.energy.consumption_power_5s)
-            self.consumption_power_15s.notify_of_external_update(self.energy.consumption_power_15s)
-            self.pv_power_channel1_5s.notify_of_external_update(self.energy.pv_power_ch1_5s)
-            self.pv_power_channel2_5s.notify_of_external_update(self.energy.pv_power_ch2_5s)
-            self.pv_power_channel3_5s.notify_of_external_update(self.energy.pv_power_ch3_5s)
-            self.pv_power_channel1_15s.notify_of_external_update(self.energy.pv_power_ch1_15s)
-            self.pv_power_channel1u2_5s.notify_of_external_update(self.energy.pv_power_ch1_5s + self.energy.pv_power_ch2_5s)
-            self.pv_power_channel1u2u3_5s.notify_of_external_update(self.energy.pv_power_ch1_5s + self.energy.pv_power_ch2_5s + self.energy.pv_power_ch3_5s)
-            self.pv_power_channel1u2_15s.notify_of_external_update(self.energy.pv_power_ch1_15s + self.energy.pv_power_ch2_15s)
-            self.pv_power_channel1u2u3_15s.notify_of_external_update(self.energy.pv_power_ch1_15s + self.energy.pv_power_ch2_15s + self.energy.pv_power_ch3_15s)
-            self.pv_power_5s.notify_of_external_update(self.energy.pv_power_5s)
-            self.pv_power_15s.notify_of_external_update(self.energy.pv_power_15s)
-            self.pv_surplus_power_5s.notify_of_external_update(self.energy.pv_surplus_power_5s)
-            self.pv_surplus_power_15s.notify_of_external_update(self.energy.pv_surplus_power_15s)
-            self.pv_surplus_power_5m.notify_of_external_update(self.energy.pv_surplus_power_5m)
-
-        if datetime.now() > self.last_long_update + timedelta(seconds=60):
-            self.last_long_update = datetime.now()
-            self.pv_power_3m.notify_of_external_update(self.energy.pv_power_3m)
-            self.consumption_power_3m.notify_of_external_update(self.energy.consumption_power_3m)
-            self.provider_power_current_hour.notify_of_external_update(self.energy.provider_power_current_hour)
-            self.provider_power_current_day.notify_of_external_update(self.energy.provider_power_current_day)
-            self.provider_power_current_year.notify_of_external_update(self.energy.provider_power_current_year)
-            self.consumption_power_current_hour.notify_of_external_update(self.energy.consumption_power_current_hour)
-            self.consumption_power_current_day.notify_of_external_update(self.energy.consumption_power_current_day)
-            self.consumption_power_current_year.notify_of_external_update(self.energy.consumption_power_current_year)
-            self.consumption_power_estimated_year.notify_of_external_update(self.energy.consumption_power_estimated_year)
-            self.pv_power_current_hour.notify_of_external_update(self.energy.pv_power_current_hour)
-            self.pv_power_current_day.notify_of_external_update(self.energy.pv_power_current_day)
-            self.pv_power_current_year.notify_of_external_update(self.energy.pv_power_current_year)
-            self.pv_power_estimated_year.notify_of_external_update(self.energy.pv_power_estimated_year)
-            self.pv_surplus_power_current_hour.notify_of_external_update(self.energy.pv_surplus_power_current_hour)
-
-
-def run_server(description: str,
-               port: int,
-               meter_addr_provider: str,
-               meter_addr_pv: str,
-               meter_addr_pv_channel1: str,
-               meter_addr_pv_channel2: str,
-               meter_addr_pv_channel3: str,
-               directory: str,
-               min_pv_power : int):
-    energy = Energy(meter_addr_provider, meter_addr_pv, meter_addr_pv_channel1, meter_addr_pv_channel2, meter_addr_pv_channel3, directory, min_pv_power)
-    server = WebThingServer(SingleThing(EnergyThing(description, energy)), port=port, disable_host_validation=True)
+        with self.__changed_lock:
+            changed = self.__changed
+            self.__changed = set()
+            self.__publish_scheduled = False
+        start = timebase.monotonic()
+        snapshot = self.energy.snapshot
+        skip_lazy = self.__lazy and len(self.subscribers) == 0
+        for group in self.__publish_groups:
+            group.publish(changed, snapshot, skip_lazy)
+        publish_seconds.observe(timebase.monotonic() - start, self.site)
+
+
+def register_energy_metrics(energies: Dict[str, Energy]):
+    # collected on scrape
+    registry.gauge("energy_power_watts", "current power", ("site", "series"),
+                   lambda: [((name, series), power) for name, energy in energies.items() for series, power in [("provider", energy.snapshot.provider_power),
+                                                                                                            ("pv", energy.snapshot.pv_power),
+                                                                                                            ("pv_effective", energy.snapshot.pv_effective_power),
+                                                                                                            ("consumption", energy.snapshot.consumption_power),
+                                                                                                            ("surplus", energy.snapshot.pv_surplus_power)]])
+    registry.gauge("energy_pv_channel_power_watts", "current pv power of a channel", ("site", "channel"),
+                   lambda: [((name, str(num)), power) for name, energy in energies.items() for num, power in enumerate(energy.snapshot.pv_power_channels, start=1)])
+    registry.gauge("energy_phase_power_watts", "current power of a provider phase (smoothen 15 sec)", ("site", "phase"),
+                   lambda: [((name, phase), energy.provider_power_phase_15s(phase)) for name, energy in energies.items() if energy.has_provider_phases for phase in PHASES])
+    registry.gauge("energy_current_day_watt_hours", "energy of the current day", ("site", "series"),
+                   lambda: [((name, series), power) for name, energy in energies.items() for series, power in [("provider", energy.provider_power_current_day),
+                                                                                                            ("pv", energy.pv_power_current_day),
+                                                                                                            ("pv_effective", energy.pv_effective_power_current_day),
+                                                                                                            ("consumption", energy.consumption_power_current_day)] +
+                                                                                                           [(series, energy.counter_energy_current_day(series)) for series in energy.counter_series]])
+    registry.gauge("energy_current_year_watt_hours", "energy of the current year", ("site", "series"),
+                   lambda: [((name, series), power) for name, energy in energies.items() for series, power in [("provider", energy.provider_power_current_year),
+                                                                                                            ("pv", energy.pv_power_current_year),
+                                                                                                            ("consumption", energy.consumption_power_current_year)]])
+    registry.gauge("energy_stale", "1, if a meter has not been read recently", ("site", "source"),
+                   lambda: [((name, source), 1 if stale else 0) for name, energy in energies.items() for source, stale in [("provider", energy.provider_stale), ("pv", energy.pv_stale)]])
+    registry.gauge("energy_snapshots_total", "measured value changes", ("site",),
+                   lambda: [((name,), energy.snapshot.version) for name, energy in energies.items()], type="counter")
+
+
+def run_server(config: Config):
+    sites = list()
+    if len(config.sites) == 1:
+        # a single site keeps the layout of the former releases (directory, thing id)
+        sites.append((config.sites[0], Energy(config.sites[0].provider, config.sites[0].pv, config.sites[0].pv_channels, config.directory, config.sites[0].min_pv_power, config.ingestion, pv_peek_window_days=config.sites[0].pv_peek_window_days)))
+    else:
+        # all meters are polled by a shared poller
+        poller = Poller()
+        for site in config.sites:
+            sites.append((site, Energy(site.provider, site.pv, site.pv_channels, os.path.join(config.directory, site.name), site.min_pv_power, config.ingestion, poller, site.pv_peek_window_days)))
+    if len(sites) == 1:
+        site, energy = sites[0]
+        things = SingleThing(EnergyThing(site.description, energy, config.push_window_sec, site.derived, site=site.name, lazy=config.lazy_properties,
+                                          push_min_interval_sec=config.push_min_interval_sec, push_deadband=config.push_deadband))
+    else:
+        things = MultipleThings([EnergyThing(site.description, energy, config.push_window_sec, site.derived, 'urn:dev:ops:energy-' + site.name, site.name, config.lazy_properties, config.push_min_interval_sec, config.push_deadband) for site, energy in sites], 'energy')
+    energies = {site.name: energy for site, energy in sites}
+    register_energy_metrics(energies)
+    controllers = [LoadController(energy, [LoadRule(**load) for load in site.loads]) for site, energy in sites if len(site.loads) > 0]
+    server = WebThingServer(things,
+                            port=config.port,
+                            disable_host_validation=True,
+                            additional_routes=[[r'/history/?', HistoryHandler, dict(energies=energies)],
+                                               [r'/forecast/?', ForecastHandler, dict(energies=energies)],
+                                               [r'/metrics/?', MetricsHandler]])
+    def on_sigterm(signum, frame):
+        # e.g. docker stop. Shut down like on Ctrl-C, so the buffered values are written
+        raise KeyboardInterrupt()
+    signal.signal(signal.SIGTERM, on_sigterm)
     try:
-        logging.info('starting the server http://localhost:' + str(port) + " (provider meter=" + meter_addr_provider + "; pv meter=" + meter_addr_pv + "; min pv power="  + str(min_pv_power) + ")")
-        energy.start()
+        for site, energy in sites:
+            logging.info('site ' + site.name + ' (provider meter=' + site.provider + "; pv meter=" + site.pv + "; pv channels=" + ", ".join(site.pv_channels) + "; min pv power="  + str(site.min_pv_power) + ")")
+            for load in site.loads:
+                logging.info('site ' + site.name + ' controls load ' + load["name"] + ' (relay=' + load["relay"] + ")")
+        logging.info('starting the server http://localhost:' + str(config.port) + " (ingestion=" + config.ingestion + ")")
+        if len(sites) > 1:
+            poller.start()
+        for site, energy in sites:
+            energy.start()
         server.start()
     except KeyboardInterrupt:
         logging.info('stopping the server')
-        energy.stop()
+        # the poller is stopped first, so no samples are processed while the storage is closed
+        if len(sites) > 1:
+            poller.stop()
+        for site, energy in sites:
+            energy.stop()
+        for controller in controllers:
+            controller.close()
         server.stop()
         logging.info('done')
 
@@ -751,4 +932,17 @@ if __name__ == '__main__':
     logging.basicConfig(format='%(asctime)s %(name)-20s: %(levelname)-8s %(message)s', level=logging.INFO, datefmt='%Y-%m-%d %H:%M:%S')
     logging.getLogger('tornado.access').setLevel(logging.ERROR)
     logging.getLogger('urllib3.connectionpool').setLevel(logging.WARNING)
-    run_server("description", int(sys.argv[1]), sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5], sys.argv[6], sys.argv[7], int(sys.argv[8]))
+    if len(sys.argv) == 2:
+        # energy_webthing.py <config file>
+        run_server(load_config(sys.argv[1]))
+    else:
+        # energy_webthing.py <port> <provider> <pv> <pv ch1> <pv ch2> <pv ch3> <directory> <min pv power> [<ingestion>]
+        run_server(Config(port=int(sys.argv[1]),
+                          directory=sys.argv[7],
+                          ingestion=sys.argv[9] if len(sys.argv) > 9 else "poll",
+                          sites=[SiteConfig(name="energy",
+                                            description="description",
+                                            provider=sys.argv[2],
+                                            pv=sys.argv[3],
+                                            pv_channels=[sys.argv[4], sys.argv[5], sys.argv[6]],
+                                            min_pv_power=int(sys.argv[8]))]))
@@ -0,0 +1,77 @@
+from math import exp, floor
+from threading import Lock
+from typing import List, Tuple, Callable, Optional, Dict
+from timebase import timebase
+
+
+class SeasonalProfile:
+
+    # Forecast based on the daily profile: per hour of day (utc) an exponentially smoothed value of the past days. The
+    # profile is updated incrementally by the hourly buckets closed since the last update. Forecasts are cached and
+    # refreshed once per hour. The first hours are blended with the current power (persistence), which dominates the
+    # very short horizon
+
+    def __init__(self,
+                 hourly: Callable[[float, float], List[Tuple[int, int]]],
+                 current_power: Callable[[], int],
+                 alpha: float = 0.3,
+                 warmup_days: int = 14,
+                 persistence_sec: float = 60 * 60):
+        self.__hourly = hourly
+        self.__current_power = current_power
+        self.__alpha = alpha
+        self.__warmup_days = warmup_days
+        self.__persistence_sec = persistence_sec
+        self.__lock = Lock()
+        self.__profile: List[Optional[float]] = [None] * 24
+        self.__last_closed_hour = -1
+        self.__cached: Tuple[int, Dict[Tuple[int, int], List[Tuple[int, int]]]] = (-1, dict())   # hour, forecast by (horizon, resolution)
+
+    def __update_profile(self, current_hour: int):
+        if self.__last_closed_hour < 0:
+            from_hour = current_hour - self.__warmup_days * 24
+        else:
+            from_hour = self.__last_closed_hour + 1
+        values = dict(self.__hourly(from_hour * 3600, (current_hour - 1) * 3600))
+        for hour in range(from_hour, current_hour):
+            value = values.get(hour * 3600, None)
+            if value is not None:
+                smoothed = self.__profile[hour % 24]
+                self.__profile[hour % 24] = value if smoothed is None else self.__alpha * value + (1 - self.__alpha) * smoothed
+        self.__last_closed_hour = current_hour - 1
+
+    def __profile_value(self, epoch_sec: float) -> float:
+        # linear interpolation between the centers of the hours
+        position = epoch_sec / 3600 - 0.5
+        hour = floor(position)
+        fraction = position - hour
+        lower = self.__profile[hour % 24]
+        upper = self.__profile[(hour + 1) % 24]
+        lower = 0 if lower is None else lower
+        upper = 0 if upper is None else upper
+        return lower * (1 - fraction) + upper * fraction
+
+    def forecast(self, horizon_hours: int = 24, resolution_sec: int = 15 * 60) -> List[Tuple[int, int]]:
+        # (start time of the slot as epoch sec, average watt) of the upcoming slots
+        now = timebase.epoch()
+        current_hour = int(now) // 3600
+        cached_hour, cached = self.__cached
+        if cached_hour == current_hour and (horizon_hours, resolution_sec) in cached.keys():
+            return cached[(horizon_hours, resolution_sec)]
+        with self.__lock:
+            if self.__cached[0] != current_hour:
+                self.__update_profile(current_hour)
+                self.__cached = (current_hour, dict())
+            current_power = self.__current_power()
+            first_slot = (int(now) // resolution_sec + 1) * resolution_sec
+            forecast = list()
+            for slot in range(first_slot, first_slot + horizon_hours * 3600, resolution_sec):
+                middle = slot + resolution_sec / 2
+                weight = exp(-(middle - now) / self.__persistence_sec)
+                forecast.append((slot, round(weight * current_power + (1 - weight) * self.__profile_value(middle))))
+            self.__cached[1][(horizon_hours, resolution_sec)] = forecast
+        return forecast
+
+    def energy(self, horizon_hours: int = 24) -> int:
+        # forecasted watt hours of the horizon
+        return round(sum([power for _, power in self.forecast(horizon_hours, 15 * 60)]) / 4)
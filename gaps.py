@@ -0,0 +1,128 @@
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from dataclasses import dataclass
+from typing import List, Dict, Optional, Callable, Tuple
+from redzoo.database.simple import SimpleDB
+from shelly import EnergyRecord
+from timebase import timebase
+from metrics import registry
+
+
+sample_gaps = registry.counter("sample_gaps_total", "polling gaps of a meter", ("addr",))
+backfilled_minutes = registry.counter("backfilled_minutes_total", "minute buckets rebuilt from the records of a meter", ("addr",))
+
+
+@dataclass(frozen=True)
+class Gap:
+    source: str
+    from_epoch_sec: float             # time of the last sample before the gap
+    to_epoch_sec: Optional[float]     # time of the first sample after the gap, or None if the gap is still open
+
+
+class SampleQuality:
+
+    # Tracks the time of the last sample per source (e.g. provider, pv). A source without samples for stale_after_sec
+    # is stale. The recent closed gaps are kept in memory
+
+    def __init__(self, sources: Dict[str, str], stale_after_sec: float = 10, max_gaps: int = 100):
+        self.__addrs = sources    # addr by source
+        self.__stale_after_sec = stale_after_sec
+        self.__last_received: Dict[str, Tuple[float, float]] = {source: (timebase.monotonic(), timebase.epoch()) for source in sources.keys()}   # monotonic, epoch
+        self.__gaps: deque = deque(maxlen=max_gaps)
+
+    def received(self, source: str) -> Optional[Gap]:
+        # returns the gap closed by this sample, if any
+        now = (timebase.monotonic(), timebase.epoch())
+        last_monotonic, last_epoch = self.__last_received[source]
+        self.__last_received[source] = now
+        if now[0] - last_monotonic > self.__stale_after_sec:
+            gap = Gap(source, last_epoch, now[1])
+            self.__gaps.append(gap)
+            sample_gaps.inc(self.__addrs[source])
+            logging.warning("no samples of " + source + " (" + self.__addrs[source] + ") for " + str(round(now[0] - last_monotonic)) + " sec")
+            return gap
+        return None
+
+    def is_stale(self, source: str) -> bool:
+        return timebase.monotonic() - self.__last_received[source][0] > self.__stale_after_sec
+
+    def last_received_epoch(self, source: str) -> float:
+        # start of the next (or the open) gap of the source
+        return self.__last_received[source][1]
+
+    def gaps(self, from_epoch_sec: float, to_epoch_sec: float) -> List[Gap]:
+        # closed and open gaps overlapping the range
+        gaps = list(self.__gaps)
+        for source, (_, last_epoch) in self.__last_received.items():
+            if self.is_stale(source):
+                gaps.append(Gap(source, last_epoch, None))
+        return [gap for gap in gaps if gap.from_epoch_sec <= to_epoch_sec and (gap.to_epoch_sec is None or gap.to_epoch_sec >= from_epoch_sec)]
+
+
+class Backfill:
+
+    # Rebuilds the minute buckets of a gap from the records stored on the meter (EMData of the Pro3EM). The device
+    # writes a record at the end of each minute, so the records are requested delay_sec after the gap has been closed. The records are fetched
+    # on a worker thread and handed over to apply() by process(), which is called on the polling thread. If a directory
+    # is given, the gaps not backfilled so far are stored and requested again after a restart
+
+    MAX_AGE_SEC = 7 * 24 * 60 * 60
+
+    def __init__(self, addr: str, records: Callable[[int, int], Optional[List[EnergyRecord]]], apply: Callable[[List[EnergyRecord]], None], delay_sec: float = 70, directory: Optional[str] = None):
+        self.__addr = addr
+        self.__records = records
+        self.__apply = apply
+        self.__delay_sec = delay_sec
+        self.__requested: List[Tuple[float, Gap]] = list()     # due time (monotonic), gap
+        self.__fetching: List[Tuple[Gap, Future]] = list()
+        self.__executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="backfill")
+        self.__db = None if directory is None else SimpleDB("backfill_gaps", directory=directory)
+        if self.__db is not None:
+            for source, from_epoch_sec, to_epoch_sec in self.__db.values():
+                logging.info("backfill of " + source + " gap " + str(int(from_epoch_sec)) + ".." + str(int(to_epoch_sec)) + " has not been completed. Requesting it again")
+                self.__requested.append((timebase.monotonic() + self.__delay_sec, Gap(source, from_epoch_sec, to_epoch_sec)))
+
+    def request(self, gap: Gap):
+        if self.__db is not None:
+            self.__db.put(self.__key(gap), [gap.source, gap.from_epoch_sec, gap.to_epoch_sec], ttl_sec=self.MAX_AGE_SEC)
+        self.__requested.append((timebase.monotonic() + self.__delay_sec, gap))
+
+    @staticmethod
+    def __key(gap: Gap) -> str:
+        return gap.source + "_" + str(int(gap.from_epoch_sec)) + "_" + str(int(gap.to_epoch_sec))
+
+    def __fetch(self, gap: Gap) -> List[EnergyRecord]:
+        # the minutes holding the last sample before and the first sample after the gap are partially stale as well
+        from_epoch_sec = int(gap.from_epoch_sec) // 60 * 60
+        to_epoch_sec = int(gap.to_epoch_sec) // 60 * 60
+        records = self.__records(from_epoch_sec, to_epoch_sec)
+        if records is None:
+            logging.info(self.__addr + " does not provide records. Gap " + str(from_epoch_sec) + ".." + str(to_epoch_sec) + " is not backfilled")
+            return []
+        return [record for record in records if from_epoch_sec <= record.time <= to_epoch_sec]
+
+    def process(self):
+        now = timebase.monotonic()
+        due = [gap for due_time, gap in self.__requested if due_time <= now]
+        if len(due) > 0:
+            # a gap is listed as requested or fetching until its records are applied (see pending_from_epoch_sec)
+            for gap in due:
+                self.__fetching.append((gap, self.__executor.submit(self.__fetch, gap)))
+            self.__requested = [(due_time, gap) for due_time, gap in self.__requested if due_time > now]
+        for gap, future in [(gap, future) for gap, future in self.__fetching if future.done()]:
+            if future.exception() is not None:
+                logging.warning("error occurred fetching the records of " + self.__addr + " " + str(future.exception()))
+            elif len(future.result()) > 0:
+                records = future.result()
+                self.__apply(records)
+                backfilled_minutes.inc(self.__addr, amount=len(records))
+                logging.info(str(len(records)) + " minutes backfilled by the records of " + self.__addr)
+            self.__fetching.remove((gap, future))
+            if self.__db is not None:
+                self.__db.delete(self.__key(gap))
+
+    def pending_from_epoch_sec(self) -> Optional[float]:
+        # start of the earliest gap requested, but not backfilled so far. May be called by other threads
+        gaps = [gap for _, gap in list(self.__requested)] + [gap for gap, _ in list(self.__fetching)]
+        return min([gap.from_epoch_sec for gap in gaps]) if len(gaps) > 0 else None
@@ -0,0 +1,122 @@
+import json
+from datetime import datetime, timezone
+from typing import Dict
+from tornado.web import RequestHandler, HTTPError
+from energy import Energy
+from timebase import timebase
+
+
+RESOLUTIONS = {"minute": 60, "hour": 60 * 60, "day": 24 * 60 * 60}
+
+# default range per resolution, if from is not given
+DEFAULT_RANGES = {"minute": 60 * 60, "hour": 24 * 60 * 60, "day": 31 * 24 * 60 * 60}
+
+
+def site_energy(handler: RequestHandler, energies: Dict[str, Energy]) -> Energy:
+    # the site parameter is required, if multiple sites are served
+    if len(energies) == 1:
+        return list(energies.values())[0]
+    site = handler.get_argument("site")
+    if site not in energies.keys():
+        raise HTTPError(400, "unknown site " + site + " (supported: " + ", ".join(energies.keys()) + ")")
+    return energies[site]
+
+
+class HistoryHandler(RequestHandler):
+
+    # e.g. /history?series=pv&resolution=hour&from=2024-04-30T00:00:00&to=2024-05-01T00:00:00&format=csv
+
+    def initialize(self, energies: Dict[str, Energy]):
+        self.energies = energies
+
+    def set_default_headers(self, *args, **kwargs):
+        self.set_header('Access-Control-Allow-Origin', '*')
+
+    def __epoch_sec(self, name: str, default_value: float) -> float:
+        value = self.get_argument(name, None)
+        if value is None:
+            return default_value
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        try:
+            dt = datetime.fromisoformat(value)
+            if dt.tzinfo is None:
+                dt = dt.replace(tzinfo=timezone.utc)
+            return dt.timestamp()
+        except ValueError:
+            raise HTTPError(400, "invalid " + name + " " + value + " (epoch sec or ISO8601 expected)")
+
+    def get(self):
+        energy = site_energy(self, self.energies)
+        series = self.get_argument("series")
+        if series not in energy.history_series:
+            raise HTTPError(400, "unknown series " + series + " (supported: " + ", ".join(energy.history_series) + ")")
+        resolution = self.get_argument("resolution", "hour")
+        if resolution not in energy.history_resolutions(series):
+            raise HTTPError(400, "unsupported resolution " + resolution + " of " + series + " (supported: " + ", ".join(energy.history_resolutions(series)) + ")")
+        now = timebase.epoch()
+        to_epoch_sec = self.__epoch_sec("to", now)
+        from_epoch_sec = self.__epoch_sec("from", to_epoch_sec - DEFAULT_RANGES[resolution])
+        values = energy.history(series, resolution, from_epoch_sec, to_epoch_sec)
+        # the counter series hold the energy per bucket, the aggregated ones the average power
+        is_energy = series in energy.counter_series
+
+        # buckets of a closed period will not change anymore, except by a backfill of a provider gap
+        resolution_sec = RESOLUTIONS[resolution]
+        if int(to_epoch_sec) // resolution_sec < int(min(now, energy.backfill_horizon_epoch_sec)) // resolution_sec:
+            self.set_header("Cache-Control", "public, max-age=86400")
+        else:
+            self.set_header("Cache-Control", "no-cache")
+
+        if self.get_argument("format", "json") == "csv":
+            self.set_header("Content-Type", "text/csv")
+            self.write(("time,energy\n" if is_energy else "time,power\n") + "".join([datetime.fromtimestamp(epoch_sec, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S+00:00") + "," + str(value) + "\n" for epoch_sec, value in values]))
+        else:
+            self.set_header("Content-Type", "application/json")
+            # periods the meters have not been read. The buckets are left empty or have been rebuilt by the records of the meter
+            gaps = [{"source": gap.source, "from": int(gap.from_epoch_sec), "to": None if gap.to_epoch_sec is None else int(gap.to_epoch_sec)} for gap in energy.gaps(from_epoch_sec, to_epoch_sec)]
+            self.write(json.dumps({"series": series,
+                                   "resolution": resolution,
+                                   "unit": "watt hour" if is_energy else "watt",
+                                   "values": [[epoch_sec, value] for epoch_sec, value in values],
+                                   "gaps": gaps},
+                                  separators=(',', ':')))
+
+
+class ForecastHandler(RequestHandler):
+
+    # e.g. /forecast?series=pv&hours=24&format=csv
+
+    def initialize(self, energies: Dict[str, Energy]):
+        self.energies = energies
+
+    def set_default_headers(self, *args, **kwargs):
+        self.set_header('Access-Control-Allow-Origin', '*')
+
+    def get(self):
+        energy = site_energy(self, self.energies)
+        series = self.get_argument("series")
+        if series not in energy.forecast_series:
+            raise HTTPError(400, "unknown series " + series + " (supported: " + ", ".join(energy.forecast_series) + ")")
+        try:
+            hours = int(self.get_argument("hours", "24"))
+        except ValueError:
+            raise HTTPError(400, "invalid hours " + self.get_argument("hours"))
+        if not 1 <= hours <= 48:
+            raise HTTPError(400, "hours out of range (1..48)")
+        values = energy.forecast(series, hours)
+
+        # forecasts are refreshed once per hour
+        self.set_header("Cache-Control", "public, max-age=" + str(3600 - int(timebase.epoch()) % 3600))
+        if self.get_argument("format", "json") == "csv":
+            self.set_header("Content-Type", "text/csv")
+            self.write("time,power\n" + "".join([datetime.fromtimestamp(epoch_sec, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S+00:00") + "," + str(value) + "\n" for epoch_sec, value in values]))
+        else:
+            self.set_header("Content-Type", "application/json")
+            self.write(json.dumps({"series": series,
+                                   "resolution": "15min",
+                                   "unit": "watt",
+                                   "values": [[epoch_sec, value] for epoch_sec, value in values]},
+                                  separators=(',', ':')))
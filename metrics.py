@@ -0,0 +1,139 @@
+from bisect import bisect_left
+from threading import Lock
+from typing import List, Dict, Tuple, Callable, Iterable
+from tornado.web import RequestHandler
+
+
+# Minimal Prometheus text exposition (version 0.0.4). Observing a value costs a lock and a bisect, so the
+# instrumentation of the 1Hz hot paths is negligible
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [name + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"' for name, value in zip(names, values)]
+    if len(extra) > 0:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if len(pairs) > 0 else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.__values: Dict[Tuple[str, ...], float] = dict()
+        self.__lock = Lock()
+
+    def inc(self, *labelvalues: str, amount: float = 1):
+        with self.__lock:
+            self.__values[labelvalues] = self.__values.get(labelvalues, 0) + amount
+
+    def render(self) -> List[str]:
+        with self.__lock:
+            values = list(self.__values.items())
+        return ["# HELP " + self.name + " " + self.help, "# TYPE " + self.name + " counter"] + \
+               [self.name + _labels(self.labelnames, labelvalues) + " " + _number(value) for labelvalues, value in values]
+
+
+class Histogram:
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.__buckets = tuple(buckets) + (float("inf"),)
+        self.__values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = dict()   # bucket counts (not cumulated), [sum]
+        self.__lock = Lock()
+
+    def observe(self, value: float, *labelvalues: str):
+        idx = bisect_left(self.__buckets, value)
+        with self.__lock:
+            counts, total = self.__values.get(labelvalues, (None, None))
+            if counts is None:
+                counts, total = [0] * len(self.__buckets), [0.0]
+                self.__values[labelvalues] = (counts, total)
+            counts[idx] += 1
+            total[0] += value
+
+    def render(self) -> List[str]:
+        with self.__lock:
+            values = [(labelvalues, list(counts), total[0]) for labelvalues, (counts, total) in self.__values.items()]
+        lines = ["# HELP " + self.name + " " + self.help, "# TYPE " + self.name + " histogram"]
+        for labelvalues, counts, total in values:
+            cumulated = 0
+            for bound, count in zip(self.__buckets, counts):
+                cumulated += count
+                lines.append(self.name + "_bucket" + _labels(self.labelnames, labelvalues, 'le="' + _number(bound) + '"') + " " + str(cumulated))
+            lines.append(self.name + "_sum" + _labels(self.labelnames, labelvalues) + " " + _number(total))
+            lines.append(self.name + "_count" + _labels(self.labelnames, labelvalues) + " " + str(cumulated))
+        return lines
+
+
+class Gauge:
+
+    # the values are collected on scrape, so gauges do not cost anything on the hot path
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...], collect: Callable[[], Iterable[Tuple[Tuple[str, ...], float]]], type: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.__collect = collect
+        self.__type = type
+
+    def render(self) -> List[str]:
+        return ["# HELP " + self.name + " " + self.help, "# TYPE " + self.name + " " + self.__type] + \
+               [self.name + _labels(self.labelnames, labelvalues) + " " + _number(value) for labelvalues, value in self.__collect()]
+
+
+class Registry:
+
+    def __init__(self):
+        self.__metrics: Dict[str, object] = dict()
+        self.__lock = Lock()
+
+    def register(self, metric):
+        with self.__lock:
+            self.__metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name: str, help: str, labelnames: Tuple[str, ...], collect: Callable[[], Iterable[Tuple[Tuple[str, ...], float]]], type: str = "gauge") -> Gauge:
+        return self.register(Gauge(name, help, labelnames, collect, type))
+
+    def render(self) -> str:
+        with self.__lock:
+            metrics = list(self.__metrics.values())
+        return "\n".join([line for metric in metrics for line in metric.render()]) + "\n"
+
+
+registry = Registry()
+
+shelly_request_seconds = registry.histogram("shelly_request_seconds", "duration of the http requests to the shelly devices", ("addr",))
+shelly_request_retries = registry.counter("shelly_request_retries_total", "retried http requests to the shelly devices", ("addr",))
+shelly_request_failures = registry.counter("shelly_request_failures_total", "measures failed after all retries", ("addr",))
+shelly_circuit_rejections = registry.counter("shelly_circuit_rejections_total", "measures rejected by an open circuit", ("addr",))
+shelly_session_renewals = registry.counter("shelly_session_renewals_total", "renewed http sessions", ("addr",))
+shelly_auto_selects = registry.counter("shelly_auto_select_total", "device type detections", ("addr",))
+publish_seconds = registry.histogram("energy_publish_seconds", "duration of publishing the changed properties", ("site",), (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+storage_sync_seconds = registry.histogram("storage_sync_seconds", "duration of writing a store to disk", ("store",))
+
+
+class MetricsHandler(RequestHandler):
+
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.write(registry.render())
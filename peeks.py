@@ -0,0 +1,77 @@
+from threading import Lock
+from typing import Tuple, List, Optional
+from timeseries import TimeSeries
+from timebase import timebase
+
+
+class PeekHourIndex:
+
+    # Histogram of the daily pv peek hours (utc) within the window of the last days. It is updated on put and rebuilt
+    # on day change only, so a query costs O(24) instead of scanning the days. The recency weighted hours favour the
+    # days of the current season (weight halves per half life)
+
+    def __init__(self, series: TimeSeries, window_days: int = 30, half_life_days: float = 10):
+        self.__series = series
+        self.__window_days = min(window_days, series.capacity)
+        self.__half_life_days = half_life_days
+        self.__lock = Lock()
+        self.__state: Tuple[int, Tuple[int, ...], Tuple[float, ...]] = (-1, tuple([0] * 24), tuple([0.0] * 24))   # day, counts, weights
+
+    @property
+    def window_days(self) -> int:
+        return self.__window_days
+
+    def __histogram(self, today: int) -> Tuple[int, Tuple[int, ...], Tuple[float, ...]]:
+        counts = [0] * 24
+        weights = [0.0] * 24
+        for day, hour in self.__series.items(today - self.__window_days + 1, today):
+            if 0 <= hour < 24:
+                counts[hour] += 1
+                weights[hour] += 0.5 ** ((today - day) / self.__half_life_days)
+        return today, tuple(counts), tuple(weights)
+
+    def __current(self) -> Tuple[int, Tuple[int, ...], Tuple[float, ...]]:
+        state = self.__state
+        today = timebase.calendar().day
+        if state[0] != today:
+            with self.__lock:
+                state = self.__histogram(today)
+                self.__state = state
+        return state
+
+    def put(self, day: int, hour: int):
+        with self.__lock:
+            if self.__series.put(day, hour) != hour:
+                # the histogram is invalidated only if the peek of the day has changed
+                self.__state = self.__histogram(timebase.calendar().day)
+
+    @property
+    def hours(self) -> List[int]:
+        # the peek hours of the window (sorted)
+        _, counts, _ = self.__current()
+        return [hour for hour in range(24) for _ in range(counts[hour])]
+
+    def percentile(self, percent: float, default_hour: int = 12) -> int:
+        _, counts, _ = self.__current()
+        return self.__percentile(counts, percent, default_hour)
+
+    def weighted_percentile(self, percent: float, default_hour: int = 12) -> int:
+        _, _, weights = self.__current()
+        return self.__percentile(weights, percent, default_hour)
+
+    @staticmethod
+    def __percentile(histogram, percent: float, default_hour: int) -> int:
+        total = sum(histogram)
+        if total == 0:
+            return default_hour
+        # same rank semantic as sorted(peeks)[int(len(peeks) * percent / 100)]
+        rank = total * percent / 100
+        cumulated = 0
+        last_hour: Optional[int] = None
+        for hour in range(24):
+            if histogram[hour] > 0:
+                cumulated += histogram[hour]
+                last_hour = hour
+                if cumulated > rank:
+                    return hour
+        return last_hour
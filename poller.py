@@ -0,0 +1,133 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from threading import Thread
+from typing import Callable, Dict, List, Tuple, Any, Optional
+from shelly import Meter, Measure, CounterSource, EnergyCounters
+
+
+@dataclass(frozen=True)
+class Sample:
+    measure: Measure
+    time: datetime    # utc datetime the measure has been received
+
+
+@dataclass(frozen=True)
+class CounterSample:
+    counters: EnergyCounters
+    time: datetime    # utc datetime the counters have been received
+
+
+class Poller:
+
+    def __init__(self):
+        self.__is_running = False
+        self.__thread: Optional[Thread] = None
+        self.__loop: Optional[asyncio.AbstractEventLoop] = None
+        self.__stopped: Optional[asyncio.Event] = None
+        self.__schedules: List[Tuple[float, Dict[str, Any], Callable[[Dict[str, Any]], None], Callable[[Any], Any]]] = list()
+        self.__streams: List[Tuple[Any, Callable[[Sample], None]]] = list()
+
+    def schedule(self, period_sec: float, meters: Dict[str, Meter], listener: Callable[[Dict[str, Sample]], None]):
+        # all meters of a schedule are polled concurrently. The listener is called once per period with the samples received
+        self.__schedules.append((period_sec, meters, listener, self.__measure))
+
+    def schedule_counters(self, period_sec: float, sources: Dict[str, CounterSource], listener: Callable[[Dict[str, CounterSample]], None]):
+        # like schedule. Sources without energy counters are left out of the samples
+        self.__schedules.append((period_sec, sources, listener, self.__read_counters))
+
+    def stream(self, stream, listener: Callable[[Sample], None]):
+        # the stream runs on the polling loop, so its samples are handled sequentially with the polled ones
+        self.__streams.append((stream, listener))
+
+    def start(self):
+        self.__is_running = True
+        self.__loop = asyncio.new_event_loop()
+        self.__stopped = asyncio.Event()
+        self.__thread = Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def stop(self, timeout_sec: float = 10):
+        # returns as soon as no listener is called anymore. Pending requests to the meters are abandoned
+        self.__is_running = False
+        if self.__thread is not None:
+            try:
+                self.__loop.call_soon_threadsafe(self.__stopped.set)
+            except RuntimeError:
+                pass    # loop already closed
+            self.__thread.join(timeout_sec)
+            if self.__thread.is_alive():
+                logging.warning("poller has not been stopped within " + str(timeout_sec) + " sec")
+            self.__thread = None
+
+    def __run(self):
+        num_meters = sum([len(meters) for _, meters, _, _ in self.__schedules])
+        executor = ThreadPoolExecutor(max_workers=max(1, num_meters), thread_name_prefix="poller")
+        loop = self.__loop
+        loop.set_default_executor(executor)
+        try:
+            loop.run_until_complete(self.__poll_all())
+        finally:
+            loop.close()
+            executor.shutdown(wait=False)
+
+    async def __poll_all(self):
+        # the loops are cancelled on stop. A listener is called synchronously, so it is never interrupted
+        tasks = [asyncio.ensure_future(self.__poll_loop(period_sec, meters, listener, read)) for period_sec, meters, listener, read in self.__schedules] + \
+                [asyncio.ensure_future(stream.run(self.__safe(listener), lambda: self.__is_running)) for stream, listener in self.__streams]
+        await self.__stopped.wait()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def __safe(self, listener: Callable[[Sample], None]) -> Callable[[Sample], None]:
+        def handle(sample: Sample):
+            try:
+                listener(sample)
+            except Exception as e:
+                logging.warning("error occurred on handling streamed sample " + str(e))
+        return handle
+
+    async def __poll_loop(self, period_sec: float, meters: Dict[str, Any], listener: Callable[[Dict[str, Any]], None], read: Callable[[Any], Any]):
+        loop = asyncio.get_running_loop()
+        pending: Dict[str, asyncio.Future] = dict()
+        next_time = loop.time()
+        while self.__is_running:
+            next_time += period_sec
+            for name, meter in meters.items():
+                # a stalled meter keeps its pending request. It does not get a further one stacked
+                if name not in pending:
+                    pending[name] = loop.run_in_executor(None, read, meter)
+            await asyncio.wait(pending.values(), timeout=max(0.0, next_time - loop.time()))
+
+            samples = dict()
+            for name, future in list(pending.items()):
+                if future.done():
+                    del pending[name]
+                    if future.exception() is None:
+                        if future.result() is not None:
+                            samples[name] = future.result()
+                    else:
+                        logging.warning("error occurred polling " + name + " " + str(future.exception()))
+            try:
+                listener(samples)
+            except Exception as e:
+                logging.warning("error occurred on handling samples " + str(e))
+
+            delay = next_time - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                next_time = loop.time()   # period missed. Do not try to catch up
+
+    @staticmethod
+    def __measure(meter: Meter) -> Sample:
+        measure = meter.measure()
+        return Sample(measure, datetime.utcnow())
+
+    @staticmethod
+    def __read_counters(source: CounterSource) -> Optional[CounterSample]:
+        counters = source.counters()
+        return None if counters is None else CounterSample(counters, datetime.utcnow())
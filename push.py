@@ -0,0 +1,80 @@
+import json
+import logging
+from typing import Dict, Any, Optional
+from tornado.ioloop import PeriodicCallback
+from tornado.websocket import WebSocketClosedError
+from webthing import Thing
+from timebase import timebase
+
+
+class Client:
+
+    def __init__(self):
+        self.pending: Dict[str, Any] = dict()    # changed values not sent so far
+        self.sent: Dict[str, Any] = dict()       # values the client has received
+        self.last_sent_time = float("-inf")      # nothing sent so far
+        self.in_flight = None                    # future of the last websocket write
+
+
+class BatchedPush:
+
+    def __init__(self, thing: Thing, window_sec: float = 0.25, min_interval_sec: float = 0, deadband: float = 0):
+        self.__thing = thing
+        self.__window_sec = window_sec
+        self.__min_interval_sec = min_interval_sec
+        self.__deadband = deadband
+        self.__changed: Dict[str, Any] = dict()
+        self.__clients: Dict[Any, Client] = dict()
+        self.__flush_callback: Optional[PeriodicCallback] = None
+
+    def start(self):
+        self.__flush_callback = PeriodicCallback(self.flush, self.__window_sec * 1000)
+        self.__flush_callback.start()
+
+    def stop(self):
+        if self.__flush_callback is not None:
+            self.__flush_callback.stop()
+
+    def notify(self, name: str, value: Any):
+        self.__changed[name] = value
+
+    def __is_significant(self, value: Any, sent_value: Any) -> bool:
+        if isinstance(value, (int, float)) and isinstance(sent_value, (int, float)):
+            return abs(value - sent_value) > self.__deadband
+        return value != sent_value
+
+    def flush(self):
+        # called once per window
+        changed = self.__changed
+        self.__changed = dict()
+
+        subscribers = set(self.__thing.subscribers)
+        for subscriber in [subscriber for subscriber in self.__clients.keys() if subscriber not in subscribers]:
+            del self.__clients[subscriber]
+
+        now = timebase.monotonic()
+        for subscriber in subscribers:
+            client = self.__clients.get(subscriber, None)
+            if client is None:
+                client = Client()
+                self.__clients[subscriber] = client
+            for name, value in changed.items():
+                if name not in client.sent or self.__is_significant(value, client.sent[name]):
+                    client.pending[name] = value
+                else:
+                    client.pending.pop(name, None)
+
+            # a slow client does not get a further message until the previous one has been written. Its pending values are merged meanwhile
+            if len(client.pending) == 0 or now < client.last_sent_time + self.__min_interval_sec:
+                continue
+            if client.in_flight is not None and not client.in_flight.done():
+                continue
+            try:
+                client.in_flight = subscriber.write_message(json.dumps({'messageType': 'propertyStatus', 'data': client.pending}))
+                client.sent.update(client.pending)
+                client.pending = dict()
+                client.last_sent_time = now
+            except WebSocketClosedError:
+                pass
+            except Exception as e:
+                logging.warning("error occurred pushing properties " + str(e))
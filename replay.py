@@ -0,0 +1,365 @@
+import sys
+import csv
+import math
+import random
+import logging
+import argparse
+import tempfile
+import tracemalloc
+from bisect import bisect_right
+from datetime import datetime, timezone
+from time import perf_counter
+from typing import List, Dict, Tuple, Callable, Optional, Set, Any
+from shelly import Meter, Measure, EnergyRecord, CounterSource, EnergyCounters
+from poller import Poller, Sample, CounterSample
+from energy import Energy
+from timebase import timebase, Clock, SECONDS_PER_DAY
+
+
+# Replays a recorded or synthetic meter trace through Energy (and optionally EnergyThing) faster than real time.
+# A virtual clock drives the timebase, so day and year rollovers can be checked in minutes, e.g.
+#   python replay.py --start 2026-12-31T20:00:00 --days 0.5
+#   python replay.py --trace trace.csv --thing
+# The trace csv consists of the columns time (epoch sec), provider, pv and optionally pv_channel_1, pv_channel_2, ...
+
+
+class VirtualClock(Clock):
+
+    def __init__(self, epoch_sec: float):
+        self.__epoch_sec = epoch_sec
+        self.__monotonic = 0.0
+
+    def monotonic(self) -> float:
+        return self.__monotonic
+
+    def epoch(self) -> float:
+        return self.__epoch_sec
+
+    def advance(self, sec: float):
+        self.__monotonic += sec
+        self.__epoch_sec += sec
+
+
+class Trace:
+
+    # the value of a series at a time is the value of the last record not after the time (step function)
+
+    def __init__(self, times: List[float], series: Dict[str, List[float]]):
+        self.times = times
+        self.series = series
+
+    @property
+    def num_channels(self) -> int:
+        return len([name for name in self.series.keys() if name.startswith("pv_channel_")])
+
+    def value(self, name: str, epoch_sec: float) -> float:
+        idx = bisect_right(self.times, epoch_sec) - 1
+        return self.series[name][max(0, idx)]
+
+    @staticmethod
+    def load(filename: str):
+        times = list()
+        series: Dict[str, List[float]] = dict()
+        with open(filename, newline="") as file:
+            for row in csv.DictReader(file):
+                times.append(float(row.pop("time")))
+                for name, value in row.items():
+                    series.setdefault(name, list()).append(float(value))
+        return Trace(times, series)
+
+    @staticmethod
+    def synthetic(start_epoch_sec: float, duration_sec: float, num_channels: int = 3, peak_pv: float = 6000, seed: int = 1):
+        # pv follows the sun between 6 and 18 utc with passing clouds. The consumption is a base load with spikes
+        rnd = random.Random(seed)
+        times = list()
+        series: Dict[str, List[float]] = {"provider": list(), "pv": list()}
+        for num in range(1, num_channels + 1):
+            series["pv_channel_" + str(num)] = list()
+        cloud = 1.0
+        spike_until = 0.0
+        epoch_sec = start_epoch_sec
+        while epoch_sec < start_epoch_sec + duration_sec:
+            hour = (epoch_sec % SECONDS_PER_DAY) / 3600
+            cloud = min(1.0, max(0.2, cloud + rnd.uniform(-0.05, 0.05)))
+            pv = round(max(0.0, peak_pv * math.sin(math.pi * (hour - 6) / 12)) * cloud) if 6 < hour < 18 else 0
+            if epoch_sec > spike_until and rnd.random() < 0.002:
+                spike_until = epoch_sec + rnd.uniform(60, 1800)
+            consumption = 250 + rnd.randint(0, 100) + (2000 if epoch_sec < spike_until else 0)
+            times.append(epoch_sec)
+            series["provider"].append(consumption - pv)
+            series["pv"].append(pv)
+            for num in range(1, num_channels + 1):
+                series["pv_channel_" + str(num)].append(round(pv / num_channels))
+            epoch_sec += rnd.choice([1, 1, 1, 2, 5])
+        return Trace(times, series)
+
+
+class TraceMeter(Meter):
+
+    def __init__(self, trace: Trace, name: str, clock: VirtualClock, offset: Callable[[], float] = lambda: 0):
+        self.__trace = trace
+        self.__name = name
+        self.__clock = clock
+        self.__offset = offset
+
+    def measure(self) -> Optional[Measure]:
+        power = round(self.__trace.value(self.__name, self.__clock.epoch()) + self.__offset())
+        return Measure(power, power)
+
+
+class TraceCounters(CounterSource):
+
+    # hardware energy counters of a trace series
+
+    def __init__(self, trace: Trace, name: str, clock: VirtualClock):
+        self.__trace = trace
+        self.__name = name
+        self.__clock = clock
+        self.__last_time = clock.epoch()
+        self.__imported_watt_sec = 0.0
+        self.__exported_watt_sec = 0.0
+
+    def counters(self) -> Optional[EnergyCounters]:
+        now = self.__clock.epoch()
+        while self.__last_time < now:
+            duration = min(1.0, now - self.__last_time)
+            power = self.__trace.value(self.__name, self.__last_time)
+            if power > 0:
+                self.__imported_watt_sec += power * duration
+            else:
+                self.__exported_watt_sec -= power * duration
+            self.__last_time += duration
+        return EnergyCounters(self.__imported_watt_sec / 3600, self.__exported_watt_sec / 3600)
+
+
+class TraceRecords:
+
+    # per minute energy records of the provider series as stored by a Pro3EM. The power is split evenly to the phases
+
+    def __init__(self, trace: Trace):
+        self.__trace = trace
+
+    def records(self, from_epoch_sec: int, to_epoch_sec: int) -> Optional[List[EnergyRecord]]:
+        records = list()
+        for minute_start in range(from_epoch_sec // 60 * 60, to_epoch_sec + 1, 60):
+            imported_wh = 0.0
+            exported_wh = 0.0
+            for sec in range(minute_start, minute_start + 60):
+                power = self.__trace.value("provider", sec) / 3
+                if power > 0:
+                    imported_wh += power / 3600
+                else:
+                    exported_wh -= power / 3600
+            records.append(EnergyRecord(minute_start, 60, (imported_wh, imported_wh, imported_wh), (exported_wh, exported_wh, exported_wh)))
+        return records
+
+
+class ReplayPoller(Poller):
+
+    # records the schedules of Energy. The replay calls the listeners instead of polling the shelly devices
+
+    def __init__(self):
+        super().__init__()
+        self.schedules: List[Tuple[float, List[str], Callable[[Dict[str, Any]], None]]] = list()
+
+    def schedule(self, period_sec: float, meters: Dict[str, Meter], listener: Callable[[Dict[str, Sample]], None]):
+        self.schedules.append((period_sec, list(meters.keys()), listener))
+
+    def schedule_counters(self, period_sec: float, sources: Dict[str, CounterSource], listener: Callable[[Dict[str, CounterSample]], None]):
+        self.schedules.append((period_sec, list(sources.keys()), listener))
+
+    def listener(self, *names: str) -> Callable[[Dict[str, Any]], None]:
+        # listener of the schedule of the given meters
+        for _, schedule_names, listener in self.schedules:
+            if tuple(schedule_names) == names:
+                return listener
+        raise KeyError("no schedule of " + ", ".join(names))
+
+
+class ImmediateLoop:
+
+    # replaces the ioloop of EnergyThing, so the changes are published synchronously
+
+    def add_callback(self, callback, *args):
+        callback(*args)
+
+
+class Stage:
+
+    def __init__(self, name: str):
+        self.name = name
+        self.durations: List[float] = list()
+
+    def add(self, duration: float):
+        self.durations.append(duration)
+
+    def report(self) -> str:
+        if len(self.durations) == 0:
+            return self.name + ": -"
+        durations = sorted(self.durations)
+        percentile = lambda p: durations[min(len(durations) - 1, int(len(durations) * p))] * 1000000
+        return self.name + ": " + str(len(durations)) + " calls, p50 " + str(round(percentile(0.5))) + "us, p99 " + \
+               str(round(percentile(0.99))) + "us, max " + str(round(durations[-1] * 1000000)) + "us"
+
+
+class Replay:
+
+    def __init__(self, trace: Trace, directory: str, with_thing: bool = False, track_memory: bool = False, provider_offset: Callable[[], float] = lambda: 0,
+                 outages: List[Tuple[float, float]] = [], backfill: bool = True, lazy: bool = False):
+        # provider_offset: additional power of the provider meter, e.g. of a simulated load
+        # lazy: the derived properties of EnergyThing are computed on read (none is read by the replay)
+        # outages: epoch sec ranges the meters are not reachable. The gaps are backfilled by the records of the trace, if backfill is set
+        self.__trace = trace
+        self.__clock = VirtualClock(trace.times[0])
+        timebase.set_clock(self.__clock)
+        self.__poller = ReplayPoller()
+        num_channels = trace.num_channels
+        self.__outages = outages
+        records = TraceRecords(trace).records if backfill else lambda from_epoch_sec, to_epoch_sec: None
+        self.energy = Energy("replay://provider", "replay://pv", ["replay://pv_channel" + str(num) for num in range(1, num_channels + 1)], directory, 400, "poll", self.__poller, records=records)
+        self.__meters = {"provider": TraceMeter(trace, "provider", self.__clock, provider_offset), "pv": TraceMeter(trace, "pv", self.__clock)}
+        for num in range(1, num_channels + 1):
+            self.__meters["pv_channel" + str(num)] = TraceMeter(trace, "pv_channel_" + str(num), self.__clock)
+        self.__counter_sources = {"provider_counters": TraceCounters(trace, "provider", self.__clock), "pv_counters": TraceCounters(trace, "pv", self.__clock)}
+        self.__energy_stage = Stage("energy")
+        self.__publish_stage = Stage("publish")
+        self.__thing = None
+        self.__publish_duration = 0.0
+        if with_thing:
+            from energy_webthing import EnergyThing
+            self.__thing = EnergyThing("replay", self.energy, push_window_sec=0, lazy=lazy)
+            self.__thing.ioloop = ImmediateLoop()
+        self.energy.set_listener(self.__on_value_changed)
+        self.__track_memory = track_memory
+        self.__memory: List[Tuple[float, int]] = list()
+        self.__replayed = (0.0, 0.0)
+        # exact integration of the trace (watt sec per series and utc day) as reference of the aggregates
+        self.__reference: Dict[str, Dict[int, float]] = {"pv": dict(), "consumption": dict(), "pv_effective": dict(), "surplus": dict()}
+
+    def __on_value_changed(self, changed: Set[str]):
+        if self.__thing is not None:
+            # called by Energy within the energy stage. Publishing is measured on its own
+            start = perf_counter()
+            self.__thing.on_value_changed(changed)
+            duration = perf_counter() - start
+            self.__publish_stage.add(duration)
+            self.__publish_duration += duration
+
+    def __integrate(self, epoch_sec: float, duration_sec: float):
+        provider = self.__trace.value("provider", epoch_sec)
+        pv = max(0.0, self.__trace.value("pv", epoch_sec))
+        surplus = -provider if provider < 0 else 0
+        day = int(epoch_sec) // SECONDS_PER_DAY
+        for name, power in [("pv", pv), ("consumption", provider + pv), ("pv_effective", max(0.0, pv - surplus)), ("surplus", surplus)]:
+            self.__reference[name][day] = self.__reference[name].get(day, 0.0) + power * duration_sec
+
+    def run(self, duration_sec: float, step_sec: float = 1):
+        if self.__track_memory:
+            tracemalloc.start()
+        due = [0.0] * len(self.__poller.schedules)
+        num_samples = 0
+        start = perf_counter()
+        elapsed = 0.0
+        while elapsed < duration_sec:
+            now = self.__clock.epoch()
+            for idx, (period_sec, names, listener) in enumerate(self.__poller.schedules):
+                if elapsed >= due[idx]:
+                    due[idx] = elapsed + period_sec
+                    if any([from_epoch_sec <= now < to_epoch_sec for from_epoch_sec, to_epoch_sec in self.__outages]):
+                        samples = dict()
+                    else:
+                        samples = {name: self.__sample(name, datetime.fromtimestamp(now, timezone.utc)) for name in names}
+                    num_samples += len(samples)
+                    stage_start = perf_counter()
+                    self.__publish_duration = 0.0
+                    listener(samples)
+                    self.__energy_stage.add(perf_counter() - stage_start - self.__publish_duration)
+            self.__integrate(now, step_sec)
+            if self.__track_memory and int(elapsed) % 3600 == 0:
+                self.__memory.append((elapsed, self.__traced_memory()))
+            self.__clock.advance(step_sec)
+            elapsed += step_sec
+        wall_sec = perf_counter() - start
+        if self.__track_memory:
+            self.__memory.append((elapsed, self.__traced_memory()))
+            tracemalloc.stop()
+        self.__replayed = (self.__trace.times[0], self.__clock.epoch())
+        return num_samples, wall_sec
+
+    def __sample(self, name: str, time: datetime):
+        if name in self.__counter_sources.keys():
+            return CounterSample(self.__counter_sources[name].counters(), time)
+        return Sample(self.__meters[name].measure(), time)
+
+    def __traced_memory(self) -> int:
+        # the recorded stage durations of the harness itself are excluded
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, __file__), tracemalloc.Filter(False, tracemalloc.__file__)])
+        return sum([statistic.size for statistic in snapshot.statistics("filename")])
+
+    def __counter_day(self, series: str, day: int) -> int:
+        return dict(self.energy.history(series, "day", day * SECONDS_PER_DAY, day * SECONDS_PER_DAY)).get(day * SECONDS_PER_DAY, 0)
+
+    def report(self, duration_sec: float, num_samples: int, wall_sec: float) -> List[str]:
+        lines = ["replayed " + str(round(duration_sec / 3600, 1)) + "h in " + str(round(wall_sec, 1)) + "s (" + str(round(duration_sec / wall_sec)) + "x real time, " + str(round(num_samples / wall_sec)) + " samples/s)",
+                 self.__energy_stage.report(),
+                 self.__publish_stage.report()]
+        if len(self.__memory) > 1:
+            lines.append("memory: " + ", ".join([str(round(elapsed / 3600)) + "h " + str(round(size / 1024)) + "KiB" for elapsed, size in self.__memory]) +
+                         " (growth " + str(round((self.__memory[-1][1] - self.__memory[1 if len(self.__memory) > 2 else 0][1]) / 1024)) + "KiB after the first hour)")
+        # days replayed completely only. The aggregated value of a day is in watt hours
+        for name, days in self.__reference.items():
+            for day in sorted(days.keys()):
+                if day * SECONDS_PER_DAY < self.__replayed[0] or (day + 1) * SECONDS_PER_DAY > self.__replayed[1]:
+                    continue
+                aggregated = dict(self.energy.history(name, "day", day * SECONDS_PER_DAY, day * SECONDS_PER_DAY)).get(day * SECONDS_PER_DAY, 0)
+                reference = days[day] / 3600
+                deviation = (aggregated - reference) * 100 / reference if reference > 0 else 0
+                lines.append(name + " " + datetime.fromtimestamp(day * SECONDS_PER_DAY, timezone.utc).strftime("%Y-%m-%d") + ": aggregated " + str(aggregated) + "Wh, trace " + str(round(reference)) + "Wh (" + str(round(deviation, 2)) + "%)")
+        # the counters are read once per minute, so the last minute of a day is accounted to the next one
+        for name, day_values in [("pv", lambda day: self.__counter_day("pv_yield", day)),
+                                 ("surplus", lambda day: self.__counter_day("grid_export", day)),
+                                 ("consumption", lambda day: self.__counter_day("grid_import", day) + self.__counter_day("pv_yield", day) - self.__counter_day("grid_export", day))]:
+            for day in sorted(self.__reference[name].keys()):
+                if day * SECONDS_PER_DAY < self.__replayed[0] or (day + 1) * SECONDS_PER_DAY > self.__replayed[1]:
+                    continue
+                counted = day_values(day)
+                reference = self.__reference[name][day] / 3600
+                deviation = (counted - reference) * 100 / reference if reference > 0 else 0
+                lines.append(name + " " + datetime.fromtimestamp(day * SECONDS_PER_DAY, timezone.utc).strftime("%Y-%m-%d") + ": counted " + str(counted) + "Wh, trace " + str(round(reference)) + "Wh (" + str(round(deviation, 2)) + "%)")
+        lines.append("current year: pv " + str(self.energy.pv_power_current_year) + "Wh, consumption " + str(self.energy.consumption_power_current_year) + "Wh (" + str(timebase.calendar().year) + ")")
+        return lines
+
+
+def main(argv: List[str]):
+    parser = argparse.ArgumentParser(description="replays a meter trace through the energy pipeline using a virtual clock")
+    parser.add_argument("--trace", help="trace csv file (time, provider, pv, pv_channel_1, ...). A synthetic trace is used, if not set")
+    parser.add_argument("--start", default="2026-06-01T00:00:00", help="start time of the synthetic trace (utc)")
+    parser.add_argument("--days", type=float, default=3, help="replayed duration")
+    parser.add_argument("--step", type=float, default=1, help="virtual seconds per step")
+    parser.add_argument("--channels", type=int, default=3, help="pv channels of the synthetic trace")
+    parser.add_argument("--directory", help="data directory. A temp directory is used, if not set")
+    parser.add_argument("--thing", action="store_true", help="publish the values by using EnergyThing")
+    parser.add_argument("--lazy", action="store_true", help="compute the derived properties of EnergyThing on read")
+    parser.add_argument("--memory", action="store_true", help="track the memory growth (slows down the replay)")
+    parser.add_argument("--outage", action="append", default=[], help="meters not reachable, as <hours after start>:<minutes> (e.g. 12:10). May be repeated")
+    parser.add_argument("--no-backfill", action="store_true", help="do not backfill the outages by the meter records")
+    args = parser.parse_args(argv)
+
+    duration_sec = args.days * SECONDS_PER_DAY
+    if args.trace is None:
+        start = datetime.fromisoformat(args.start).replace(tzinfo=timezone.utc).timestamp()
+        trace = Trace.synthetic(start, duration_sec, args.channels)
+    else:
+        trace = Trace.load(args.trace)
+        duration_sec = min(duration_sec, trace.times[-1] - trace.times[0])
+    directory = tempfile.mkdtemp() if args.directory is None else args.directory
+    outages = [(trace.times[0] + float(hours) * 3600, trace.times[0] + float(hours) * 3600 + float(minutes) * 60) for hours, minutes in [outage.split(":") for outage in args.outage]]
+    replay = Replay(trace, directory, args.thing, args.memory, outages=outages, backfill=not args.no_backfill, lazy=args.lazy)
+    num_samples, wall_sec = replay.run(duration_sec, args.step)
+    for line in replay.report(duration_sec, num_samples, wall_sec):
+        print(line)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s %(name)-20s: %(levelname)-8s %(message)s', level=logging.WARNING, datefmt='%Y-%m-%d %H:%M:%S')
+    main(sys.argv[1:])
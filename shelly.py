@@ -1,9 +1,14 @@
 from requests import Session
 from abc import ABC, abstractmethod
 import logging
-from time import sleep
-from typing import Optional
+from random import uniform
+from time import sleep, monotonic
+from typing import Optional, Callable, Dict, Any, List, Tuple
 from dataclasses import dataclass
+from threading import Lock, local
+from concurrent.futures import ThreadPoolExecutor
+from redzoo.database.simple import SimpleDB
+from metrics import shelly_request_seconds, shelly_request_retries, shelly_request_failures, shelly_circuit_rejections, shelly_session_renewals, shelly_auto_selects, storage_sync_seconds
 
 
 @dataclass(frozen=True)
@@ -14,6 +19,22 @@ class Measure:
     channel_c: Optional[int] = None
 
 
+@dataclass(frozen=True)
+class EnergyCounters:
+    # hardware accumulated energy since the device has been set up
+    imported_wh: float
+    exported_wh: float = 0
+
+
+@dataclass(frozen=True)
+class EnergyRecord:
+    # energy of a recording period stored on the device, per phase
+    time: int                                  # start of the period as epoch sec
+    period_sec: int
+    imported_wh: Tuple[float, float, float]
+    exported_wh: Tuple[float, float, float]
+
+
 class Meter(ABC):
 
     @abstractmethod
@@ -21,197 +42,348 @@ class Meter(ABC):
         pass
 
 
+class CounterSource(ABC):
+
+    @abstractmethod
+    def counters(self) -> Optional[EnergyCounters]:
+        # None, if the device does not provide energy counters
+        pass
+
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_tries: int = 3
+    connect_timeout_sec: float = 3
+    read_timeout_sec: float = 8
+    backoff_sec: float = 0.5          # initial backoff, doubled per retry
+    max_backoff_sec: float = 4
+    latency_budget_sec: float = 12    # max time a single measure may take including retries
+    failure_threshold: int = 5        # consecutive failed measures opening the circuit
+    open_circuit_sec: float = 30
+
+    def backoff(self, num_try: int) -> float:
+        delay = min(self.max_backoff_sec, self.backoff_sec * (2 ** num_try))
+        return delay / 2 + uniform(0, delay / 2)
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class UnexpectedResponseError(Exception):
+    # the device is reachable but answers with a payload of an other device type
+    pass
+
+
+class CircuitBreaker:
+
+    def __init__(self, failure_threshold: int, open_circuit_sec: float):
+        self.__failure_threshold = failure_threshold
+        self.__open_circuit_sec = open_circuit_sec
+        self.__num_failures = 0
+        self.__opened_time = 0.0
+
+    @property
+    def is_open(self) -> bool:
+        return self.__num_failures >= self.__failure_threshold
+
+    def allow(self) -> bool:
+        # once the open period is elapsed a single trial request passes (half open)
+        if self.is_open and monotonic() < self.__opened_time + self.__open_circuit_sec:
+            return False
+        return True
 
-class Shelly3em(Meter):
+    def on_success(self):
+        self.__num_failures = 0
 
-    def __init__(self, addr: str):
-        self.__session = Session()
+    def on_failure(self):
+        self.__num_failures += 1
+        if self.is_open:
+            self.__opened_time = monotonic()
+
+
+class ShellyDevice(Meter):
+
+    # A device is queried by multiple threads (polling, counters, backfill). A Session is not thread-safe, so each
+    # thread uses a session of its own. A renewal replaces the session of the calling thread only
+
+    def __init__(self, addr: str, policy: RetryPolicy = RetryPolicy()):
+        self.__sessions = local()
         self.addr = addr
+        self.policy = policy
+
+    @property
+    def _session(self) -> Session:
+        session = getattr(self.__sessions, "session", None)
+        if session is None:
+            session = Session()
+            self.__sessions.session = session
+        return session
+
+    def counters(self) -> Optional[EnergyCounters]:
+        # None, if the device does not provide energy counters
+        return None
 
-    def measure(self) -> Optional[Measure]:
-        ex = None
-        for i in range(0,3):
-            uri = self.addr + '/rpc/EM.GetStatus?id=0'
+    def records(self, from_epoch_sec: int, to_epoch_sec: int) -> Optional[List[EnergyRecord]]:
+        # None, if the device does not store energy records
+        return None
+
+    def _query(self, path: str, parse: Callable[[Dict[str, Any]], Any]) -> Any:
+        uri = self.addr + path
+        name = self.__class__.__name__
+        deadline = monotonic() + self.policy.latency_budget_sec
+        ex: Exception = Exception(name + " called " + uri)
+        for num_try in range(0, self.policy.max_tries):
+            if num_try > 0:
+                shelly_request_retries.inc(self.addr)
+            start = monotonic()
+            remaining = deadline - start
             try:
-                resp = self.__session.get(uri, timeout=20)
-                try:
-                    data = resp.json()
-                    return Measure(round(data['total_act_power']), round(data['a_act_power']), round(data['b_act_power']), round(data['c_act_power']))
-                except Exception as e:
-                    ex = Exception("Shelly3em called " + uri + " got " + str(resp.status_code) + " " + resp.text + " " + str(e))
+                resp = self._session.get(uri, timeout=(min(self.policy.connect_timeout_sec, remaining), min(self.policy.read_timeout_sec, remaining)))
             except Exception as e:
+                shelly_request_seconds.observe(monotonic() - start, self.addr)
                 self.__renew_session()
-                ex = Exception("Shelly3em called " + uri + " got " + str(e))
-            sleep(1)
-        if ex is not None:
-            raise ex
+                resp = None
+                ex = Exception(name + " called " + uri + " got " + str(e))
+            if resp is not None:
+                shelly_request_seconds.observe(monotonic() - start, self.addr)
+                # error status (e.g. 401, 5xx) and non json bodies (e.g. html while rebooting) are transient. Only a json
+                # payload lacking the expected fields is unexpected
+                if resp.status_code // 100 != 2:
+                    ex = Exception(name + " called " + uri + " got " + str(resp.status_code) + " " + resp.text)
+                else:
+                    try:
+                        data = resp.json()
+                    except ValueError as e:
+                        data = None
+                        ex = Exception(name + " called " + uri + " got no json " + resp.text + " " + str(e))
+                    if data is not None:
+                        try:
+                            return parse(data)
+                        except Exception as e:
+                            ex = UnexpectedResponseError(name + " called " + uri + " got " + str(resp.status_code) + " " + resp.text + " " + str(e))
+            delay = self.policy.backoff(num_try)
+            if num_try + 1 >= self.policy.max_tries or monotonic() + delay >= deadline:
+                break
+            sleep(delay)
+        shelly_request_failures.inc(self.addr)
+        raise ex
 
     def __renew_session(self):
         logging.info("renew session for " + self.addr)
+        shelly_session_renewals.inc(self.addr)
         try:
-            self.__session.close()
+            self._session.close()
         except Exception as e:
             logging.warning(str(e))
-        self.__session = Session()
+        self.__sessions.session = Session()
 
 
 
-class Shelly1pro(Meter):
+class Shelly3em(ShellyDevice):
 
-    def __init__(self, addr: str):
-        self.__session = Session()
-        self.addr = addr
+    def measure(self) -> Optional[Measure]:
+        return self._query('/rpc/EM.GetStatus?id=0',
+                           lambda data: Measure(round(data['total_act_power']), round(data['a_act_power']), round(data['b_act_power']), round(data['c_act_power'])))
+
+    def counters(self) -> Optional[EnergyCounters]:
+        return self._query('/rpc/EMData.GetStatus?id=0',
+                           lambda data: EnergyCounters(data['total_act'], data['total_act_ret']))
+
+    def records(self, from_epoch_sec: int, to_epoch_sec: int) -> Optional[List[EnergyRecord]]:
+        # the device stores per minute records. Large ranges are returned in pages
+        records = list()
+        ts = from_epoch_sec
+        while ts is not None and ts <= to_epoch_sec:
+            data = self._query('/rpc/EMData.GetData?id=0&ts=' + str(ts) + '&end_ts=' + str(to_epoch_sec), lambda data: data)
+            keys = data['keys']
+            indexes = [(keys.index(phase + '_total_act_energy'), keys.index(phase + '_total_act_ret_energy')) for phase in ['a', 'b', 'c']]
+            for block in data['data']:
+                for num, values in enumerate(block['values']):
+                    records.append(EnergyRecord(block['ts'] + num * block['period'],
+                                                block['period'],
+                                                tuple([values[imported] for imported, _ in indexes]),
+                                                tuple([values[exported] for _, exported in indexes])))
+            next_ts = data.get('next_record_ts', None)
+            ts = next_ts if next_ts is not None and next_ts > ts else None
+        return records
+
+
+
+class Shelly1pro(ShellyDevice):
 
     def measure(self) -> Optional[Measure]:
-        ex = None
-        for i in range(0,3):
-            uri = self.addr + '/rpc/switch.GetStatus?id=0'
-            try:
-                resp = self.__session.get(uri, timeout=20)
-                try:
-                    data = resp.json()
-                    power = round(data['apower'])
-                    return Measure(power, power)
-                except Exception as e:
-                    ex = Exception("Shelly1pro called " + uri + " got " + str(resp.status_code) + " " + resp.text + " " + str(e))
-            except Exception as e:
-                self.__renew_session()
-                ex = Exception("Shelly1pro called " + uri + " got " + str(e))
-            sleep(1)
-        if ex is not None:
-            raise ex
+        return self._query('/rpc/switch.GetStatus?id=0',
+                           lambda data: Measure(round(data['apower']), round(data['apower'])))
 
-    def __renew_session(self):
-        logging.info("renew session for " + self.addr)
-        try:
-            self.__session.close()
-        except Exception as e:
-            logging.warning(str(e))
-        self.__session = Session()
+    def counters(self) -> Optional[EnergyCounters]:
+        # returned energy is reported by newer firmware only
+        return self._query('/rpc/switch.GetStatus?id=0',
+                           lambda data: EnergyCounters(data['aenergy']['total'], data.get('ret_aenergy', {}).get('total', 0)))
 
 
 
-class ShellyPmMini(Meter):
+class ShellyPmMini(ShellyDevice):
+
+    def measure(self) -> Optional[Measure]:
+        return self._query('/rpc/Shelly.GetStatus?channel=0',
+                           lambda data: Measure(round(data['pm1:0']['apower']), round(data['pm1:0']['apower'])))
+
+    def counters(self) -> Optional[EnergyCounters]:
+        return self._query('/rpc/Shelly.GetStatus?channel=0',
+                           lambda data: EnergyCounters(data['pm1:0']['aenergy']['total'], data['pm1:0'].get('ret_aenergy', {}).get('total', 0)))
 
-    def __init__(self, addr: str):
-        self.__session = Session()
-        self.addr = addr
+
+
+class Shelly1pm(ShellyDevice):
 
     def measure(self) -> Optional[Measure]:
-        ex = None
-        for i in range(0,3):
-            uri = self.addr + '/rpc/Shelly.GetStatus?channel=0'
-            try:
-                resp = self.__session.get(uri, timeout=20)
-                try:
-                    data = resp.json()
-                    power = round(data['pm1:0']['apower'])
-                    return Measure(power, power)
-                except Exception as e:
-                    ex =  Exception("ShellyPmMini called " + uri + " got " + str(resp.status_code) + " " + resp.text + " " + str(e))
-            except Exception as e:
-                self.__renew_session()
-                ex = Exception("ShellyPmMini called " + uri + " got " + str(e))
-            sleep(1)
-        if ex is not None:
-            raise ex
+        return self._query('/status',
+                           lambda data: Measure(round(data['meters'][0]['power']), round(data['meters'][0]['power'])))
 
-    def __renew_session(self):
-        logging.info("renew session for " + self.addr)
-        try:
-            self.__session.close()
-        except Exception as e:
-            logging.warning(str(e))
-        self.__session = Session()
+    def counters(self) -> Optional[EnergyCounters]:
+        # gen1 devices count watt minutes
+        return self._query('/status',
+                           lambda data: EnergyCounters(data['meters'][0]['total'] / 60))
 
 
+class ShellySwitch(ShellyDevice):
 
-class Shelly1pm(Meter):
+    # relay of a gen2+ device (e.g. Pro1PM, Plus1PM)
 
-    def __init__(self, addr: str):
-        self.__session = Session()
-        self.addr = addr
+    def __init__(self, addr: str, switch_id: int = 0, policy: RetryPolicy = RetryPolicy()):
+        super().__init__(addr, policy)
+        self.switch_id = switch_id
 
     def measure(self) -> Optional[Measure]:
-        ex = None
-        for i in range(0,3):
-            uri = self.addr + '/status'
-            try:
-                resp = self.__session.get(uri, timeout=20)
-                try:
-                    data = resp.json()
-                    power = round(data['meters'][0]['power'])
-                    return Measure(power, power)
-                except Exception as e:
-                    ex = Exception("Shelly1pm called " + uri + " got " + str(resp.status_code) + " " + resp.text + " " + str(e))
-            except Exception as e:
-                self.__renew_session()
-                ex = Exception("Shelly1pm called " + uri + " got " + str(e))
-            sleep(1)
-        if ex is not None:
-            raise ex
+        return self._query('/rpc/Switch.GetStatus?id=' + str(self.switch_id),
+                           lambda data: Measure(round(data['apower']), round(data['apower'])))
 
+    def switch(self, on: bool):
+        self._query('/rpc/Switch.Set?id=' + str(self.switch_id) + '&on=' + ('true' if on else 'false'),
+                    lambda data: data['was_on'])
+
+
+DEVICE_TYPES = {device_type.__name__: device_type for device_type in [Shelly1pro, Shelly1pm, ShellyPmMini, Shelly3em]}
+
+# device type by the app (gen2+) or type (gen1) reported by the /shelly device info endpoint
+DEVICE_TYPES_BY_MODEL = {
+    "Pro3EM": Shelly3em,
+    "Pro1PM": Shelly1pro,
+    "Plus1PM": Shelly1pro,
+    "PlusPMMini": ShellyPmMini,
+    "MiniPMG3": ShellyPmMini,
+    "SHSW-PM": Shelly1pm
+}
 
-    def __renew_session(self):
-        logging.info("renew session for " + self.addr)
-        try:
-            self.__session.close()
-        except Exception as e:
-            logging.warning(str(e))
-        self.__session = Session()
 
+class DeviceRegistry:
 
-class ShellyMeter(Meter):
+    def __init__(self, directory: str):
+        self.__db = SimpleDB("shelly_devices", directory=directory)
+        self.__lock = Lock()
 
-    def __init__(self, addr: str):
+    def get(self, addr: str) -> Optional[str]:
+        with self.__lock:
+            return self.__db.get(addr, None)
+
+    def put(self, addr: str, device_type: str):
+        with self.__lock:
+            start = monotonic()
+            self.__db.put(addr, device_type)
+            storage_sync_seconds.observe(monotonic() - start, "shelly_devices")
+
+    def delete(self, addr: str):
+        with self.__lock:
+            self.__db.delete(addr)
+
+
+class ShellyMeter(Meter, CounterSource):
+
+    def __init__(self, addr: str, policy: RetryPolicy = RetryPolicy(), registry: Optional[DeviceRegistry] = None):
         self.addr = addr
-        self.device = ShellyMeter.auto_select(addr)
+        self.policy = policy
+        self.circuit_breaker = CircuitBreaker(policy.failure_threshold, policy.open_circuit_sec)
+        self.__registry = registry
+        self.device: Optional[ShellyDevice] = None
+        if registry is not None:
+            device_type = DEVICE_TYPES.get(registry.get(addr), None)
+            if device_type is not None:
+                logging.info("using known " + device_type.__name__ + " running on " + addr)
+                self.device = device_type(addr, policy)
 
     def measure(self) -> Optional[Measure]:
-        if self.device is None:
-            self.device = ShellyMeter.auto_select(self.addr)
+        # a dead meter is not called again until the open circuit period is elapsed
+        if not self.circuit_breaker.allow():
+            shelly_circuit_rejections.inc(self.addr)
+            raise CircuitOpenError("circuit open for " + self.addr)
         try:
-            return self.device.measure()
-        except Exception as e:
+            if self.device is None:
+                self.device = self.__detect()
+            measure = self.device.measure()
+            self.circuit_breaker.on_success()
+            return measure
+        except UnexpectedResponseError as e:
+            # device has been replaced by an other type. Transient network errors do not trigger a re-detection
             self.device = None
+            if self.__registry is not None:
+                self.__registry.delete(self.addr)
+            self.circuit_breaker.on_failure()
             raise e
-
-    @staticmethod
-    def auto_select(addr: str) -> Optional[Meter]:
-        try:
-            s = Shelly1pro(addr)
-            s.measure()
-            logging.info("detected shelly1pro running on " + addr)
-            return s
         except Exception as e:
-            pass
+            self.circuit_breaker.on_failure()
+            raise e
 
-        try:
-            s = Shelly1pm(addr)
-            s.measure()
-            logging.info("detected shelly1pm running on " + addr)
-            return s
-        except Exception as e:
-            pass
+    def counters(self) -> Optional[EnergyCounters]:
+        # None, if the device has not been detected by a measure so far or does not provide energy counters
+        device = self.device
+        return None if device is None else device.counters()
 
-        try:
-            s = ShellyPmMini(addr)
-            s.measure()
-            logging.info("detected shellyPmMini running on " + addr)
-            return s
-        except Exception as e:
-            pass
+    def records(self, from_epoch_sec: int, to_epoch_sec: int) -> Optional[List[EnergyRecord]]:
+        device = self.device
+        return None if device is None else device.records(from_epoch_sec, to_epoch_sec)
+
+    def __detect(self) -> ShellyDevice:
+        device = ShellyMeter.auto_select(self.addr, self.policy)
+        if device is None:
+            raise Exception("unsupported shelly running on " + self.addr)
+        if self.__registry is not None:
+            self.__registry.put(self.addr, device.__class__.__name__)
+        return device
+
+    @staticmethod
+    def auto_select(addr: str, policy: RetryPolicy = RetryPolicy()) -> Optional[ShellyDevice]:
+        shelly_auto_selects.inc(addr)
+        device = ShellyMeter.__select_by_device_info(addr, policy)
+        if device is None:
+            device = ShellyMeter.__select_by_probing(addr, policy)
+        if device is None:
+            logging.warning("unsupported shelly running on " + addr)
+        else:
+            logging.info("detected " + device.__class__.__name__ + " running on " + addr)
+        return device
 
+    @staticmethod
+    def __select_by_device_info(addr: str, policy: RetryPolicy) -> Optional[ShellyDevice]:
         try:
-            s = Shelly3em(addr)
-            s.measure()
-            logging.info("detected shelly3em running on " + addr)
-            return s
+            with Session() as session:
+                info = session.get(addr + "/shelly", timeout=(policy.connect_timeout_sec, policy.read_timeout_sec)).json()
+            device_type = DEVICE_TYPES_BY_MODEL.get(info.get("app", info.get("type", "")), None)
+            if device_type is not None:
+                return device_type(addr, policy)
         except Exception as e:
-            pass
-
-        logging.warning("unsupported shelly running on " + addr)
+            logging.info("could not read device info of " + addr + " " + str(e))
         return None
 
-
+    @staticmethod
+    def __select_by_probing(addr: str, policy: RetryPolicy) -> Optional[ShellyDevice]:
+        devices = [device_type(addr, policy) for device_type in DEVICE_TYPES.values()]
+        with ThreadPoolExecutor(max_workers=len(devices)) as executor:
+            probes = [executor.submit(device.measure) for device in devices]
+        # order of DEVICE_TYPES defines the preference, if more than one probe succeeds
+        for device, probe in zip(devices, probes):
+            if probe.exception() is None:
+                return device
+        return None
 
@@ -0,0 +1,203 @@
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+from datetime import datetime
+from multiprocessing import Process
+from typing import Callable, Dict, Any, Optional, List, Tuple
+from tornado.web import Application, RequestHandler
+from tornado.ioloop import IOLoop
+from tornado.websocket import websocket_connect, WebSocketHandler
+from shelly import Meter, Measure, ShellyMeter
+from poller import Sample, Poller
+from timebase import timebase
+
+
+class ShellyStream(Meter):
+
+    # Receives the NotifyStatus notifications of a gen2 shelly via its websocket rpc channel. The device pushes the
+    # notifications to each websocket client that has sent a request with a src. While the stream is silent, the
+    # measure is polled by using the wrapped meter
+
+    def __init__(self, meter: Meter, addr: str, silence_timeout_sec: float = 5, reconnect_timeout_sec: float = 60):
+        self.__meter = meter
+        self.addr = addr
+        self.__silence_timeout_sec = silence_timeout_sec
+        self.__reconnect_timeout_sec = reconnect_timeout_sec
+        self.__status: Dict[str, Dict[str, Any]] = dict()
+        self.__measure: Optional[Measure] = None
+        self.__last_push_time = timebase.monotonic() - silence_timeout_sec
+
+    @property
+    def is_streaming(self) -> bool:
+        return timebase.monotonic() < self.__last_push_time + self.__silence_timeout_sec
+
+    def measure(self) -> Optional[Measure]:
+        if self.is_streaming:
+            return self.__measure
+        else:
+            return self.__meter.measure()
+
+    async def run(self, listener: Callable[[Sample], None], is_running: Callable[[], bool]):
+        uri = self.addr.replace("http://", "ws://").replace("https://", "wss://").rstrip("/") + "/rpc"
+        retry_delay_sec = 1
+        while is_running():
+            connection = None
+            try:
+                connection = await websocket_connect(uri, connect_timeout=5)
+                await connection.write_message(json.dumps({"id": 1, "src": "energy_webthing", "method": "Shelly.GetStatus"}))
+                logging.info("streaming status of " + self.addr)
+                retry_delay_sec = 1
+                while is_running():
+                    message = await asyncio.wait_for(connection.read_message(), timeout=self.__reconnect_timeout_sec)
+                    if message is None:
+                        break   # closed by the device
+                    self.__on_message(json.loads(message), listener)
+            except Exception as e:
+                logging.info("status stream of " + self.addr + " interrupted " + str(e))
+            finally:
+                if connection is not None:
+                    connection.close()
+            await asyncio.sleep(retry_delay_sec)
+            retry_delay_sec = min(60, retry_delay_sec * 2)
+
+    def __on_message(self, message: Dict[str, Any], listener: Callable[[Sample], None]):
+        if message.get("id", None) == 1:
+            components = message.get("result", {})
+        elif message.get("method", "") in ["NotifyStatus", "NotifyFullStatus"]:
+            components = message.get("params", {})
+        else:
+            return
+        # NotifyStatus contains the changed attributes only
+        for name, attributes in components.items():
+            if isinstance(attributes, dict):
+                self.__status.setdefault(name, dict()).update(attributes)
+        measure = self.__parse()
+        if measure is not None:
+            self.__measure = measure
+            self.__last_push_time = timebase.monotonic()
+            listener(Sample(measure, datetime.utcnow()))
+
+    def __parse(self) -> Optional[Measure]:
+        try:
+            if "em:0" in self.__status:
+                em = self.__status["em:0"]
+                return Measure(round(em['total_act_power']), round(em['a_act_power']), round(em['b_act_power']), round(em['c_act_power']))
+            for name in ["switch:0", "pm1:0"]:
+                if name in self.__status:
+                    power = round(self.__status[name]['apower'])
+                    return Measure(power, power)
+        except KeyError:
+            pass
+        return None
+
+
+def simulated_status(start_epoch_sec: float, hz: float) -> Dict[str, Any]:
+    # the power is increased by one watt per change, so a receiver can compute the time of the change
+    power = 1000 + int((time.time() - start_epoch_sec) * hz)
+    return {"id": 0, "total_act_power": power, "a_act_power": power / 3, "b_act_power": power / 3, "c_act_power": power / 3}
+
+
+def run_simulator(port: int, start_epoch_sec: float, hz: float):
+    # gen2 Pro3EM providing the http rpc endpoints and the websocket rpc channel. Each change is notified to the
+    # websocket clients that have sent a request with a src
+
+    clients: List[WebSocketHandler] = list()
+
+    class DeviceInfoHandler(RequestHandler):
+        def get(self):
+            self.write({"app": "Pro3EM", "gen": 2})
+
+    class StatusHandler(RequestHandler):
+        def get(self):
+            self.write(simulated_status(start_epoch_sec, hz))
+
+    class RpcHandler(WebSocketHandler):
+        def on_message(self, message):
+            request = json.loads(message)
+            if "src" in request and self not in clients:
+                clients.append(self)
+            self.write_message(json.dumps({"id": request.get("id"), "src": "shellypro3em-sim", "dst": request.get("src"), "result": {"em:0": simulated_status(start_epoch_sec, hz)}}))
+
+        def on_close(self):
+            if self in clients:
+                clients.remove(self)
+
+    def notify():
+        # scheduled right behind the next change
+        status = simulated_status(start_epoch_sec, hz)
+        message = json.dumps({"src": "shellypro3em-sim", "method": "NotifyStatus", "params": {"ts": time.time(), "em:0": status}})
+        for client in list(clients):
+            client.write_message(message)
+        next_change = start_epoch_sec + (status["total_act_power"] - 1000 + 1) / hz
+        IOLoop.current().call_later(max(0.0, next_change - time.time()) + 0.0005, notify)
+
+    Application([(r"/shelly", DeviceInfoHandler), (r"/rpc/EM.GetStatus", StatusHandler), (r"/rpc", RpcHandler)]).listen(port, address="127.0.0.1")
+    IOLoop.current().add_callback(notify)
+    IOLoop.current().start()
+
+
+def receive(addr: str, ingestion: str, duration_sec: float, start_epoch_sec: float, hz: float) -> Tuple[int, List[float], float]:
+    # returns the number of samples, the latency (sec) per change of the simulated device until a sample reflecting it
+    # has been received and the cpu time (sec) of this process
+    received: List[Tuple[float, int]] = list()   # time, change number
+
+    def on_sample(sample: Sample):
+        received.append((time.time(), int(sample.measure.total) - 1000))
+
+    poller = Poller()
+    meter = ShellyMeter(addr)
+    if ingestion == "push":
+        meter = ShellyStream(meter, addr)
+        poller.stream(meter, on_sample)
+        # the scheduled polls reuse the pushed measure as long as the stream is not silent
+        poller.schedule(1, {"provider": meter}, lambda samples: None)
+    else:
+        poller.schedule(1, {"provider": meter}, lambda samples: [on_sample(sample) for sample in samples.values()])
+    cpu_start = time.process_time()
+    run_start = time.time()
+    poller.start()
+    time.sleep(duration_sec)
+    poller.stop()
+    cpu_sec = time.process_time() - cpu_start
+    # changes of the run, except the last second (may not be received so far)
+    latencies = list()
+    for change in range(int((run_start - start_epoch_sec) * hz) + 1, int((run_start + duration_sec - 1 - start_epoch_sec) * hz)):
+        receive_times = [receive_time for receive_time, received_change in received if received_change >= change]
+        if len(receive_times) > 0:
+            latencies.append(receive_times[0] - (start_epoch_sec + change / hz))
+    return len(received), latencies, cpu_sec
+
+
+def simulate(argv: List[str]):
+    # compares the push ingestion with polling by using a simulated gen2 device running as separate process, so the
+    # cpu time of the receiver is measured only
+    parser = argparse.ArgumentParser(description="compares push and poll ingestion by using a simulated shelly Pro3EM")
+    parser.add_argument("--seconds", type=float, default=10, help="duration per ingestion mode")
+    parser.add_argument("--hz", type=float, default=5, help="power changes per second of the simulated device")
+    parser.add_argument("--port", type=int, default=18277)
+    args = parser.parse_args(argv)
+
+    start_epoch_sec = time.time()
+    simulator = Process(target=run_simulator, args=(args.port, start_epoch_sec, args.hz), daemon=True)
+    simulator.start()
+    time.sleep(1)
+    try:
+        for ingestion in ["push", "poll"]:
+            num_samples, latencies, cpu_sec = receive("http://127.0.0.1:" + str(args.port), ingestion, args.seconds, start_epoch_sec, args.hz)
+            latencies = sorted(latencies)
+            if num_samples == 0 or len(latencies) == 0:
+                print(ingestion + ": no samples received")
+                continue
+            percentile = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+            print(ingestion + ": " + str(num_samples) + " samples in " + str(round(args.seconds)) + "s (" + str(round(args.hz * args.seconds)) + " changes), latency from change to sample p50 " +
+                  str(round(percentile(0.5), 1)) + "ms, p99 " + str(round(percentile(0.99), 1)) + "ms, cpu " + str(round(cpu_sec * 1000 / num_samples, 2)) + "ms per sample")
+    finally:
+        simulator.terminate()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s %(name)-20s: %(levelname)-8s %(message)s', level=logging.WARNING, datefmt='%Y-%m-%d %H:%M:%S')
+    simulate(sys.argv[1:])
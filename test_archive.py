@@ -0,0 +1,74 @@
+import os
+from datetime import datetime, timezone
+from archive import SampleArchive
+
+
+START = int(datetime(2026, 6, 1, tzinfo=timezone.utc).timestamp())
+SERIES = ["provider", "pv"]
+
+
+def feed(archive: SampleArchive, from_epoch_sec: int, to_epoch_sec: int, step_sec: int = 5):
+    for epoch_sec in range(from_epoch_sec, to_epoch_sec, step_sec):
+        archive.append(epoch_sec, {"provider": 100 + (epoch_sec // 3600) % 24, "pv": 50})
+    # as done by the writer thread
+    archive.write()
+
+
+def test_coarse_tiers_survive_a_crash(tmp_path):
+    end = START + 3 * 24 * 60 * 60
+    feed(SampleArchive(str(tmp_path), SERIES), START, end)
+    # not flushed (e.g. killed). The completed buckets of the coarse tiers have been written nevertheless
+    archive = SampleArchive(str(tmp_path), SERIES)
+    minutes = archive.read("1m", START, end)
+    assert len(minutes) == 3 * 24 * 60 - 1
+    assert minutes[0] == (START, {"provider": 100, "pv": 50})
+    assert len(archive.read("15m", START, end)) == 3 * 24 * 4 - 1
+    hours = archive.read("1h", START, end)
+    assert len(hours) == 3 * 24 - 1
+    assert [values["provider"] for _, values in hours[:24]] == [100 + hour for hour in range(24)]
+
+
+def test_restart_continues_a_segment(tmp_path):
+    middle = START + 12 * 60 * 60
+    archive = SampleArchive(str(tmp_path), SERIES)
+    feed(archive, START, middle)
+    archive.flush()
+    archive = SampleArchive(str(tmp_path), SERIES)
+    feed(archive, middle, START + 24 * 60 * 60)
+    # the buckets in progress on restart are lost
+    assert len(archive.read("1h", START, START + 24 * 60 * 60)) == 22
+    assert len(archive.read("1s", middle - 60, middle - 1)) == 11
+
+
+def test_torn_record_is_cut_off(tmp_path):
+    middle = START + 12 * 60 * 60
+    feed(SampleArchive(str(tmp_path), SERIES), START, middle)
+    directory = os.path.join(str(tmp_path), "archive", "1h")
+    filename = os.path.join(directory, os.listdir(directory)[0])
+    with open(filename, "ab") as file:
+        file.write(b"\x1f\x8b\x08\x00torn")
+    archive = SampleArchive(str(tmp_path), SERIES)
+    assert len(archive.read("1h", START, middle)) == 11
+    feed(archive, middle, START + 24 * 60 * 60)
+    assert len(archive.read("1h", START, START + 24 * 60 * 60)) == 22
+
+
+def test_segment_of_other_series_is_replaced(tmp_path):
+    feed(SampleArchive(str(tmp_path), ["provider"]), START, START + 3 * 60 * 60)
+    archive = SampleArchive(str(tmp_path), SERIES)
+    feed(archive, START + 3 * 60 * 60, START + 6 * 60 * 60)
+    hours = archive.read("1h", START, START + 6 * 60 * 60)
+    assert [epoch_sec for epoch_sec, _ in hours] == [START + hour * 3600 for hour in range(3, 5)]
+
+
+def test_append_does_not_write(tmp_path):
+    archive = SampleArchive(str(tmp_path), SERIES, write_period_sec=60)
+    for epoch_sec in range(START, START + 2 * 24 * 60 * 60, 5):
+        archive.append(epoch_sec, {"provider": 100, "pv": 50})
+    # the samples are passed to the tiers by the writer thread
+    directory = os.path.join(str(tmp_path), "archive", "1h")
+    assert os.listdir(directory) == []
+    archive.write()
+    assert len(os.listdir(directory)) == 1
+    assert len(archive.read("1h", START, START + 2 * 24 * 60 * 60)) == 2 * 24 - 1
+    archive.close()
@@ -0,0 +1,45 @@
+import json
+import pytest
+from config import load_config, SiteConfig, DEFAULT_DERIVED
+
+
+def write_config(tmp_path, data) -> str:
+    filename = str(tmp_path / "config.json")
+    with open(filename, "w") as file:
+        json.dump(data, file)
+    return filename
+
+
+def test_multiple_sites_are_parsed(tmp_path):
+    config = load_config(write_config(tmp_path, {
+        "port": 8343,
+        "directory": "/etc/energy",
+        "push_deadband": 5,
+        "sites": [
+            {"name": "house", "provider": "http://10.1.11.92", "pv": "http://10.1.11.91", "pv_channels": ["http://10.1.11.93", "http://10.1.11.94"], "min_pv_power": 300},
+            {"name": "garage", "provider": "http://10.1.12.92", "pv": "http://10.1.12.91", "derived": {},
+             "loads": [{"name": "heater", "relay": "http://10.1.12.95", "on_watt": 2200, "off_watt": 0, "min_on_sec": 600}]}
+        ]}))
+    assert (config.port, config.directory, config.ingestion, config.push_deadband, config.push_min_interval_sec) == (8343, "/etc/energy", "poll", 5, 0)
+    assert config.sites[0] == SiteConfig(name="house", provider="http://10.1.11.92", pv="http://10.1.11.91", pv_channels=["http://10.1.11.93", "http://10.1.11.94"], min_pv_power=300)
+    assert config.sites[0].derived == DEFAULT_DERIVED
+    assert config.sites[1].name == "garage"
+    assert (config.sites[1].pv_channels, config.sites[1].derived, config.sites[1].min_pv_power) == ([], {}, 400)
+    assert config.sites[1].loads[0]["relay"] == "http://10.1.12.95"
+
+
+def test_sites_are_required(tmp_path):
+    with pytest.raises(ValueError, match="does not define any site"):
+        load_config(write_config(tmp_path, {"port": 8343, "directory": "/etc/energy", "sites": []}))
+
+
+def test_site_names_are_unique(tmp_path):
+    site = {"name": "house", "provider": "http://10.1.11.92", "pv": "http://10.1.11.91"}
+    with pytest.raises(ValueError, match="duplicated site names"):
+        load_config(write_config(tmp_path, {"port": 8343, "directory": "/etc/energy", "sites": [site, site]}))
+
+
+def test_unknown_site_keys_are_rejected(tmp_path):
+    site = {"name": "house", "provider": "http://10.1.11.92", "pv": "http://10.1.11.91", "min_pv_watt": 300}
+    with pytest.raises(ValueError, match="unknown key min_pv_watt in site house"):
+        load_config(write_config(tmp_path, {"port": 8343, "directory": "/etc/energy", "sites": [site]}))
@@ -0,0 +1,71 @@
+from time import sleep
+from datetime import datetime
+from shelly import Measure
+from poller import Sample
+from energy import Energy
+from control import LoadController, LoadRule, SimulatedRelay
+from replay import ReplayPoller
+
+
+def test_loads_are_switched_off_while_the_provider_is_stale(tmp_path, clock):
+    poller = ReplayPoller()
+    energy = Energy("http://provider", "http://pv", [], str(tmp_path), 400, "poll", poller)
+    on_samples = poller.listener("provider", "pv")
+    relay = SimulatedRelay(2000)
+    controller = LoadController(energy, [LoadRule("load", "simulated", on_watt=1500, off_watt=0, min_on_sec=300, min_off_sec=60)], {"load": relay})
+
+    # exporting 2000 watt
+    for _ in range(30):
+        on_samples({"provider": Sample(Measure(-2000), datetime.utcnow()), "pv": Sample(Measure(3000), datetime.utcnow())})
+        clock.advance(1)
+    assert controller.states["load"]
+
+    # the provider meter is not reachable. The load is switched off before min_on_sec has passed and kept off
+    for _ in range(12):
+        on_samples({"pv": Sample(Measure(3000), datetime.utcnow())})
+        clock.advance(1)
+    assert not controller.states["load"]
+    for _ in range(120):
+        on_samples({"pv": Sample(Measure(3000), datetime.utcnow())})
+        clock.advance(1)
+    assert not controller.states["load"]
+    controller.close()
+    energy.stop()
+    assert [on for _, on in relay.switched] == [True, False]
+
+
+class FlakyRelay(SimulatedRelay):
+
+    # fails every third switch. The failed switch does not change the load
+
+    def __init__(self, power: int):
+        super().__init__(power)
+        self.num_switches = 0
+
+    def switch(self, on: bool):
+        self.num_switches += 1
+        sleep(0.001)
+        if self.num_switches % 3 == 0:
+            raise Exception("relay not reachable")
+        super().switch(on)
+
+
+def test_failed_switches_are_reverted_consistently(tmp_path, clock):
+    poller = ReplayPoller()
+    energy = Energy("http://provider", "http://pv", [], str(tmp_path), 400, "poll", poller)
+    on_samples = poller.listener("provider", "pv")
+    relay = FlakyRelay(2000)
+    controller = LoadController(energy, [LoadRule("load", "simulated", signal="pv_surplus_power", on_watt=1500, off_watt=0, min_on_sec=0, min_off_sec=0)], {"load": relay})
+
+    # the relay threads revert failed switches while the ticks keep deciding
+    for num in range(600):
+        provider = -2000 if (num // 3) % 2 == 0 else 500
+        on_samples({"provider": Sample(Measure(provider), datetime.utcnow()), "pv": Sample(Measure(3000), datetime.utcnow())})
+        clock.advance(1)
+        if num % 7 == 0:
+            sleep(0.002)
+    controller.close()
+    energy.stop()
+    assert relay.num_switches > 100
+    # the state of the controller matches the load as switched by the last successful request
+    assert controller.states["load"] == relay.is_on
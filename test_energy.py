@@ -0,0 +1,514 @@
+import json
+import asyncio
+from datetime import datetime
+from threading import Thread
+from time import sleep
+from typing import List, Tuple, Callable, Any, Dict, Optional
+from tornado.concurrent import Future
+from tornado.httpclient import AsyncHTTPClient, HTTPResponse
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+from tornado.web import Application
+from shelly import Measure, EnergyCounters
+from poller import Sample, CounterSample
+from webthing import Value, Thing
+from energy import Energy, AGGREGATES
+from energy_webthing import EnergyThing, LazyValue, PublishGroup
+from push import BatchedPush
+from history import HistoryHandler
+from replay import ReplayPoller, ImmediateLoop
+
+
+
+def test_snapshots_are_consistent_under_concurrent_writers_and_readers(tmp_path):
+    poller = ReplayPoller()
+    energy = Energy("http://provider", "http://pv", ["http://pv_channel1", "http://pv_channel2", "http://pv_channel3"], str(tmp_path), 400, "poll", poller)
+    on_samples = poller.listener("provider", "pv")
+    on_channel_samples = poller.listener("pv_channel1", "pv_channel2", "pv_channel3")
+    num_rounds = 3000
+    is_writing = [True, True]
+    errors: List[str] = list()
+
+    def write_samples():
+        # the provider and pv values of a round are equal. A snapshot mixing rounds has different values
+        for power in range(1, num_rounds + 1):
+            on_samples({"provider": Sample(Measure(power), datetime.utcnow()), "pv": Sample(Measure(power), datetime.utcnow())})
+        is_writing[0] = False
+
+    def write_channel_samples():
+        for power in range(1, num_rounds + 1):
+            on_channel_samples({"pv_channel" + str(num): Sample(Measure(power), datetime.utcnow()) for num in range(1, 4)})
+        is_writing[1] = False
+
+    def read():
+        version = 0
+        while any(is_writing):
+            snapshot = energy.snapshot
+            if snapshot.version < version:
+                errors.append("version went backwards " + str(version) + " -> " + str(snapshot.version))
+            version = snapshot.version
+            if snapshot.provider_power != snapshot.pv_power or snapshot.consumption_power != 2 * snapshot.pv_power:
+                errors.append("torn provider/pv values " + str(snapshot))
+            if len(set(snapshot.pv_power_channels)) != 1:
+                errors.append("torn channel values " + str(snapshot))
+
+    threads = [Thread(target=write_samples), Thread(target=write_channel_samples)] + [Thread(target=read) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    energy.stop()
+
+    assert errors == []
+    # each round has changed the snapshot once. No update got lost
+    assert energy.snapshot.version == 2 * num_rounds
+    assert energy.snapshot.provider_power == energy.snapshot.pv_power == num_rounds
+    assert energy.snapshot.pv_power_channels == (num_rounds, num_rounds, num_rounds)
+
+
+def test_single_phase_meter_has_no_phase_values(tmp_path, clock):
+    poller = ReplayPoller()
+    energy = Energy("http://provider", "http://pv", [], str(tmp_path), 400, "poll", poller)
+    on_samples = poller.listener("provider", "pv")
+
+    # single phase meters report the total as channel a
+    on_samples({"provider": Sample(Measure(1500, 1500), datetime.utcnow()), "pv": Sample(Measure(0), datetime.utcnow())})
+    assert energy.snapshot.provider_power == 1500
+    assert not energy.has_provider_phases
+    assert (energy.provider_power_phase_a, energy.provider_power_phase_b, energy.provider_power_phase_c) == (None, None, None)
+    assert energy.provider_power_phase_imbalance == 0
+    assert energy.provider_power_phase_15s("a") == 0
+
+    on_samples({"provider": Sample(Measure(1500, 1000, 300, 200), datetime.utcnow()), "pv": Sample(Measure(0), datetime.utcnow())})
+    assert energy.has_provider_phases
+    assert (energy.provider_power_phase_a, energy.provider_power_phase_b, energy.provider_power_phase_c) == (1000, 300, 200)
+    clock.advance(60)
+    assert energy.provider_power_phase_imbalance == 800
+    energy.stop()
+
+
+def test_counter_samples(tmp_path, clock):
+    poller = ReplayPoller()
+    energy = Energy("http://provider", "http://pv", [], str(tmp_path), 400, "poll", poller)
+    on_counter_samples = poller.listener("provider_counters", "pv_counters")
+
+    on_counter_samples({"provider_counters": CounterSample(EnergyCounters(1000.4, 200.7), datetime.utcnow()), "pv_counters": CounterSample(EnergyCounters(500), datetime.utcnow())})
+    clock.advance(60)
+    on_counter_samples({"provider_counters": CounterSample(EnergyCounters(1100.2, 230.9), datetime.utcnow()), "pv_counters": CounterSample(EnergyCounters(580), datetime.utcnow())})
+    assert energy.counter_energy_current_day("grid_import") == 100
+    assert energy.counter_energy_current_day("grid_export") == 30
+    assert energy.counter_energy_current_day("pv_yield") == 80
+    assert energy.counter_energy_current_day("self_consumption") == 50
+
+    # meters without energy counters provide no sample
+    clock.advance(60)
+    on_counter_samples({})
+    assert energy.counter_energy_current_day("grid_import") == 100
+    energy.stop()
+
+
+def test_stale_provider_is_not_recorded(tmp_path, clock):
+    poller = ReplayPoller()
+    energy = Energy("http://provider", "http://pv", [], str(tmp_path), 400, "poll", poller)
+    on_samples = poller.listener("provider", "pv")
+    ticks: List[bool] = list()
+    energy.add_tick_listener(lambda snapshot: ticks.append(energy.provider_stale))
+
+    start = int(clock.epoch())
+    for _ in range(120):
+        on_samples({"provider": Sample(Measure(900, 300, 300, 300), datetime.utcnow()), "pv": Sample(Measure(200), datetime.utcnow())})
+        clock.advance(1)
+    assert energy.provider_power_1m == 900
+    assert energy.consumption_power_1m == 1100
+
+    # the provider meter is not reachable anymore. The pv meter still is
+    stale_start = int(clock.epoch())
+    for _ in range(120):
+        on_samples({"pv": Sample(Measure(200), datetime.utcnow())})
+        clock.advance(1)
+    assert energy.provider_stale and not energy.pv_stale
+    assert energy.snapshot.provider_power == 900     # the last value is kept, but flagged as stale
+    assert (energy.provider_power_1m, energy.consumption_power_1m, energy.pv_surplus_power_1m, energy.pv_effective_power_1m) == (0, 0, 0, 0)
+    assert energy.provider_power_phase_imbalance == 0
+    assert energy.pv_power_1m == 200
+    # ticks continue, flagged as stale
+    assert ticks[-1] and not ticks[0]
+    energy.stop()
+    archived = [epoch_sec for epoch_sec, _ in energy.archived_samples("1s", start, int(clock.epoch()))]
+    assert len(archived) > 0
+    assert max(archived) < stale_start + 11
+
+
+def test_backfill_horizon(tmp_path, clock):
+    poller = ReplayPoller()
+    fetched = list()
+
+    def records(from_epoch_sec: int, to_epoch_sec: int):
+        fetched.append(from_epoch_sec)
+        return []
+
+    energy = Energy("http://provider", "http://pv", [], str(tmp_path), 400, "poll", poller, records=records)
+    on_samples = poller.listener("provider", "pv")
+
+    def run(seconds: int, with_provider: bool = True):
+        for _ in range(seconds):
+            samples = {"pv": Sample(Measure(200), datetime.utcnow())}
+            if with_provider:
+                samples["provider"] = Sample(Measure(900), datetime.utcnow())
+            on_samples(samples)
+            clock.advance(1)
+
+    run(90)
+    assert energy.backfill_horizon_epoch_sec == int(clock.epoch() - 1) // 60 * 60
+    gap_start = int(clock.epoch() - 1) // 60 * 60
+    # the buckets of an open gap and of a gap to be backfilled may still be rewritten
+    run(180, with_provider=False)
+    assert energy.backfill_horizon_epoch_sec == gap_start
+    run(60)
+    assert energy.backfill_horizon_epoch_sec == gap_start
+    # the records are fetched 70 sec after the gap has been closed (on a worker thread)
+    run(20)
+    for _ in range(100):
+        if energy.backfill_horizon_epoch_sec != gap_start:
+            break
+        sleep(0.01)
+        run(1)
+    assert fetched == [gap_start]
+    assert energy.backfill_horizon_epoch_sec == int(clock.epoch() - 1) // 60 * 60
+    energy.stop()
+
+
+def test_stale_pv_channels_are_not_recorded(tmp_path, clock):
+    poller = ReplayPoller()
+    energy = Energy("http://provider", "http://pv", ["http://pv_channel1", "http://pv_channel2"], str(tmp_path), 400, "poll", poller)
+    on_samples = poller.listener("provider", "pv")
+    on_channel_samples = poller.listener("pv_channel1", "pv_channel2")
+
+    on_channel_samples({"pv_channel1": Sample(Measure(120), datetime.utcnow()), "pv_channel2": Sample(Measure(80), datetime.utcnow())})
+    for _ in range(120):
+        on_samples({"provider": Sample(Measure(900), datetime.utcnow()), "pv": Sample(Measure(200), datetime.utcnow())})
+        clock.advance(1)
+    assert (energy.pv_power_channel_15s(1), energy.pv_power_channel_15s(2)) == (120, 80)
+
+    # the pv meter is not reachable anymore
+    for _ in range(120):
+        on_samples({"provider": Sample(Measure(900), datetime.utcnow())})
+        clock.advance(1)
+    assert energy.pv_stale
+    assert (energy.pv_power_15s, energy.pv_power_channel_15s(1), energy.pv_power_channel_15s(2)) == (0, 0, 0)
+    energy.stop()
+
+
+def test_gaps_to_be_backfilled_survive_a_restart(tmp_path, clock):
+    fetched = list()
+
+    def records(from_epoch_sec: int, to_epoch_sec: int):
+        fetched.append((from_epoch_sec, to_epoch_sec))
+        return []
+
+    def start() -> Tuple[Energy, Callable]:
+        poller = ReplayPoller()
+        energy = Energy("http://provider", "http://pv", [], str(tmp_path), 400, "poll", poller, records=records)
+        on_samples = poller.listener("provider", "pv")
+
+        def run(seconds: int, with_provider: bool = True):
+            for _ in range(seconds):
+                samples = {"pv": Sample(Measure(200), datetime.utcnow())}
+                if with_provider:
+                    samples["provider"] = Sample(Measure(900), datetime.utcnow())
+                on_samples(samples)
+                clock.advance(1)
+        return energy, run
+
+    def wait_for_backfill(energy: Energy, run: Callable, num_fetched: int):
+        run(70)
+        for _ in range(100):
+            if len(fetched) >= num_fetched and energy.backfill_horizon_epoch_sec == int(clock.epoch() - 1) // 60 * 60:
+                break
+            sleep(0.01)
+            run(1)
+
+    # stopped before the gap has been backfilled
+    energy, run = start()
+    run(90)
+    gap_start = int(clock.epoch() - 1) // 60 * 60
+    run(180, with_provider=False)
+    run(10)
+    energy.stop()
+    energy, run = start()
+    assert energy.backfill_horizon_epoch_sec == gap_start
+    wait_for_backfill(energy, run, 1)
+    assert [from_epoch_sec for from_epoch_sec, _ in fetched] == [gap_start]
+    energy.stop()
+
+    # the downtime is a gap as well. It is backfilled starting with the last minute measured
+    last_minute = energy.history("provider", "minute", clock.epoch() - 3600, clock.epoch())[-1][0]
+    clock.advance(600)
+    energy, run = start()
+    assert energy.backfill_horizon_epoch_sec == last_minute
+    wait_for_backfill(energy, run, 2)
+    assert fetched[1][0] == last_minute
+    energy.stop()
+    energy, _ = start()
+    assert energy.backfill_horizon_epoch_sec == int(clock.epoch()) // 60 * 60
+    energy.stop()
+
+
+class FakeSubscriber:
+
+    # websocket of a thing subscriber
+
+    def __init__(self):
+        self.updates: List[Tuple[str, Any]] = list()
+
+    def update_property(self, property_):
+        self.updates.append((property_.name, property_.get_value()))
+
+
+def test_lazy_value_is_computed_on_read(clock):
+    computed = list()
+    value = LazyValue(0)
+    assert value.get() == 0      # unbound, like Value
+    updates = list()
+    value.on("update", updates.append)
+    value.bind(lambda: computed.append(len(computed)) or len(computed) * 100, 3)
+
+    # the initial value is valid for ttl_sec
+    clock.advance(1)
+    assert value.get() == 0
+    clock.advance(3)
+    assert value.get() == 100
+    # memoized for ttl_sec
+    clock.advance(2)
+    assert value.get() == 100
+    assert len(computed) == 1
+    clock.advance(2)
+    assert value.get() == 200
+    assert updates == [100, 200]
+
+
+def test_publish_group_publishes_the_changed_dependencies(clock):
+    group = PublishGroup(3)
+    power = Value(0)
+    day = Value(0)
+    smoothen = Value(0)
+    state = {"power": 1, "day": 1, "smoothen": 1}
+    group.add(power, lambda _: state["power"], {"provider_power"})
+    group.add(day, lambda _: state["day"], {AGGREGATES})
+    group.add(smoothen, lambda _: state["smoothen"])
+
+    group.publish({"provider_power"}, None)
+    assert (power.get(), day.get(), smoothen.get()) == (1, 0, 1)
+
+    # changes within the interval are collected and published together
+    state = {"power": 2, "day": 2, "smoothen": 2}
+    clock.advance(1)
+    group.publish({AGGREGATES}, None)
+    assert (power.get(), day.get(), smoothen.get()) == (1, 0, 1)
+    clock.advance(3)
+    group.publish(set(), None)
+    assert (power.get(), day.get(), smoothen.get()) == (1, 2, 2)
+
+
+def test_skipped_lazy_values_are_published_later(clock):
+    group = PublishGroup(0)
+    eager = Value(0)
+    lazy = LazyValue(0)
+    state = {"eager": 1, "lazy": 1}
+    group.add(eager, lambda _: state["eager"], {AGGREGATES})
+    group.add(lazy, lambda _: state["lazy"], {AGGREGATES})
+
+    group.publish({AGGREGATES}, None, skip_lazy=True)
+    assert (eager.get(), lazy.last_value) == (1, 0)
+    # no further change. The skipped change is published once skip_lazy is off (first subscriber)
+    clock.advance(1)
+    group.publish(set(), None, skip_lazy=True)
+    assert lazy.last_value == 0
+    clock.advance(1)
+    group.publish(set(), None)
+    assert lazy.last_value == 1
+    # published once only
+    state["lazy"] = 2
+    clock.advance(1)
+    group.publish(set(), None)
+    assert lazy.last_value == 1
+
+
+def test_lazy_thing_pushes_aggregates_to_the_first_subscriber(tmp_path, clock):
+    poller = ReplayPoller()
+    energy = Energy("http://provider", "http://pv", [], str(tmp_path), 400, "poll", poller)
+    on_samples = poller.listener("provider", "pv")
+    thing = EnergyThing("test", energy, push_window_sec=0, lazy=True)
+    thing.ioloop = ImmediateLoop()
+
+    for _ in range(120):
+        on_samples({"provider": Sample(Measure(900), datetime.utcnow()), "pv": Sample(Measure(200), datetime.utcnow())})
+        clock.advance(1)
+    assert thing.pv_power_current_hour.last_value == 0    # not computed so far
+
+    subscriber = FakeSubscriber()
+    thing.add_subscriber(subscriber)
+    clock.advance(61)
+    thing.on_value_changed(set())
+    pushed = dict(subscriber.updates)
+    assert pushed["pv_current_hour"] == energy.pv_power_current_hour > 0
+    energy.stop()
+
+
+class QueuedLoop:
+
+    # replaces the ioloop of EnergyThing. The callbacks are run on demand
+
+    def __init__(self):
+        self.callbacks: List[Tuple[Callable, Any]] = list()
+
+    def add_callback(self, callback, *args):
+        self.callbacks.append((callback, args))
+
+    def run(self):
+        callbacks = self.callbacks
+        self.callbacks = list()
+        for callback, args in callbacks:
+            callback(*args)
+
+
+def test_thing_publishes_the_changed_properties_once_per_callback(tmp_path, clock):
+    poller = ReplayPoller()
+    energy = Energy("http://provider", "http://pv", ["http://pv_channel1", "http://pv_channel2"], str(tmp_path), 400, "poll", poller)
+    on_samples = poller.listener("provider", "pv")
+    on_channel_samples = poller.listener("pv_channel1", "pv_channel2")
+    thing = EnergyThing("test", energy, push_window_sec=0, derived={"pv_channel1u2": [1, 2]})
+    loop = QueuedLoop()
+    thing.ioloop = loop
+    subscriber = FakeSubscriber()
+    thing.add_subscriber(subscriber)
+    on_samples({"provider": Sample(Measure(900), datetime.utcnow()), "pv": Sample(Measure(200), datetime.utcnow())})
+    on_channel_samples({"pv_channel1": Sample(Measure(120), datetime.utcnow()), "pv_channel2": Sample(Measure(80), datetime.utcnow())})
+    loop.run()
+
+    # a burst of notifications of the measure threads is published by a single callback
+    subscriber.updates.clear()
+    clock.advance(1)
+    for power in [130, 140, 150]:
+        on_channel_samples({"pv_channel1": Sample(Measure(power), datetime.utcnow()), "pv_channel2": Sample(Measure(80), datetime.utcnow())})
+    assert len(loop.callbacks) == 1
+    loop.run()
+    # only the properties depending on the changed channel are published
+    assert dict(subscriber.updates) == {"pv_channel1": 150, "pv_channel1u2": 230}
+    energy.stop()
+
+
+class FakeWebSocket:
+
+    # websocket of a subscriber of a thing with batched pushes
+
+    def __init__(self):
+        self.messages: List[Dict[str, Any]] = list()
+        self.in_flight: Optional[Future] = None    # None: written immediately
+
+    def write_message(self, message: str) -> Optional[Future]:
+        self.messages.append(json.loads(message)["data"])
+        return self.in_flight
+
+
+def test_batched_push_coalesces_the_changes_of_a_client(clock):
+    thing = Thing("urn:dev:ops:test", "test")
+    websocket = FakeWebSocket()
+    thing.add_subscriber(websocket)
+    push = BatchedPush(thing, min_interval_sec=1, deadband=5)
+    push.notify("power", 100)
+    push.notify("state", "on")
+    push.flush()
+    assert websocket.messages == [{"power": 100, "state": "on"}]
+
+    # the changes within the min interval are merged into the next message
+    for power, state in [(200, "on"), (300, "off")]:
+        clock.advance(0.25)
+        push.notify("power", power)
+        push.notify("state", state)
+        push.flush()
+    assert len(websocket.messages) == 1
+    clock.advance(0.5)
+    push.flush()
+    assert websocket.messages[-1] == {"power": 300, "state": "off"}
+
+    # changes within the deadband compared with the value sent are not pushed. A pending change returning into the
+    # deadband is dropped
+    clock.advance(1)
+    push.notify("power", 304)
+    push.notify("state", "on")
+    push.flush()
+    assert websocket.messages[-1] == {"state": "on"}
+    clock.advance(0.25)
+    push.notify("power", 310)
+    push.flush()
+    push.notify("power", 302)
+    clock.advance(1)
+    push.flush()
+    assert len(websocket.messages) == 3
+
+    # a client with a pending write gets the merged changes once the write is done
+    websocket.in_flight = Future()
+    push.notify("power", 400)
+    clock.advance(1)
+    push.flush()
+    push.notify("power", 500)
+    clock.advance(1)
+    push.flush()
+    assert websocket.messages[-1] == {"power": 400}
+    websocket.in_flight.set_result(None)
+    websocket.in_flight = None
+    clock.advance(1)
+    push.flush()
+    assert websocket.messages[-1] == {"power": 500}
+
+
+def fetch(energy: Energy, path: str, headers: Dict[str, str] = None) -> HTTPResponse:
+    async def run() -> HTTPResponse:
+        sock, port = bind_unused_port()
+        server = HTTPServer(Application([(r'/history/?', HistoryHandler, dict(energies={"energy": energy}))]))
+        server.add_sockets([sock])
+        try:
+            return await AsyncHTTPClient().fetch("http://127.0.0.1:" + str(port) + path, headers=headers, raise_error=False)
+        finally:
+            server.stop()
+    return asyncio.run(run())
+
+
+def test_history_of_closed_buckets_is_cached_up_to_the_backfill_horizon(tmp_path, clock):
+    poller = ReplayPoller()
+    energy = Energy("http://provider", "http://pv", [], str(tmp_path), 400, "poll", poller, records=lambda from_epoch_sec, to_epoch_sec: [])
+    on_samples = poller.listener("provider", "pv")
+
+    def run(seconds: int, with_provider: bool = True):
+        for _ in range(seconds):
+            samples = {"pv": Sample(Measure(200), datetime.utcnow())}
+            if with_provider:
+                samples["provider"] = Sample(Measure(900), datetime.utcnow())
+            on_samples(samples)
+            clock.advance(1)
+
+    def cache_control(from_epoch_sec: int, to_epoch_sec: int) -> str:
+        response = fetch(energy, "/history?series=provider&resolution=minute&from=" + str(from_epoch_sec) + "&to=" + str(to_epoch_sec))
+        assert response.code == 200
+        return response.headers["Cache-Control"]
+
+    start = int(clock.epoch())
+    run(150)
+    assert cache_control(start, start + 60) == "public, max-age=86400"
+    assert cache_control(start, int(clock.epoch())) == "no-cache"
+
+    # the buckets of the provider gap are backfilled later. They are not cached, even if closed
+    gap_start = int(clock.epoch() - 1) // 60 * 60
+    run(180, with_provider=False)
+    run(10)
+    assert energy.backfill_horizon_epoch_sec == gap_start
+    assert cache_control(start, gap_start - 60) == "public, max-age=86400"
+    assert cache_control(start, gap_start + 60) == "no-cache"
+
+    # an unchanged history is not sent again
+    path = "/history?series=provider&resolution=minute&from=" + str(start) + "&to=" + str(start + 120)
+    response = fetch(energy, path)
+    assert response.headers["Etag"] is not None
+    assert fetch(energy, path, {"If-None-Match": response.headers["Etag"]}).code == 304
+    energy.stop()
@@ -0,0 +1,91 @@
+from time import sleep, monotonic
+from threading import Event
+from typing import List, Optional, Dict
+from shelly import Meter, Measure
+from poller import Poller
+
+
+class CountingMeter(Meter):
+
+    def __init__(self):
+        self.num_measures = 0
+
+    def measure(self) -> Optional[Measure]:
+        self.num_measures += 1
+        return Measure(self.num_measures)
+
+
+class BlockingMeter(Meter):
+
+    # a stalled meter. The requests block until released
+
+    def __init__(self):
+        self.num_measures = 0
+        self.released = Event()
+
+    def measure(self) -> Optional[Measure]:
+        self.num_measures += 1
+        self.released.wait(5)
+        return Measure(self.num_measures)
+
+
+def test_stop_returns_after_the_last_listener_call():
+    poller = Poller()
+    in_listener = Event()
+    calls: List[int] = list()
+
+    def on_samples(samples):
+        in_listener.set()
+        sleep(0.3)
+        calls.append(len(samples))
+        in_listener.clear()
+
+    poller.schedule(0.05, {"meter": CountingMeter()}, on_samples)
+    # a long period does not delay the stop
+    poller.schedule(60, {"counters": CountingMeter()}, lambda samples: None)
+    poller.start()
+    assert in_listener.wait(2)
+    start = monotonic()
+    poller.stop()
+    assert monotonic() - start < 1
+    assert not in_listener.is_set()
+    num_calls = len(calls)
+    assert num_calls > 0
+    sleep(0.5)
+    assert len(calls) == num_calls
+
+
+def test_stop_of_a_poller_not_started():
+    Poller().stop()
+
+
+def test_stalled_meter_does_not_delay_the_other_meters():
+    # the poller runs on the loop time of asyncio, so real (short) periods are used instead of the virtual clock
+    poller = Poller()
+    stalled = BlockingMeter()
+    rounds: List[Dict[str, int]] = list()
+    times: List[float] = list()
+
+    def on_samples(samples):
+        rounds.append({name: sample.measure.total for name, sample in samples.items()})
+        times.append(monotonic())
+
+    poller.schedule(0.05, {"stalled": stalled, "meter": CountingMeter()}, on_samples)
+    poller.start()
+    try:
+        sleep(0.6)
+        # a single pending request of the stalled meter. The other meter keeps its cadence
+        assert stalled.num_measures == 1
+        assert len(rounds) >= 6
+        assert all(["meter" in samples and "stalled" not in samples for samples in rounds])
+        assert max([later - earlier for earlier, later in zip(times, times[1:])]) < 0.2
+
+        # once released, the stalled meter is polled again
+        num_rounds = len(rounds)
+        stalled.released.set()
+        sleep(0.3)
+        assert any(["stalled" in samples for samples in rounds[num_rounds:]])
+        assert stalled.num_measures > 1
+    finally:
+        stalled.released.set()
+        poller.stop()
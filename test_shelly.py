@@ -0,0 +1,211 @@
+import json
+import pytest
+from time import sleep, monotonic
+from threading import Thread, current_thread
+from urllib.parse import urlparse, parse_qs
+from typing import List
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from shelly import RetryPolicy, ShellyMeter, Shelly3em, CircuitOpenError, UnexpectedResponseError
+
+
+class FakeShelly:
+
+    # local Pro3EM. The next responses can be scripted as (status, body, delay sec). Without script it answers regularly
+
+    def __init__(self):
+        self.script: List[tuple] = list()
+        self.requests: List[str] = list()
+        self.down = False
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                fake.requests.append(self.path)
+                if self.path.startswith("/shelly"):
+                    status, body, delay = 200, json.dumps({"app": "Pro3EM", "gen": 2}), 0
+                elif self.path.startswith("/rpc/EMData.GetData"):
+                    status, body, delay = 200, json.dumps(fake.records_page(self.path)), 0
+                elif fake.down:
+                    status, body, delay = 503, "<html>rebooting</html>", 0
+                elif len(fake.script) > 0:
+                    status, body, delay = fake.script.pop(0)
+                else:
+                    status, body, delay = 200, json.dumps({"total_act_power": 1200.4, "a_act_power": 400.1, "b_act_power": 400.2, "c_act_power": 400.1}), 0
+                if delay > 0:
+                    sleep(delay)
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.end_headers()
+                    self.wfile.write(body.encode("UTF-8"))
+                except OSError:
+                    pass    # client gave up
+
+            def log_message(self, format, *args):
+                pass
+
+        self.__server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.__server.daemon_threads = True
+        self.addr = "http://127.0.0.1:" + str(self.__server.server_address[1])
+        Thread(target=self.__server.serve_forever, daemon=True).start()
+
+    @staticmethod
+    def records_page(path: str) -> dict:
+        # per minute records, 10 per page. Each phase imports 1 Wh and exports 0.5 Wh per minute
+        query = parse_qs(urlparse(path).query)
+        ts = int(query["ts"][0])
+        end_ts = int(query["end_ts"][0])
+        num = min(10, (end_ts - ts) // 60 + 1)
+        page = {"keys": ["a_total_act_energy", "a_total_act_ret_energy", "b_total_act_energy", "b_total_act_ret_energy", "c_total_act_energy", "c_total_act_ret_energy"],
+                "data": [{"ts": ts, "period": 60, "values": [[1, 0.5, 1, 0.5, 1, 0.5]] * num}]}
+        if ts + num * 60 <= end_ts:
+            page["next_record_ts"] = ts + num * 60
+        return page
+
+    def measure_requests(self) -> int:
+        return len([path for path in self.requests if path.startswith("/rpc/EM.GetStatus")])
+
+    def close(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+
+@pytest.fixture
+def fake():
+    fake = FakeShelly()
+    yield fake
+    fake.close()
+
+
+FAST = RetryPolicy(max_tries=3, connect_timeout_sec=1, read_timeout_sec=0.3, backoff_sec=0.01, max_backoff_sec=0.05, latency_budget_sec=2, failure_threshold=2, open_circuit_sec=0.5)
+
+
+def test_measure(fake):
+    measure = Shelly3em(fake.addr, FAST).measure()
+    assert (measure.total, measure.channel_a, measure.channel_b, measure.channel_c) == (1200, 400, 400, 400)
+
+
+def test_retries_transient_errors(fake):
+    fake.script = [(500, "internal error", 0), (200, "{}", 0.5)]     # error, then a timed out read
+    measure = Shelly3em(fake.addr, FAST).measure()
+    assert measure.total == 1200
+    assert fake.measure_requests() == 3
+
+
+def test_gives_up_after_max_tries(fake):
+    fake.down = True
+    with pytest.raises(Exception):
+        Shelly3em(fake.addr, FAST).measure()
+    assert fake.measure_requests() == FAST.max_tries
+
+
+def test_latency_budget(fake):
+    # each try times out. The budget ends the retries before max_tries is reached
+    policy = RetryPolicy(max_tries=10, read_timeout_sec=0.3, backoff_sec=0.01, max_backoff_sec=0.05, latency_budget_sec=0.8)
+    fake.script = [(200, "{}", 1)] * 10
+    start = monotonic()
+    with pytest.raises(Exception):
+        Shelly3em(fake.addr, policy).measure()
+    elapsed = monotonic() - start
+    assert elapsed < policy.latency_budget_sec + 0.3
+    assert fake.measure_requests() < policy.max_tries
+
+
+def test_circuit_opens_and_recovers(fake):
+    meter = ShellyMeter(fake.addr, FAST)
+    assert meter.measure().total == 1200
+
+    fake.down = True
+    for _ in range(FAST.failure_threshold):
+        with pytest.raises(Exception):
+            meter.measure()
+    assert meter.circuit_breaker.is_open
+
+    # open: rejected without calling the device
+    num_requests = fake.measure_requests()
+    with pytest.raises(CircuitOpenError):
+        meter.measure()
+    assert fake.measure_requests() == num_requests
+
+    # half open: a failed trial opens the circuit again
+    sleep(FAST.open_circuit_sec + 0.1)
+    with pytest.raises(Exception) as error:
+        meter.measure()
+    assert not isinstance(error.value, CircuitOpenError)
+    assert fake.measure_requests() > num_requests
+    with pytest.raises(CircuitOpenError):
+        meter.measure()
+
+    # half open: a successful trial closes the circuit
+    fake.down = False
+    sleep(FAST.open_circuit_sec + 0.1)
+    assert meter.measure().total == 1200
+    assert not meter.circuit_breaker.is_open
+    assert meter.measure().total == 1200
+
+
+def test_transient_errors_keep_the_device(fake):
+    meter = ShellyMeter(fake.addr, FAST)
+    assert meter.measure().total == 1200
+    for status, body in [(503, "<html>rebooting</html>"), (401, '{"code": 401}'), (200, "<html>truncat")]:
+        fake.script = [(status, body, 0)] * FAST.max_tries
+        with pytest.raises(Exception) as error:
+            meter.measure()
+        assert not isinstance(error.value, UnexpectedResponseError)
+        assert meter.device is not None
+        meter.circuit_breaker.on_success()
+    assert meter.measure().total == 1200
+    assert len([path for path in fake.requests if path.startswith("/shelly")]) == 1
+
+
+def test_unexpected_payload_triggers_redetection(fake):
+    meter = ShellyMeter(fake.addr, FAST)
+    assert meter.measure().total == 1200
+    fake.script = [(200, json.dumps({"apower": 300}), 0)] * FAST.max_tries
+    with pytest.raises(UnexpectedResponseError):
+        meter.measure()
+    assert meter.device is None
+    assert meter.measure().total == 1200
+    assert len([path for path in fake.requests if path.startswith("/shelly")]) == 2
+
+
+def test_records_and_polling_run_concurrently(fake):
+    # the backfill fetches the records on its own thread while the device is polled
+    device = Shelly3em(fake.addr, FAST)
+    errors: List[str] = list()
+    sessions = dict()
+
+    def poll():
+        for _ in range(100):
+            measure = device.measure()
+            if measure.total != 1200:
+                errors.append("unexpected measure " + str(measure))
+        sessions[current_thread().name] = device._session
+
+    def backfill():
+        for _ in range(5):
+            records = device.records(1780000000, 1780000000 + 59 * 60)
+            if [record.time for record in records] != [1780000000 + minute * 60 for minute in range(60)]:
+                errors.append("unexpected records " + str(records))
+        sessions[current_thread().name] = device._session
+
+    threads = [Thread(target=poll, name="poll" + str(num)) for num in range(3)] + [Thread(target=backfill, name="backfill")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    # each thread has used a session of its own
+    assert len({id(session) for session in sessions.values()}) == len(threads)
+
+
+def test_backoff_bounds():
+    policy = RetryPolicy(backoff_sec=0.5, max_backoff_sec=4)
+    for num_try in range(0, 8):
+        delay = min(4, 0.5 * 2 ** num_try)
+        for _ in range(200):
+            backoff = policy.backoff(num_try)
+            assert delay / 2 <= backoff <= delay
+    # jittered
+    assert len({policy.backoff(3) for _ in range(20)}) > 1
@@ -0,0 +1,86 @@
+import pytest
+from datetime import datetime, timezone
+from energy import WattRecorder
+from timebase import Timebase, Calendar, Clock, SECONDS_PER_DAY
+
+
+class FakeClock(Clock):
+
+    # the wall clock may be stepped independently of the monotonic one (e.g. by NTP)
+
+    def __init__(self, epoch_sec: float):
+        self.monotonic_sec = 1000.0
+        self.epoch_sec = epoch_sec
+
+    def monotonic(self) -> float:
+        return self.monotonic_sec
+
+    def epoch(self) -> float:
+        return self.epoch_sec
+
+    def advance(self, sec: float):
+        self.monotonic_sec += sec
+        self.epoch_sec += sec
+
+
+def utc(*args) -> float:
+    return datetime(*args, tzinfo=timezone.utc).timestamp()
+
+
+@pytest.fixture
+def clock(use_clock):
+    return use_clock(FakeClock(utc(2026, 6, 1, 12)))
+
+
+@pytest.mark.parametrize("step_sec", [-3600, -30, 30, 3600])
+def test_wall_clock_step_does_not_skew_the_integration(clock, step_sec):
+    recorder = WattRecorder()
+    for sec in range(120):
+        recorder.put(1000 if sec < 60 else 2000)
+        clock.advance(1)
+        if sec == 90:
+            clock.epoch_sec += step_sec
+    assert recorder.watt_per_hour(minute_range=1) == 2000
+    assert recorder.watt_per_hour(minute_range=2) == 1500
+    assert recorder.watt_per_hour(second_range=15) == 2000
+
+
+def test_calendar_day_rollover():
+    clock = FakeClock(utc(2026, 6, 1, 23, 59, 59))
+    calendar_timebase = Timebase(clock)
+    calendar = calendar_timebase.calendar()
+    assert calendar.day == int(utc(2026, 6, 1)) // SECONDS_PER_DAY
+    assert calendar.hour_of_day(clock.epoch()) == 23
+    clock.advance(1)
+    calendar = calendar_timebase.calendar()
+    assert calendar.day == int(utc(2026, 6, 2)) // SECONDS_PER_DAY
+    assert calendar.day_start_epoch == utc(2026, 6, 2)
+    assert calendar.hour_of_day(clock.epoch()) == 0
+    assert calendar.year == 2026
+
+
+def test_calendar_year_rollover():
+    clock = FakeClock(utc(2026, 12, 31, 23, 59, 59))
+    calendar_timebase = Timebase(clock)
+    assert calendar_timebase.calendar().year == 2026
+    assert calendar_timebase.calendar().year_start_day == int(utc(2026, 1, 1)) // SECONDS_PER_DAY
+    clock.advance(1)
+    calendar = calendar_timebase.calendar()
+    assert calendar.year == 2027
+    assert calendar.year_start_day == calendar.day == int(utc(2027, 1, 1)) // SECONDS_PER_DAY
+
+
+def test_calendar_follows_a_clock_step_backwards():
+    clock = FakeClock(utc(2027, 1, 1, 0, 0, 10))
+    calendar_timebase = Timebase(clock)
+    assert calendar_timebase.calendar().year == 2027
+    clock.epoch_sec -= 20
+    calendar = calendar_timebase.calendar()
+    assert (calendar.year, calendar.day) == (2026, int(utc(2026, 12, 31)) // SECONDS_PER_DAY)
+
+
+def test_calendar_is_utc_based():
+    # the buckets do not follow DST changes (e.g. 2026-03-29 in Europe). Each day has 24 hours
+    for day in range(int(utc(2026, 3, 27)) // SECONDS_PER_DAY, int(utc(2026, 11, 2)) // SECONDS_PER_DAY):
+        calendar = Calendar.of(day * SECONDS_PER_DAY + 5)
+        assert calendar.hour_of_day(day * SECONDS_PER_DAY + SECONDS_PER_DAY - 1) == 23
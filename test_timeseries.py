@@ -0,0 +1,129 @@
+import random
+import pytest
+from datetime import datetime, timezone
+from timeseries import TimeSeries, RollingSum
+from energy import AggregatedPower
+from peeks import PeekHourIndex
+from forecast import SeasonalProfile
+from replay import VirtualClock, Trace, Replay
+from timebase import timebase, SECONDS_PER_DAY
+
+
+@pytest.fixture
+def clock(use_clock):
+    return use_clock(VirtualClock(datetime(2026, 12, 30, 22, 0, tzinfo=timezone.utc).timestamp()))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_rolling_sum_matches_resumming(tmp_path, seed):
+    rnd = random.Random(seed)
+    series = TimeSeries("test", str(tmp_path), resolution_sec=60, capacity=50)
+    rolling_sum = RollingSum(series)
+    from_bucket, to_bucket = 1000, 1010
+    for _ in range(2000):
+        operation = rnd.random()
+        if operation < 0.4:
+            # slide forward, now and then with a gap, a jump or backwards
+            step = rnd.choice([0, 1, 1, 1, 2, 5, 30, 80, -3])
+            width = rnd.choice([to_bucket - from_bucket, rnd.randint(0, 40)])
+            to_bucket += step
+            from_bucket = to_bucket - width
+            rolling_sum.move(from_bucket, to_bucket)
+        else:
+            # put a new or replaced value in or near the range. Buckets not put are gaps
+            bucket = rnd.randint(from_bucket - 5, to_bucket + 2)
+            value = rnd.randint(-2000, 6000)
+            rolling_sum.update(bucket, series.put(bucket, value), value)
+        items = series.items(from_bucket, to_bucket)
+        assert rolling_sum.sum_and_count(from_bucket, to_bucket) == (series.sum(from_bucket, to_bucket), len(items))
+    series.close()
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_aggregates_match_resumming_across_year_rollover(tmp_path, clock, seed):
+    rnd = random.Random(seed)
+    aggregated_power = AggregatedPower("test", str(tmp_path))
+    end = clock.epoch() + 2 * SECONDS_PER_DAY
+    while clock.epoch() < end:
+        # measured each 29..31 sec. Outages leave the minute buckets empty
+        clock.advance(rnd.choice([29, 30, 31, 30, 30, 30, 600]))
+        aggregated_power.measure(rnd.randint(0, 5000))
+
+        now = timebase.epoch()
+        calendar = timebase.calendar()
+        hour_start = int(now) // 3600 * 3600
+        minutes = aggregated_power.history("minute", hour_start - 59 * 60 + 60 * (int(now) % 3600 // 60), now)
+        assert aggregated_power.power_current_hour == int(sum([power for _, power in minutes]) / 60)
+        hours = aggregated_power.history("hour", calendar.day_start_epoch, hour_start - 3600)
+        assert aggregated_power.power_current_day == sum([power for _, power in hours])
+        days = aggregated_power.history("day", calendar.year_start_day * SECONDS_PER_DAY, now)
+        assert aggregated_power.power_current_year == sum([power for _, power in days])
+        if len(days) > 0:
+            assert aggregated_power.power_estimated_year == int(sum([power for _, power in days]) * 365 / len(days))
+    # the year has changed. The days of the former year are not part of the current one
+    assert timebase.calendar().year == 2027
+    assert len(aggregated_power.history("day", datetime(2026, 12, 30, tzinfo=timezone.utc).timestamp(), timebase.epoch())) == 3
+
+
+def test_peek_hour_index_follows_the_changed_peeks_and_the_day(tmp_path, clock):
+    series = TimeSeries("peeks", str(tmp_path), resolution_sec=SECONDS_PER_DAY, capacity=60)
+    index = PeekHourIndex(series, window_days=3, half_life_days=1)
+    assert index.percentile(50) == 12    # default hour, no peeks so far
+    today = timebase.calendar().day
+    index.put(today - 3, 8)     # out of the window
+    index.put(today - 2, 10)
+    index.put(today - 1, 11)
+    index.put(today, 13)
+    assert index.hours == [10, 11, 13]
+
+    # a changed peek of the day replaces the former one
+    index.put(today, 14)
+    assert index.hours == [10, 11, 14]
+    assert (index.percentile(0), index.percentile(50), index.percentile(99)) == (10, 11, 14)
+    # the recent days weigh more
+    assert (index.percentile(30), index.weighted_percentile(30)) == (10, 11)
+
+    # the window slides with the day
+    clock.advance(SECONDS_PER_DAY)
+    assert index.hours == [11, 14]
+    series.close()
+
+
+def test_seasonal_profile_is_refreshed_by_the_new_hourly_bucket(clock):
+    current_hour = int(clock.epoch()) // 3600
+    values = {hour * 3600: 1000 for hour in range(current_hour - 48, current_hour)}
+    requested = list()
+
+    def hourly(from_epoch_sec: float, to_epoch_sec: float):
+        requested.append((from_epoch_sec, to_epoch_sec))
+        return [(epoch_sec, value) for epoch_sec, value in sorted(values.items()) if from_epoch_sec <= epoch_sec <= to_epoch_sec]
+
+    # without persistence the forecast is the profile
+    profile = SeasonalProfile(hourly, lambda: 0, alpha=0.5, warmup_days=2, persistence_sec=1)
+    forecast = profile.forecast(24, 3600)
+    assert {power for _, power in forecast} == {1000}
+    # the forecast is cached within the hour
+    clock.advance(600)
+    assert profile.forecast(24, 3600) is forecast
+    assert len(requested) == 1
+
+    # on the next hour the closed hourly bucket only is merged into the profile
+    values[current_hour * 3600] = 3000
+    clock.advance(3600)
+    forecast = dict(profile.forecast(24, 3600))
+    assert requested[-1] == (current_hour * 3600, current_hour * 3600)
+    assert forecast[(current_hour + 24) * 3600] == 2000
+    assert {power for epoch_sec, power in forecast.items() if epoch_sec != (current_hour + 24) * 3600} == {1000}
+
+
+def test_day_total_includes_the_last_hour(tmp_path, use_clock):
+    # constant consumption of 1000 watt from 22:00 until 00:30 of the next day
+    start = datetime(2026, 6, 1, 22, 0, tzinfo=timezone.utc).timestamp()
+    replay = Replay(Trace([start], {"provider": [1000], "pv": [0]}), str(tmp_path))
+    replay.run(2.5 * 3600)
+    day_start = int(start) // SECONDS_PER_DAY * SECONDS_PER_DAY
+    hours = replay.energy.history("consumption", "hour", day_start, day_start + SECONDS_PER_DAY - 1)
+    assert [(epoch_sec - day_start) // 3600 for epoch_sec, _ in hours] == [22, 23]
+    assert replay.energy.history("consumption", "day", day_start, day_start) == [(day_start, sum([power for _, power in hours]))]
+    assert abs(replay.energy.history("consumption", "day", day_start, day_start)[0][1] - 2000) < 40
+    replay.energy.stop()
@@ -0,0 +1,94 @@
+import os
+import sys
+import random
+import signal
+import subprocess
+import pytest
+from wal import WriteAheadLog
+from timeseries import TimeSeries
+
+
+CAPACITY = 200000
+
+# writes bucket * 7 per bucket. Each committed bucket is reported, checkpoints happen every few hundred milliseconds
+WRITER = """
+import sys
+from wal import WriteAheadLog
+from timeseries import TimeSeries
+wal = WriteAheadLog(sys.argv[1], commit_period_sec=0.05, checkpoint_period_sec=0.3)
+series = TimeSeries("series", sys.argv[1], resolution_sec=60, capacity=""" + str(CAPACITY) + """, wal=wal)
+for bucket in range(0, """ + str(CAPACITY) + """):
+    series.put(bucket, bucket * 7)
+    if bucket % 50 == 0:
+        wal.commit()
+        print(bucket, flush=True)
+"""
+
+
+def recover(directory: str):
+    wal = WriteAheadLog(directory, commit_period_sec=3600)
+    series = TimeSeries("series", directory, resolution_sec=60, capacity=CAPACITY, wal=wal)
+    return wal, series
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_kill_during_write(tmp_path, seed):
+    directory = str(tmp_path)
+    writer = subprocess.Popen([sys.executable, "-c", WRITER, directory], stdout=subprocess.PIPE, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)))
+    # killed after a random number of commits, while writing
+    num_commits = random.Random(seed).randint(20, 1500)
+    committed = -1
+    for _ in range(num_commits):
+        committed = int(writer.stdout.readline())
+    os.kill(writer.pid, signal.SIGKILL)
+    writer.wait()
+
+    wal, series = recover(directory)
+    items = series.items(0, CAPACITY - 1)
+    assert [value for _, value in items] == [bucket * 7 for bucket, _ in items]
+    # no committed value is lost. Values not reported as committed may be present
+    assert len(items) >= committed + 1
+    assert [bucket for bucket, _ in items] == list(range(0, len(items)))
+    wal.close()
+
+
+def test_torn_log_tail_is_ignored(tmp_path):
+    directory = str(tmp_path)
+    wal, series = recover(directory)
+    for bucket in range(100):
+        series.put(bucket, bucket * 7)
+    wal.commit()
+    with open(wal.filename, "ab") as file:
+        file.write(os.urandom(11))
+    # not closed (no checkpoint), as on a crash
+    wal, series = recover(directory)
+    assert series.items(0, 1000) == [(bucket, bucket * 7) for bucket in range(100)]
+    assert os.path.getsize(wal.filename) == 100 * WriteAheadLog.RECORD.size
+    wal.close()
+
+
+def test_series_file_is_written_on_checkpoint_only(tmp_path):
+    directory = str(tmp_path)
+    wal, series = recover(directory)
+    with open(series.filename, "rb") as file:
+        before = file.read()
+    series.put(12345, 99)
+    wal.commit()
+    with open(series.filename, "rb") as file:
+        assert file.read() == before
+    wal.checkpoint()
+    assert os.path.getsize(wal.filename) == 0
+    wal.close()
+    reopened = TimeSeries("series", directory, resolution_sec=60, capacity=CAPACITY)
+    assert reopened.get(12345) == 99
+    reopened.close()
+
+
+def test_append_after_close_is_rejected(tmp_path):
+    wal = WriteAheadLog(str(tmp_path), commit_period_sec=0.01)
+    series_id = wal.register("test", lambda bucket, value: None, lambda: None)
+    wal.append(series_id, 1, 100)
+    wal.close()
+    with pytest.raises(ValueError):
+        wal.append(series_id, 2, 200)
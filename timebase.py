@@ -0,0 +1,70 @@
+import time
+from dataclasses import dataclass
+from datetime import date, timedelta
+
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+EPOCH = date(1970, 1, 1)
+
+
+class Clock:
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def epoch(self) -> float:
+        return time.time()
+
+
+@dataclass(frozen=True)
+class Calendar:
+    # utc calendar context of a day. All buckets are utc based, so DST changes do not apply
+    day: int                  # epoch day
+    day_start_epoch: int
+    year: int
+    year_start_day: int       # epoch day of january 1st
+
+    def hour_of_day(self, epoch_sec: float) -> int:
+        return int(epoch_sec - self.day_start_epoch) // 3600
+
+    def contains(self, epoch_sec: float) -> bool:
+        return self.day_start_epoch <= epoch_sec < self.day_start_epoch + SECONDS_PER_DAY
+
+    @staticmethod
+    def of(epoch_sec: float):
+        day = int(epoch_sec) // SECONDS_PER_DAY
+        year = (EPOCH + timedelta(days=day)).year
+        return Calendar(day, day * SECONDS_PER_DAY, year, (date(year, 1, 1) - EPOCH).days)
+
+
+class Timebase:
+
+    # monotonic timestamps are used to integrate and to measure durations (immune against NTP clock steps). The wall
+    # clock is used for calendar buckets only. Its calendar context is cached and recomputed on a day change or clock step
+
+    def __init__(self, clock: Clock = Clock()):
+        self.__clock = clock
+        self.__calendar = Calendar.of(clock.epoch())
+
+    def set_clock(self, clock: Clock):
+        self.__clock = clock
+        self.__calendar = Calendar.of(clock.epoch())
+
+    def monotonic(self) -> float:
+        return self.__clock.monotonic()
+
+    def epoch(self) -> float:
+        return self.__clock.epoch()
+
+    def calendar(self, epoch_sec: float = None) -> Calendar:
+        if epoch_sec is None:
+            epoch_sec = self.__clock.epoch()
+        calendar = self.__calendar
+        if not calendar.contains(epoch_sec):
+            calendar = Calendar.of(epoch_sec)
+            self.__calendar = calendar
+        return calendar
+
+
+timebase = Timebase()
@@ -0,0 +1,161 @@
+import os
+import logging
+from time import monotonic
+from typing import List, Tuple, Optional, Set
+from metrics import storage_sync_seconds
+from wal import WriteAheadLog
+
+
+class TimeSeries:
+
+    # Fixed-width ring of slots. Each slot consists of two int32: the bucket number (epoch based, e.g. epoch minute) and
+    # the value of the bucket. A slot holding an other bucket number than requested is treated as empty. The slots are
+    # held in process memory and loaded from the file on start. A flush writes the pages holding changed slots in place,
+    # so the file is written on flush only (unlike a shared mapping, which the kernel writes back every few seconds).
+    # If a write ahead log is given, puts are logged and flush is called on checkpoints of the log only
+
+    SLOT_SIZE = 8
+    PAGE_SIZE = 4096
+
+    def __init__(self, name: str, directory: str, resolution_sec: int, capacity: int, sync_period_sec: int = 60, wal: Optional[WriteAheadLog] = None):
+        self.resolution_sec = resolution_sec
+        self.capacity = capacity
+        self.__sync_period_sec = sync_period_sec
+        self.__last_time_synced = monotonic()
+        if not os.path.exists(directory):
+            logging.info("directory " + directory + " does not exits. Creating it")
+            os.makedirs(directory)
+        self.filename = os.path.join(directory, name + ".ts")
+        self.is_new = not os.path.isfile(self.filename)
+        size = capacity * self.SLOT_SIZE
+        with open(self.filename, "a+b") as file:
+            if os.path.getsize(self.filename) != size:
+                if not self.is_new:
+                    logging.warning(self.filename + " has an unexpected size. Resetting it")
+                file.truncate(0)
+                file.truncate(size)
+        self.__file = open(self.filename, "r+b")
+        self.__data = bytearray(self.__file.read())
+        self.__slots = memoryview(self.__data).cast('i')
+        self.__dirty_pages: Set[int] = set()
+        logging.info("time series: using " + self.filename + " (" + str(capacity) + " slots of " + str(resolution_sec) + " sec)")
+        self.__wal = wal
+        if wal is not None:
+            self.__series_id = wal.register(name, self.__apply, self.flush)
+
+    def bucket_of(self, epoch_sec: float) -> int:
+        return int(epoch_sec) // self.resolution_sec
+
+    def put(self, bucket: int, value: int) -> Optional[int]:
+        # returns the replaced value of the bucket, if any
+        idx = (bucket % self.capacity) * 2
+        old_value = self.__slots[idx + 1] if self.__slots[idx] == bucket else None
+        self.__slots[idx + 1] = value
+        self.__slots[idx] = bucket
+        self.__dirty_pages.add(idx * 4 // self.PAGE_SIZE)
+        if self.__wal is not None:
+            self.__wal.append(self.__series_id, bucket, value)
+        elif monotonic() > self.__last_time_synced + self.__sync_period_sec:
+            self.flush()
+        return old_value
+
+    def __apply(self, bucket: int, value: int):
+        # recovery of a logged put
+        idx = (bucket % self.capacity) * 2
+        self.__slots[idx + 1] = value
+        self.__slots[idx] = bucket
+        self.__dirty_pages.add(idx * 4 // self.PAGE_SIZE)
+
+    def get(self, bucket: int, default_value: Optional[int] = None) -> Optional[int]:
+        idx = (bucket % self.capacity) * 2
+        if self.__slots[idx] == bucket:
+            return self.__slots[idx + 1]
+        else:
+            return default_value
+
+    def items(self, from_bucket: int, to_bucket: int) -> List[Tuple[int, int]]:
+        # buckets from_bucket..to_bucket (inclusive) holding a value
+        from_bucket = max(from_bucket, to_bucket - self.capacity + 1)
+        slots = self.__slots
+        capacity = self.capacity
+        items = list()
+        for bucket in range(from_bucket, to_bucket + 1):
+            idx = (bucket % capacity) * 2
+            if slots[idx] == bucket:
+                items.append((bucket, slots[idx + 1]))
+        return items
+
+    def sum(self, from_bucket: int, to_bucket: int) -> int:
+        return sum([value for _, value in self.items(from_bucket, to_bucket)])
+
+    def flush(self):
+        # a put concurrent to a flush may be written by the next flush only. With a write ahead log, its record is
+        # logged behind the checkpoint
+        start = monotonic()
+        dirty_pages = self.__dirty_pages
+        self.__dirty_pages = set()
+        try:
+            if len(dirty_pages) > 0:
+                fileno = self.__file.fileno()
+                for page in sorted(dirty_pages):
+                    offset = page * self.PAGE_SIZE
+                    os.pwrite(fileno, self.__data[offset:offset + self.PAGE_SIZE], offset)
+                os.fsync(fileno)
+        except Exception as e:
+            self.__dirty_pages.update(dirty_pages)
+            logging.warning("error occurred flushing " + self.filename + " " + str(e))
+        self.__last_time_synced = monotonic()
+        storage_sync_seconds.observe(self.__last_time_synced - start, "timeseries")
+
+    def close(self):
+        self.flush()
+        self.__slots.release()
+        self.__file.close()
+
+
+class RollingSum:
+
+    # Sum and count of the values of a time series within a bucket range. Moving the range forward and replacing a
+    # bucket value are O(1) (amortized), instead of re-summing the range
+
+    def __init__(self, series: TimeSeries):
+        self.__series = series
+        self.__state = (0, -1, 0, 0)    # from bucket, to bucket, sum, count. Replaced as a whole to support concurrent readers
+
+    def move(self, from_bucket: int, to_bucket: int):
+        current_from, current_to, total, count = self.__state
+        if from_bucket == current_from and to_bucket == current_to:
+            return
+        if from_bucket < current_from or to_bucket < current_to or from_bucket > current_to + 1:
+            total, count = self.__compute(from_bucket, to_bucket)
+        else:
+            for bucket in range(current_from, from_bucket):
+                value = self.__series.get(bucket)
+                if value is not None:
+                    total -= value
+                    count -= 1
+            for bucket in range(current_to + 1, to_bucket + 1):
+                value = self.__series.get(bucket)
+                if value is not None:
+                    total += value
+                    count += 1
+        self.__state = (from_bucket, to_bucket, total, count)
+
+    def update(self, bucket: int, old_value: Optional[int], new_value: int):
+        from_bucket, to_bucket, total, count = self.__state
+        if from_bucket <= bucket <= to_bucket:
+            if old_value is None:
+                self.__state = (from_bucket, to_bucket, total + new_value, count + 1)
+            else:
+                self.__state = (from_bucket, to_bucket, total + new_value - old_value, count)
+
+    def sum_and_count(self, from_bucket: int, to_bucket: int) -> Tuple[int, int]:
+        current_from, current_to, total, count = self.__state
+        if from_bucket == current_from and to_bucket == current_to:
+            return total, count
+        else:
+            return self.__compute(from_bucket, to_bucket)
+
+    def __compute(self, from_bucket: int, to_bucket: int) -> Tuple[int, int]:
+        items = self.__series.items(from_bucket, to_bucket)
+        return sum([value for _, value in items]), len(items)
@@ -0,0 +1,128 @@
+import os
+import struct
+import logging
+from zlib import crc32
+from threading import Thread, Lock, Event
+from time import monotonic
+from typing import List, Dict, Tuple, Callable
+from metrics import storage_sync_seconds
+
+
+class WriteAheadLog:
+
+    # One log for all time series of a directory. A put is appended to an in-memory buffer, which is written and
+    # fsync'ed as a whole once per commit period (group commit). So at most the last commit period is lost on power
+    # loss. The series files are written on checkpoint only, afterwards the log is truncated.
+    # Record: uint32 series id, int32 bucket, int32 value, uint32 crc32 of the preceding 12 bytes
+
+    RECORD = struct.Struct("<IiiI")
+
+    def __init__(self, directory: str, commit_period_sec: float = 2, checkpoint_period_sec: float = 60 * 60):
+        self.__commit_period_sec = commit_period_sec
+        self.__checkpoint_period_sec = checkpoint_period_sec
+        self.__lock = Lock()
+        self.__buffer: List[bytes] = list()
+        self.__series: Dict[int, Tuple[str, Callable[[int, int], None], Callable[[], None]]] = dict()
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.filename = os.path.join(directory, "series.wal")
+        self.__recovered = self.__recover()
+        self.__file = open(self.filename, "ab")
+        self.__last_checkpoint = monotonic()
+        self.__is_closed = False
+        self.__stopped = Event()
+        self.__commit_thread = Thread(target=self.__commit_loop, daemon=True)
+        self.__commit_thread.start()
+
+    def __recover(self) -> Dict[int, List[Tuple[int, int]]]:
+        recovered: Dict[int, List[Tuple[int, int]]] = dict()
+        if not os.path.isfile(self.filename):
+            return recovered
+        with open(self.filename, "rb") as file:
+            data = file.read()
+        valid_size = 0
+        for offset in range(0, len(data) - self.RECORD.size + 1, self.RECORD.size):
+            series_id, bucket, value, checksum = self.RECORD.unpack_from(data, offset)
+            if checksum != crc32(data[offset:offset + 12]):
+                break
+            recovered.setdefault(series_id, list()).append((bucket, value))
+            valid_size = offset + self.RECORD.size
+        if valid_size < len(data):
+            # torn write of the last commit
+            logging.warning(self.filename + " ignoring " + str(len(data) - valid_size) + " bytes of an incomplete commit")
+            with open(self.filename, "r+b") as file:
+                file.truncate(valid_size)
+        logging.info("write ahead log: " + str(valid_size // self.RECORD.size) + " records recovered from " + self.filename)
+        return recovered
+
+    @staticmethod
+    def series_id(name: str) -> int:
+        return crc32(name.encode("UTF-8"))
+
+    def register(self, name: str, apply: Callable[[int, int], None], flush: Callable[[], None]) -> int:
+        # apply(bucket, value) is called for each record logged since the last checkpoint, flush() on checkpoint
+        series_id = self.series_id(name)
+        with self.__lock:
+            self.__series[series_id] = (name, apply, flush)
+            for bucket, value in self.__recovered.pop(series_id, []):
+                apply(bucket, value)
+        return series_id
+
+    def append(self, series_id: int, bucket: int, value: int):
+        head = struct.pack("<Iii", series_id, bucket, value)
+        with self.__lock:
+            if self.__is_closed:
+                raise ValueError(self.filename + " is closed")
+            self.__buffer.append(head + struct.pack("<I", crc32(head)))
+
+    def commit(self):
+        with self.__lock:
+            self.__commit()
+
+    def __commit(self):
+        if len(self.__buffer) == 0 or self.__is_closed:
+            return
+        start = monotonic()
+        try:
+            self.__file.write(b"".join(self.__buffer))
+            self.__file.flush()
+            os.fsync(self.__file.fileno())
+            self.__buffer = list()
+        except Exception as e:
+            logging.warning("error occurred committing " + self.filename + " " + str(e))
+        storage_sync_seconds.observe(monotonic() - start, "wal_commit")
+
+    def checkpoint(self):
+        # writers are blocked while the series are synced, so no record gets lost by truncating the log
+        with self.__lock:
+            if self.__is_closed:
+                return
+            start = monotonic()
+            self.__commit()
+            try:
+                for _, _, flush in self.__series.values():
+                    flush()
+                self.__file.truncate(0)
+                self.__file.seek(0)
+                os.fsync(self.__file.fileno())
+                self.__recovered = dict()
+            except Exception as e:
+                logging.warning("error occurred on checkpoint of " + self.filename + " " + str(e))
+            self.__last_checkpoint = monotonic()
+            storage_sync_seconds.observe(self.__last_checkpoint - start, "wal_checkpoint")
+
+    def __commit_loop(self):
+        while not self.__stopped.wait(self.__commit_period_sec):
+            if monotonic() > self.__last_checkpoint + self.__checkpoint_period_sec:
+                self.checkpoint()
+            else:
+                self.commit()
+
+    def close(self):
+        # the writers have to be stopped before. The commit thread is stopped first, so the final checkpoint is the last write
+        self.__stopped.set()
+        self.__commit_thread.join()
+        self.checkpoint()
+        with self.__lock:
+            self.__is_closed = True
+            self.__file.close()